@@ -1,9 +1,15 @@
 from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_sqlalchemy import SQLAlchemy
+from .cache import query_cache
+from .instrumentation import instrumentation
+from .lead_matrix import LeadMatrixIndex
+from .page_cache import page_cache
+from .profiler import sampling_profiler
 
 bootstrap = Bootstrap()
 db = SQLAlchemy()
+lead_matrix_index = LeadMatrixIndex()
 
 
 def create_app(config):
@@ -12,8 +18,34 @@ def create_app(config):
     app.config.from_object(config)
     bootstrap.init_app(app)
     db.init_app(app)
+    lead_matrix_index.init_app(app)
+    query_cache.init_app(app)
+    page_cache.init_app(app)
+    instrumentation.init_app(app)
+    sampling_profiler.init_app(app)
+
+    from .catalog import catalog_index
+    catalog_index.init_app(app)
+
+    from .recommender import strategy_dispatcher
+    strategy_dispatcher.init_app(app)
+
+    from .neighbour_search import sharded_search
+    sharded_search.init_app(app)
+
+    from .lead_writer import lead_writer
+    lead_writer.init_app(app)
+
+    from .lead_delta import lead_delta
+    lead_delta.init_app(app)
+
+    from .refresher import recommendation_refresher
+    recommendation_refresher.init_app(app)
 
     from . import main
     app.register_blueprint(main.main)
 
+    from .pool import database_pool
+    database_pool.init_app(app)
+
     return app
@@ -0,0 +1,234 @@
+import re
+import numpy as np
+from scipy import sparse
+from typing import Dict, Iterator, List, Tuple
+from sqlalchemy import Index, MetaData, Table, UniqueConstraint
+from sqlalchemy.sql import text
+from . import db
+from .lead_matrix import LeadMatrix, lead_matrix_lock
+from .similarity import top_k_similarities
+
+TOKEN_PATTERN = re.compile(r'(?u)\b\w\w+\b')
+
+
+def stream_rows(query: str, chunk_size: int = 10000, **params) -> Iterator[List]:
+    """Executes a query with a server side cursor and yields its rows in chunks
+
+    :param query: Query to database
+    :param chunk_size: Number of rows of each chunk
+    :param params: Query parameters
+    :return: Iterator of lists of rows
+    """
+    result = db.engine.execution_options(stream_results=True).execute(text(query), **params)
+
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            yield rows
+    finally:
+        result.close()
+
+
+def tf_idf(documents: List[str]) -> sparse.csr_matrix:
+    """Creates the TF-IDF matrix of some documents. Rows are normalized, so their dot product is the cosine
+        similarity
+
+    :param documents: Documents text
+    :return: A sparse matrix with one row per document and one column per term
+    """
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+
+    for document in documents:
+        for token in TOKEN_PATTERN.findall((document or '').lower()):
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        indptr.append(len(indices))
+
+    counts = sparse.csr_matrix((np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr)),
+                               shape=(len(documents), len(vocabulary)))
+    counts.sum_duplicates()
+
+    document_frequency = np.bincount(counts.indices, minlength=len(vocabulary))
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+
+    weights = counts.multiply(idf).tocsr()
+    norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+
+    return sparse.diags(1 / norms).dot(weights).tocsr()
+
+
+class SimilarityBuilder:
+    """Rebuilds the similarity tables read by the course repository and the lead matrix file read by the
+        recommender"""
+
+    def __init__(self, top_k: int = 10, chunk_size: int = 10000, insert_size: int = 1000, item_neighbours: int = 20):
+        """SimilarityBuilder constructor
+
+        :param top_k: Number of similar courses kept for each course
+        :param chunk_size: Number of rows read from database at once
+        :param insert_size: Number of rows of each multi-row insert
+        :param item_neighbours: Number of neighbours of each course stored in the lead matrix file, for item based
+            collaborative filtering. If 0, they are not stored
+        """
+        self.top_k = top_k
+        self.item_neighbours = item_neighbours
+        self.chunk_size = chunk_size
+        self.insert_size = insert_size
+
+    def read_courses(self) -> Tuple[List[str], List[str]]:
+        """Reads the courses in chunks
+
+        :return: The course identifiers and the text of each course
+        """
+        course_ids = []
+        documents = []
+
+        for rows in stream_rows('SELECT id, title, description FROM courses ORDER BY id', self.chunk_size):
+            for row in rows:
+                course_ids.append(str(row['id']))
+                documents.append('{} {}'.format(row['title'] or '', row['description'] or ''))
+
+        return course_ids, documents
+
+    def read_lead_matrix(self, course_columns: Dict[str, int]) -> Tuple[sparse.csr_matrix, List[str]]:
+        """Reads the leads in chunks and creates the user-course lead matrix
+
+        :param course_columns: Column of each course identifier
+        :return: A binary sparse matrix with one row per user and the user identifiers
+        """
+        user_rows = {}
+        rows = []
+        columns = []
+
+        for chunk in stream_rows('SELECT DISTINCT user_id, course_id FROM clean_leads', self.chunk_size):
+            for lead in chunk:
+                column = course_columns.get(str(lead['course_id']))
+                if column is None:
+                    continue
+
+                rows.append(user_rows.setdefault(lead['user_id'], len(user_rows)))
+                columns.append(column)
+
+        matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                                   shape=(len(user_rows), len(course_columns)))
+        matrix.data[:] = 1
+
+        return matrix, list(user_rows.keys())
+
+    def build(self, lead_matrix_file: str):
+        """Rebuilds the content and co-lead similarity tables and the lead matrix file, with the course neighbours
+
+        :param lead_matrix_file: Path where the lead matrix is written
+        """
+        course_ids, documents = self.read_courses()
+        course_columns = {course_id: column for (column, course_id) in enumerate(course_ids)}
+
+        features = tf_idf(documents)
+        content_similarities = top_k_similarities(features, self.top_k)
+        self.load_table('courses_similarities', ('a_course_id', 'another_course_id', 'similarity'),
+                        self.similarity_rows(content_similarities, course_ids))
+
+        lead_matrix, user_ids = self.read_lead_matrix(course_columns)
+        co_lead_similarities = top_k_similarities(lead_matrix.T.tocsr(), self.top_k)
+        self.load_table('recommended_courses_by_leads', ('course', 'recommended'),
+                        (row[:2] for row in self.similarity_rows(co_lead_similarities, course_ids)))
+
+        lead_matrix = LeadMatrix(lead_matrix, user_ids, course_ids)
+        if self.item_neighbours > 0:
+            lead_matrix.item_neighbours(self.item_neighbours)
+
+        with lead_matrix_lock(lead_matrix_file):
+            lead_matrix.save(lead_matrix_file)
+
+    @staticmethod
+    def similarity_rows(similarities: Iterator, course_ids: List[str]) -> Iterator[Tuple]:
+        """Converts the similarities of the matrix indexes to rows of course identifiers
+
+        :param similarities: Iterator returned by `top_k_similarities`
+        :param course_ids: Course identifier of each matrix index
+        :return: Iterator of tuples with the course, the similar course and the similarity
+        """
+        for rows, columns, values in similarities:
+            for row, column, value in zip(rows, columns, values):
+                yield course_ids[row], course_ids[column], float(value)
+
+    def load_table(self, table: str, columns: Tuple, rows):
+        """Loads rows into a new copy of a table and replaces the table with it atomically. The copy has the columns,
+            primary key, unique constraints and indexes of the table
+
+        :param table: Table name
+        :param columns: Column names
+        :param rows: Iterable of row tuples
+        """
+        new_table = '{}_new'.format(table)
+        old_table = '{}_old'.format(table)
+        mysql = db.engine.dialect.name == 'mysql'
+
+        db.engine.execute(text('DROP TABLE IF EXISTS {}'.format(new_table)))
+        if mysql:
+            db.engine.execute(text('CREATE TABLE {} LIKE {}'.format(new_table, table)))
+        else:
+            original = Table(table, MetaData(), autoload=True, autoload_with=db.engine)
+            self.copy_table(original, new_table).create(db.engine)
+
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.insert_size:
+                self.insert(new_table, columns, batch)
+                batch = []
+        self.insert(new_table, columns, batch)
+
+        if mysql:
+            db.engine.execute(text('DROP TABLE IF EXISTS {}'.format(old_table)))
+            db.engine.execute(text('RENAME TABLE {0} TO {1}, {2} TO {0}'.format(table, old_table, new_table)))
+            db.engine.execute(text('DROP TABLE {}'.format(old_table)))
+        else:
+            # Index names are unique per database, so the indexes are created once the table has its final name, after
+            # dropping the indexes of the replaced table
+            with db.engine.begin() as connection:
+                connection.execute(text('DROP TABLE {}'.format(table)))
+                connection.execute(text('ALTER TABLE {} RENAME TO {}'.format(new_table, table)))
+
+                renamed = self.copy_table(original, table)
+                for index in original.indexes:
+                    Index(index.name, *[renamed.c[column.name] for column in index.columns],
+                          unique=index.unique).create(connection)
+
+    @staticmethod
+    def copy_table(table: Table, name: str) -> Table:
+        """Returns the definition of a table with another name, with its columns, primary key and unique constraints
+
+        :param table: Reflected table
+        :param name: Name of the copy
+        :return: The table definition
+        """
+        constraints = [UniqueConstraint(*[column.name for column in constraint.columns])
+                       for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+
+        return Table(name, MetaData(), *([column.copy() for column in table.columns] + constraints))
+
+    @staticmethod
+    def insert(table: str, columns: Tuple, rows: List[Tuple]):
+        """Inserts rows with a single multi-row insert
+
+        :param table: Table name
+        :param columns: Column names
+        :param rows: Row tuples
+        """
+        if len(rows) == 0:
+            return
+
+        values = []
+        params = {}
+        for index, row in enumerate(rows):
+            values.append('({})'.format(', '.join([':{}_{}'.format(column, index) for column in columns])))
+            params.update({'{}_{}'.format(column, index): value for (column, value) in zip(columns, row)})
+
+        insert_sql = 'INSERT INTO {} ({}) VALUES {}'.format(table, ', '.join(columns), ', '.join(values))
+        db.engine.execute(text(insert_sql), **params)
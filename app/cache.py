@@ -0,0 +1,299 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from .instrumentation import instrumentation
+
+
+class MemoryCacheBackend:
+    """In-process cache backend. Keeps up to a maximum number of entries, evicting the least recently used"""
+
+    def __init__(self, max_entries: int = 1024):
+        """MemoryCacheBackend constructor
+
+        :param max_entries: Maximum number of entries
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns a cached value
+
+        :param key: Cache key
+        :return: The cached value or None if it is not cached or it has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_on = entry
+            if expires_on < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+
+            return value
+
+    def set(self, key: str, value: Any, ttl: int):
+        """Caches a value
+
+        :param key: Cache key
+        :param value: Value to cache
+        :param ttl: Seconds during which the value is valid
+        """
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries"""
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCacheBackend:
+    """Cache backend shared by all the worker processes of a host. Entries are pickled into an SQLite file, which
+        is only readable by the user running the application, since unpickling a value can run arbitrary code. The
+        least recently used entries are evicted, with the time of the last access updated at most once per
+        ACCESS_RESOLUTION seconds, so cache hits are not serialized by writes"""
+
+    # Seconds during which the last access time of an entry is not updated
+    ACCESS_RESOLUTION = 30
+
+    def __init__(self, path: str, max_entries: int = 1024):
+        """SharedCacheBackend constructor. The cache file and its directory are created with permissions for the
+            current user only
+
+        :param path: Path to the cache file
+        :param max_entries: Maximum number of entries
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+
+        if os.stat(path).st_uid != os.getuid():
+            raise ValueError('The cache file {} belongs to another user'.format(path))
+        os.chmod(path, 0o600)
+
+        with self.connection() as connection:
+            connection.execute('''CREATE TABLE IF NOT EXISTS cache (
+                                  key TEXT PRIMARY KEY,
+                                  value BLOB NOT NULL,
+                                  expires_on REAL NOT NULL,
+                                  accessed_on REAL NOT NULL)''')
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread to the cache file
+
+        :return: An SQLite connection
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns a cached value
+
+        :param key: Cache key
+        :return: The cached value or None if it is not cached or it has expired
+        """
+        now = time.time()
+        connection = self.connection()
+        row = connection.execute('SELECT value, accessed_on FROM cache WHERE key = ? AND expires_on >= ?',
+                                 (key, now)).fetchone()
+
+        if row is None:
+            return None
+
+        if now - row[1] > self.ACCESS_RESOLUTION:
+            connection.execute('UPDATE cache SET accessed_on = ? WHERE key = ?', (now, key))
+
+        return pickle.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: int):
+        """Caches a value
+
+        :param key: Cache key
+        :param value: Value to cache
+        :param ttl: Seconds during which the value is valid
+        """
+        now = time.time()
+        connection = self.connection()
+        connection.execute('INSERT OR REPLACE INTO cache (key, value, expires_on, accessed_on) VALUES (?, ?, ?, ?)',
+                           (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + ttl, now))
+
+        # Expired entries go first, then the least recently used ones
+        connection.execute('DELETE FROM cache WHERE expires_on < ?', (now,))
+        connection.execute('''DELETE FROM cache WHERE key IN (
+                              SELECT key FROM cache ORDER BY accessed_on DESC LIMIT -1 OFFSET ?)''',
+                           (self.max_entries,))
+
+    def clear(self):
+        """Removes all entries"""
+        self.connection().execute('DELETE FROM cache')
+
+
+class QueryCache:
+    """Cache of repository query responses, keyed on the query and its parameters"""
+
+    BACKEND_MEMORY = 'memory'
+    BACKEND_SHARED = 'shared'
+
+    def __init__(self, app=None):
+        """QueryCache constructor
+
+        :param app: Flask application. If provided, the cache is configured from it
+        """
+        self.backend = None
+        self.ttl = 300
+        self._invalidation_hooks = []
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the cache from the application config. If no backend is configured, nothing is cached
+
+        :param app: Flask application
+        """
+        self.ttl = app.config.get('QUERY_CACHE_TTL', self.ttl)
+        self.backend = self.create_backend('QUERY_CACHE_BACKEND', app.config.get('QUERY_CACHE_BACKEND'),
+                                           app.config.get('QUERY_CACHE_MAX_ENTRIES', 1024),
+                                           app.config.get('QUERY_CACHE_PATH'))
+
+    @classmethod
+    def create_backend(cls, setting: str, backend: Optional[str], max_entries: int, path: str = None):
+        """Creates a cache backend
+
+        :param setting: Name of the config key of the backend, used in the error message
+        :param backend: 'memory', 'shared' or None
+        :param max_entries: Maximum number of entries
+        :param path: Path to the cache file of the shared backend
+        :return: The backend or None if no backend is configured
+        """
+        if backend == cls.BACKEND_MEMORY:
+            return MemoryCacheBackend(max_entries)
+        if backend == cls.BACKEND_SHARED:
+            return SharedCacheBackend(path, max_entries)
+        if backend is not None:
+            raise ValueError('{} must be {} or {}.'.format(setting, cls.BACKEND_MEMORY, cls.BACKEND_SHARED))
+
+        return None
+
+    @property
+    def enabled(self) -> bool:
+        """Returns whether a backend is configured
+
+        :return: True if responses are cached
+        """
+        return self.backend is not None
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Creates a cache key from some values
+
+        :param parts: Values that identify the cached response
+        :return: The cache key
+        """
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns a cached value
+
+        :param key: Cache key
+        :return: The cached value or None if it is not cached, it has expired or the cache is disabled
+        """
+        if not self.enabled:
+            return None
+
+        return self.backend.get(key)
+
+    def set(self, key: str, value: Any, ttl: int = None):
+        """Caches a value
+
+        :param key: Cache key
+        :param value: Value to cache
+        :param ttl: Seconds during which the value is valid. If None, the configured time is used
+        """
+        if self.enabled:
+            self.backend.set(key, value, self.ttl if ttl is None else ttl)
+
+    def on_invalidate(self, hook: Callable):
+        """Registers a function that will be called each time the cache is invalidated
+
+        :param hook: Function without parameters
+        """
+        if hook not in self._invalidation_hooks:
+            self._invalidation_hooks.append(hook)
+
+    def invalidate(self):
+        """Removes all cached responses and calls the invalidation hooks. With the memory backend, only the responses
+            of the current worker are removed, and the other workers serve theirs until they expire"""
+        if self.enabled:
+            self.backend.clear()
+
+        for hook in self._invalidation_hooks:
+            hook()
+
+
+query_cache = QueryCache()
+
+
+def cached_query(build_response: Callable) -> Callable:
+    """Decorator for the `build_response` method of repositories. Responses are cached by repository, query and
+        parameters, together with the row count when the repository is paginated. Cache lookups and the entities
+        built are recorded by the instrumentation
+
+    :param build_response: The `build_response` method
+    :return: The decorated method
+    """
+    @functools.wraps(build_response)
+    def wrapper(repository, query: str, **kwargs):
+        if not query_cache.enabled or not repository.cacheable:
+            response = build_response(repository, query, **kwargs)
+            instrumentation.record_hydrated_rows(len(response))
+
+            return response
+
+        paginator = repository.paginator
+        page = (paginator.offset, paginator.items_per_page) if paginator else None
+        key = query_cache.make_key(type(repository).__name__, query, sorted(kwargs.items()), page)
+
+        cached = query_cache.get(key)
+        instrumentation.record_cache_lookup(cached is not None)
+
+        if cached is not None:
+            response, row_count = cached
+            if paginator:
+                paginator.set_row_count(row_count)
+
+            return response
+
+        response = build_response(repository, query, **kwargs)
+        instrumentation.record_hydrated_rows(len(response))
+        query_cache.set(key, (response, paginator.row_count if paginator else None))
+
+        return response
+
+    return wrapper
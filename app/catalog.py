@@ -0,0 +1,378 @@
+import time
+import threading
+import numpy as np
+from typing import Callable, Dict, List, Tuple
+from .models import Category, Course, CourseRepository, Paginator
+from .search import CourseSearchIndex
+
+
+class CatalogSnapshot:
+    """In-memory snapshot of the listable courses. Course attributes are stored in columnar arrays, with an index
+        permutation for each sort order, grouped by category, so ranked lists are served without querying the
+        database"""
+
+    SORT_LEADS = 'leads'
+    SORT_RATING = 'rating'
+
+    def __init__(self, courses: Dict[str, Course]):
+        """CatalogSnapshot constructor. Builds the arrays and the sort permutations
+
+        :param courses: Collection of listable courses
+        """
+        courses = list(courses.values())
+
+        self.ids = np.array([course.id for course in courses], dtype=object)
+        self.titles = np.array([course.title for course in courses], dtype=object)
+        self.descriptions = np.array([course.description for course in courses], dtype=object)
+        self.centers = np.array([course.center for course in courses], dtype=object)
+        self.category_ids = np.array([course.category_id for course in courses], dtype=np.int64)
+        self.number_of_leads = np.array([course.number_of_leads or 0 for course in courses], dtype=np.int64)
+        self.number_of_reviews = np.array([course.number_of_reviews or 0 for course in courses], dtype=np.int64)
+        self.weighted_rating = np.array([course.weighted_rating or 0.0 for course in courses], dtype=np.float64)
+        self.category_entities = {course.category_id: Category(course.category_id, course.category_name)
+                                  for course in courses}
+        # Rows are found by the identifier of the request, which is a string whatever the column type
+        self.rows = {str(course_id): row for (row, course_id) in enumerate(self.ids)}
+        self.created_on = time.time()
+
+        # Ties are broken by descending identifier, as the database queries do
+        id_rank = np.argsort(np.argsort(self.id_keys(self.ids), kind='stable'), kind='stable')
+        sort_keys = {self.SORT_LEADS: (-id_rank, -self.number_of_reviews, -self.weighted_rating,
+                                       -self.number_of_leads),
+                     self.SORT_RATING: (-id_rank, -self.number_of_leads, -self.number_of_reviews,
+                                        -self.weighted_rating)}
+
+        self.orders = {}
+        self.positions = {}
+        self.category_orders = {}
+        self.category_positions = {}
+        self.categories = np.unique(self.category_ids)
+
+        for sort_by, keys in sort_keys.items():
+            order = np.lexsort(keys)
+            self.orders[sort_by] = order
+            self.positions[sort_by] = self.inverse(order)
+
+            # Stable sort by category keeps each category block in rank order
+            category_order = order[np.argsort(self.category_ids[order], kind='stable')]
+            self.category_orders[sort_by] = category_order
+            self.category_positions[sort_by] = self.inverse(category_order)
+
+        sorted_category_ids = np.sort(self.category_ids)
+        self.category_starts = np.searchsorted(sorted_category_ids, self.categories, side='left')
+        self.category_ends = np.searchsorted(sorted_category_ids, self.categories, side='right')
+
+    @staticmethod
+    def id_keys(ids: np.ndarray) -> np.ndarray:
+        """Returns the sort keys of the course identifiers. Integer identifiers, read from a numeric column, are
+            compared as numbers, and the others as strings
+
+        :param ids: Course identifiers
+        :return: The identifiers as an array of integers or strings
+        """
+        if len(ids) > 0 and all(isinstance(course_id, (int, np.integer)) for course_id in ids):
+            return ids.astype(np.int64)
+
+        return ids.astype(str)
+
+    @staticmethod
+    def inverse(permutation: np.ndarray) -> np.ndarray:
+        """Returns the inverse of a permutation, that is, the position of each row in the permutation
+
+        :param permutation: Index permutation
+        :return: Position of each row
+        """
+        positions = np.empty_like(permutation)
+        positions[permutation] = np.arange(len(permutation))
+
+        return positions
+
+    def ranked(self, sort_by: str, category: int = None) -> Tuple[np.ndarray, np.ndarray, int, int]:
+        """Returns the permutation of rows sorted by a sort order and the slice of a category in it
+
+        :param sort_by: leads|rating
+        :param category: Category identifier. If None, all courses are considered
+        :return: The permutation, the positions of each row in it and the start and end of the slice
+        """
+        if sort_by not in self.orders:
+            raise ValueError('sort_by must be {} or {}.'.format(self.SORT_LEADS, self.SORT_RATING))
+
+        if category is None:
+            return self.orders[sort_by], self.positions[sort_by], 0, len(self.ids)
+
+        index = np.searchsorted(self.categories, category)
+        if index >= len(self.categories) or self.categories[index] != category:
+            return self.orders[sort_by], self.positions[sort_by], 0, 0
+
+        return (self.category_orders[sort_by], self.category_positions[sort_by],
+                self.category_starts[index], self.category_ends[index])
+
+    def count(self, category: int = None) -> int:
+        """Returns the number of listable courses
+
+        :param category: Category identifier. If None, all courses are counted
+        :return: The number of courses
+        """
+        _, _, start, end = self.ranked(self.SORT_LEADS, category)
+
+        return int(end - start)
+
+    def find_sorted(self, sort_by: str, category: int = None, max_rows: int = None, offset: int = 0,
+                    exclude: str = None, after: str = None) -> Dict[str, Course]:
+        """Returns a collection of courses sorted by number of leads or weighted rating
+
+        :param sort_by: leads|rating
+        :param category: Category to which the courses belong
+        :param max_rows: Maximum number of courses to retrieve
+        :param offset: Number of courses to skip
+        :param exclude: Course id excluded from the result
+        :param after: Identifier of the last course of the previous page. If provided, the offset is ignored
+        :return: A collection of courses
+        """
+        order, positions, start, end = self.ranked(sort_by, category)
+
+        if after is not None:
+            after_row = self.rows.get(str(after))
+            if after_row is None:
+                return {}
+            start = max(start, positions[after_row] + 1)
+        else:
+            start += offset
+
+        stop = end if max_rows is None else min(end, start + max_rows + (1 if exclude else 0))
+        rows = [row for row in order[start:stop] if exclude is None or str(self.ids[row]) != str(exclude)]
+
+        if max_rows is not None:
+            rows = rows[:max_rows]
+
+        return self.hydrate(rows)
+
+    def hydrate(self, rows: List[int]) -> Dict[str, Course]:
+        """Builds the course entities of some rows
+
+        :param rows: Row indexes
+        :return: A collection of courses
+        """
+        courses = {}
+
+        for row in rows:
+            category_id = int(self.category_ids[row])
+            course = Course(self.ids[row], self.titles[row],
+                            self.category_entities[category_id],
+                            self.centers[row])
+
+            if self.descriptions[row]:
+                course.set_description(self.descriptions[row])
+
+            course.set_weighted_rating(float(self.weighted_rating[row]))
+            course.set_number_of_reviews(int(self.number_of_reviews[row]))
+            course.set_number_of_leads(int(self.number_of_leads[row]))
+
+            courses[course.id] = course
+
+        return courses
+
+
+class SearchSnapshot:
+    """In-memory search index of every course of the catalog, including the ones that are not listable because of
+        their number of leads or weighted rating, with the courses it returns"""
+
+    def __init__(self, courses: Dict[str, Course]):
+        """SearchSnapshot constructor. Indexes the titles and descriptions of the courses
+
+        :param courses: Collection of courses, sorted by number of leads. Courses with the same search score keep
+            this order
+        """
+        self.courses = list(courses.values())
+        self.search_index = CourseSearchIndex([course.title for course in self.courses],
+                                              [course.description for course in self.courses])
+        self.created_on = time.time()
+
+    def search(self, query: str, max_rows: int = 10, prefix: bool = False) -> Dict[str, Course]:
+        """Returns the courses that best match a search query
+
+        :param query: Text of the query
+        :param max_rows: Maximum number of courses to retrieve
+        :param prefix: If True, the last word of the query also matches the words that start with it
+        :return: A collection of courses, sorted by relevance
+        """
+        rows = self.search_index.search(query, max_rows, prefix).tolist()
+
+        return {self.courses[row].id: self.courses[row] for row in rows}
+
+
+class SnapshotCourseRepository:
+    """Serves the ranked course lists of `CourseRepository` from a catalog snapshot"""
+
+    def __init__(self, snapshot: CatalogSnapshot, paginator: Paginator = None):
+        """SnapshotCourseRepository constructor
+
+        :param snapshot: The catalog snapshot
+        :param paginator: Paginator class. If None, results wont be paginated
+        """
+        self.snapshot = snapshot
+        self.paginator = paginator
+
+    def find_sorted(self, sort_by: str, category: int = None, max_rows: int = None, exclude: str = None,
+                    after: str = None) -> Dict[str, Course]:
+        """Returns a page or a number of courses sorted by a sort order
+
+        :param sort_by: leads|rating
+        :param category: Category to which the courses belong
+        :param max_rows: Maximum number of courses to retrieve
+        :param exclude: Course ids excluded from search
+        :param after: Identifier of the last course of the previous page, to use keyset pagination
+        :return: A collection of courses
+        """
+        offset = 0
+        if self.paginator and not max_rows:
+            self.paginator.set_row_count(self.snapshot.count(category))
+            max_rows = self.paginator.items_per_page
+            offset = self.paginator.offset
+
+        return self.snapshot.find_sorted(sort_by, category, max_rows, offset, exclude, after)
+
+    def find_sorted_by_leads(self, category: int = None,
+                             max_rows: int = None,
+                             exclude: str = None,
+                             after: str = None,
+                             with_description: bool = True) -> Dict[str, Course]:
+        """Returns a collection of courses sorted by number of leads
+
+        :param category: Category to which the courses belong
+        :param max_rows: Maximum number of courses to retrieve
+        :param exclude: Course ids excluded from search
+        :param after: Identifier of the last course of the previous page, to use keyset pagination
+        :param with_description: Unused, descriptions are kept in the snapshot
+        :return: A collection of courses
+        """
+        return self.find_sorted(CatalogSnapshot.SORT_LEADS, category, max_rows, exclude, after)
+
+    def find_sorted_by_rating(self, category: int = None,
+                              max_rows: int = None,
+                              exclude: str = None,
+                              after: str = None,
+                              with_description: bool = True) -> Dict[str, Course]:
+        """Returns a collection of courses sorted by weighted rating
+
+        :param category: Category to which the courses belong
+        :param max_rows: Maximum number of courses to retrieve
+        :param exclude: Course ids excluded from search
+        :param after: Identifier of the last course of the previous page, to use keyset pagination
+        :param with_description: Unused, descriptions are kept in the snapshot
+        :return: A collection of courses
+        """
+        return self.find_sorted(CatalogSnapshot.SORT_RATING, category, max_rows, exclude, after)
+
+
+class CatalogIndex:
+    """Process-wide access point to the catalog snapshot and the search snapshot. Each snapshot is built on first use
+        and rebuilt in the background when it is older than the configured time to live"""
+
+    def __init__(self, app=None):
+        """CatalogIndex constructor
+
+        :param app: Flask application. If provided, the index is configured from it
+        """
+        self.app = None
+        self.enabled = False
+        self.ttl = 600
+        self._snapshot = None
+        self._search_snapshot = None
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the index from the application config
+
+        :param app: Flask application
+        """
+        self.app = app
+        self.enabled = app.config.get('CATALOG_SNAPSHOT_ENABLED', self.enabled)
+        self.ttl = app.config.get('CATALOG_SNAPSHOT_TTL', self.ttl)
+
+    def get(self) -> CatalogSnapshot:
+        """Returns the catalog snapshot. The first call builds it; later calls return the current snapshot and
+            schedule a rebuild if it has expired
+
+        :return: The catalog snapshot
+        """
+        return self.current('_snapshot', self.load)
+
+    def get_search(self) -> SearchSnapshot:
+        """Returns the search snapshot, which is built even if the catalog pages are served from the database. The
+            first call builds it; later calls return the current snapshot and schedule a rebuild if it has expired
+
+        :return: The search snapshot
+        """
+        return self.current('_search_snapshot', self.load_search)
+
+    def current(self, name: str, load: Callable):
+        """Returns a snapshot, building it if it has not been built yet and scheduling a rebuild if it has expired
+
+        :param name: Attribute that holds the snapshot
+        :param load: Function that builds the snapshot
+        :return: The snapshot
+        """
+        snapshot = getattr(self, name)
+
+        if snapshot is None:
+            with self._lock:
+                if getattr(self, name) is None:
+                    setattr(self, name, load())
+
+            return getattr(self, name)
+
+        if time.time() - snapshot.created_on > self.ttl and name not in self._refreshing:
+            with self._lock:
+                if name not in self._refreshing:
+                    self._refreshing.add(name)
+                    threading.Thread(target=self.refresh, args=(name, load), daemon=True).start()
+
+        return snapshot
+
+    def refresh(self, name: str, load: Callable):
+        """Rebuilds a snapshot and replaces the current one
+
+        :param name: Attribute that holds the snapshot
+        :param load: Function that builds the snapshot
+        """
+        try:
+            with self.app.app_context():
+                setattr(self, name, load())
+        finally:
+            self._refreshing.discard(name)
+
+    @staticmethod
+    def load() -> CatalogSnapshot:
+        """Builds a catalog snapshot of the listable courses from the database
+
+        :return: A catalog snapshot
+        """
+        return CatalogSnapshot(CourseRepository().find_all_by())
+
+    @staticmethod
+    def load_search() -> SearchSnapshot:
+        """Builds a search snapshot of every course from the database
+
+        :return: A search snapshot
+        """
+        return SearchSnapshot(CourseRepository().find_all())
+
+    def course_repository(self, paginator: Paginator = None):
+        """Returns the repository that serves the ranked course lists: the snapshot, if it is enabled, or the
+            database
+
+        :param paginator: Paginator class. If None, results wont be paginated
+        :return: A `SnapshotCourseRepository` or a `CourseRepository`
+        """
+        if self.enabled:
+            return SnapshotCourseRepository(self.get(), paginator)
+
+        return CourseRepository(paginator)
+
+
+catalog_index = CatalogIndex()
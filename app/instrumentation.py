@@ -0,0 +1,471 @@
+import os
+import re
+import time
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+from flask import Response, g, has_app_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the histogram buckets of the number of queries of a request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Characters not allowed in the metric names of a Server-Timing header, which must be HTTP tokens
+NON_TOKEN_CHARACTERS = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]+")
+
+
+class Histogram:
+    """Histogram of observed values, one series per label value, rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, description: str, label: str, buckets: Tuple):
+        """Histogram constructor
+
+        :param name: Metric name
+        :param description: Metric description
+        :param label: Name of the label that identifies each series
+        :param buckets: Sorted upper bounds of the buckets
+        """
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        """Records a value
+
+        :param label_value: Value of the label of the series
+        :param value: Observed value
+        """
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * len(self.buckets), 0.0, 0]
+
+            bucket = bisect.bisect_left(self.buckets, value)
+            if bucket < len(self.buckets):
+                series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        """Renders the histogram. Bucket counts are cumulative, as the format requires
+
+        :return: The lines of the metric
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+
+        with self._lock:
+            for label_value in sorted(self._series):
+                counts, total, count = self._series[label_value]
+                label = '{}="{}"'.format(self.label, escape_label(label_value))
+
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, label, bound, cumulative))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(self.name, label, count))
+                lines.append('{}_sum{{{}}} {}'.format(self.name, label, total))
+                lines.append('{}_count{{{}}} {}'.format(self.name, label, count))
+
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per label value, rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, description: str, label: str = None):
+        """Counter constructor
+
+        :param name: Metric name
+        :param description: Metric description
+        :param label: Name of the label that identifies each series. If None, the counter has a single series
+        """
+        self.name = name
+        self.description = description
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def increment(self, amount: float = 1, label_value: str = None):
+        """Increments the counter
+
+        :param amount: Amount added
+        :param label_value: Value of the label of the series
+        """
+        with self._lock:
+            self._series[label_value] = self._series.get(label_value, 0) + amount
+
+    def render(self) -> List[str]:
+        """Renders the counter
+
+        :return: The lines of the metric
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} counter'.format(self.name)]
+
+        with self._lock:
+            for label_value in sorted(self._series, key=str):
+                if self.label is None:
+                    lines.append('{} {}'.format(self.name, self._series[label_value]))
+                else:
+                    lines.append('{}{{{}="{}"}} {}'.format(self.name, self.label, escape_label(label_value),
+                                                           self._series[label_value]))
+
+        return lines
+
+
+def timing_name(section: str) -> str:
+    """Converts a section name to a metric name of a Server-Timing header, replacing the characters that are not
+        allowed in HTTP tokens with dots
+
+    :param section: Section name
+    :return: The metric name
+    """
+    return NON_TOKEN_CHARACTERS.sub('.', section).strip('.') or 'section'
+
+
+def escape_label(value: str) -> str:
+    """Escapes a label value of the Prometheus text format
+
+    :param value: Label value
+    :return: The escaped value
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestTimings:
+    """Time spent by a request in each instrumented section, in queries and in hydrated rows. Strategies running in
+        pool threads add to the timings of the request that dispatched them"""
+
+    def __init__(self, endpoint: str = None):
+        """RequestTimings constructor
+
+        :param endpoint: Endpoint of the request
+        """
+        self.endpoint = endpoint or 'unknown'
+        self.started_on = time.perf_counter()
+        self.sections = {}
+        self.query_count = 0
+        self.query_time = 0.0
+        self.hydrated_rows = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+
+    def add(self, section: str, duration: float):
+        """Adds the duration of a section. Sections run several times are accumulated
+
+        :param section: Section name
+        :param duration: Duration, in seconds
+        """
+        with self._lock:
+            total, count = self.sections.get(section, (0.0, 0))
+            self.sections[section] = (total + duration, count + 1)
+
+    def add_query(self, duration: float):
+        """Adds a query
+
+        :param duration: Query duration, in seconds
+        """
+        with self._lock:
+            self.query_count += 1
+            self.query_time += duration
+
+    def add_hydrated_rows(self, rows: int):
+        """Adds the number of entities built from query rows
+
+        :param rows: Number of entities
+        """
+        with self._lock:
+            self.hydrated_rows += rows
+
+    def add_cache_lookup(self, hit: bool):
+        """Adds a query cache lookup
+
+        :param hit: Whether the response was cached
+        """
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    @property
+    def duration(self) -> float:
+        """Returns the time elapsed since the request started
+
+        :return: Duration, in seconds
+        """
+        return time.perf_counter() - self.started_on
+
+    def server_timing(self) -> str:
+        """Renders the timings as the value of a Server-Timing header
+
+        :return: The header value
+        """
+        with self._lock:
+            metrics = ['db;dur={:.2f};desc="{} queries, {} rows"'.format(self.query_time * 1000, self.query_count,
+                                                                        self.hydrated_rows)]
+
+            if self.cache_hits or self.cache_misses:
+                metrics.append('cache;desc="{} hits, {} misses"'.format(self.cache_hits, self.cache_misses))
+
+            for section, (total, count) in self.sections.items():
+                description = ';desc="{} calls"'.format(count) if count > 1 else ''
+                metrics.append('{};dur={:.2f}{}'.format(timing_name(section), total * 1000, description))
+
+        metrics.append('total;dur={:.2f}'.format(self.duration * 1000))
+
+        return ', '.join(metrics)
+
+
+class Instrumentation:
+    """Collects the time spent in queries, recommendation strategies, use cases and templates. Each request gets a
+        Server-Timing header with its own timings, and the aggregated histograms are exposed in the Prometheus text
+        format"""
+
+    def __init__(self, app=None):
+        """Instrumentation constructor
+
+        :param app: Flask application. If provided, the instrumentation is configured from it
+        """
+        self.enabled = False
+        self.server_timing = True
+        self.buckets = DEFAULT_BUCKETS
+        self.create_metrics()
+
+        if app is not None:
+            self.init_app(app)
+
+    def create_metrics(self):
+        """Creates the metrics, with the configured buckets"""
+        self.request_duration = Histogram('recommendations_request_duration_seconds',
+                                          'Request latency by endpoint', 'endpoint', self.buckets)
+        self.request_queries = Histogram('recommendations_request_queries', 'Number of queries of each request by '
+                                         'endpoint', 'endpoint', QUERY_COUNT_BUCKETS)
+        self.section_duration = Histogram('recommendations_section_duration_seconds', 'Latency of use cases, '
+                                          'recommendation strategies and templates', 'section', self.buckets)
+        self.query_duration = Histogram('recommendations_query_duration_seconds', 'Database query latency by '
+                                        'endpoint', 'endpoint', self.buckets)
+        self.hydrated_rows = Counter('recommendations_hydrated_rows_total', 'Entities built from query rows')
+        self.cache_lookups = Counter('recommendations_query_cache_lookups_total', 'Query cache lookups by result',
+                                     'result')
+        self.collectors = [self.request_duration, self.request_queries, self.section_duration, self.query_duration,
+                           self.hydrated_rows, self.cache_lookups]
+
+    def init_app(self, app):
+        """Configures the instrumentation from the application config. When enabled, it registers the request hooks,
+            the query listeners, the template class and the metrics endpoint
+
+        :param app: Flask application
+        """
+        self.enabled = app.config.get('INSTRUMENTATION_ENABLED', self.enabled)
+        self.server_timing = app.config.get('INSTRUMENTATION_SERVER_TIMING', self.server_timing)
+        self.create_metrics()
+
+        if not self.enabled:
+            return
+
+        if 'instrumentation' not in app.extensions:
+            app.before_request(self.start_request)
+            app.after_request(self.finish_request)
+            app.jinja_env.template_class = TimedTemplate
+            app.add_url_rule(app.config.get('INSTRUMENTATION_METRICS_PATH', '/metrics'), 'metrics', self.metrics_view)
+            app.extensions['instrumentation'] = self
+
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+    @staticmethod
+    def start_request():
+        """Creates the timings of the request"""
+        g.request_timings = RequestTimings(request.endpoint)
+
+    def finish_request(self, response: Response) -> Response:
+        """Records the request in the histograms and adds the Server-Timing header
+
+        :param response: The response
+        :return: The response
+        """
+        timings = current_timings()
+        if timings is None:
+            return response
+
+        self.request_duration.observe(timings.endpoint, timings.duration)
+        self.request_queries.observe(timings.endpoint, timings.query_count)
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = timings.server_timing()
+
+        return response
+
+    def metrics_view(self) -> Response:
+        """Renders every metric in the Prometheus text format
+
+        :return: The metrics response
+        """
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.render())
+
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    @contextmanager
+    def measure(self, section: str):
+        """Context manager that records the time spent in a section of the current request
+
+        :param section: Section name
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.section_duration.observe(section, duration)
+
+            timings = current_timings()
+            if timings is not None:
+                timings.add(section, duration)
+
+    def record_query(self, duration: float):
+        """Records a database query
+
+        :param duration: Query duration, in seconds
+        """
+        timings = current_timings()
+        if timings is None:
+            return
+
+        timings.add_query(duration)
+        self.query_duration.observe(timings.endpoint, duration)
+
+    def record_hydrated_rows(self, rows: int):
+        """Records the number of entities built from query rows
+
+        :param rows: Number of entities
+        """
+        if not self.enabled:
+            return
+
+        self.hydrated_rows.increment(rows)
+
+        timings = current_timings()
+        if timings is not None:
+            timings.add_hydrated_rows(rows)
+
+    def record_cache_lookup(self, hit: bool):
+        """Records a query cache lookup
+
+        :param hit: Whether the response was cached
+        """
+        if not self.enabled:
+            return
+
+        self.cache_lookups.increment(1, 'hit' if hit else 'miss')
+
+        timings = current_timings()
+        if timings is not None:
+            timings.add_cache_lookup(hit)
+
+
+instrumentation = Instrumentation()
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """Returns the timings of the current request
+
+    :return: The request timings or None if there is no instrumented request in the current context
+    """
+    if not has_app_context():
+        return None
+
+    return g.get('request_timings')
+
+
+def bind_timings(timings: Optional[RequestTimings]):
+    """Makes the timings of a request the timings of the current context, so work done in another thread on behalf
+        of the request is added to it
+
+    :param timings: Timings returned by `current_timings` in the requesting thread
+    """
+    if timings is not None:
+        g.request_timings = timings
+
+
+def timed(section: str = None) -> Callable:
+    """Decorator that records the time spent in a function
+
+    :param section: Section name. If None, the qualified name of the function is used
+    :return: The decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        name = section or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return function(*args, **kwargs)
+
+            with instrumentation.measure(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedTemplate(Template):
+    """Jinja template that records its rendering time"""
+
+    @property
+    def section(self) -> str:
+        """Returns the section name of the template, its path without extension in dotted form, ex:
+            template.main.course-list
+
+        :return: The section name
+        """
+        return timing_name('template.{}'.format(os.path.splitext(self.name or 'string')[0]))
+
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        """Creates a template from its compiled code, wrapping its root render function with the time measure. Templates
+            included or extended by other templates are rendered by calling that function, so they are timed too, and
+            the time of a template includes the time of the templates it renders
+
+        :return: The template
+        """
+        template = super()._from_namespace(environment, namespace, globals)
+        root_render_func = template.root_render_func
+        section = template.section
+
+        def timed_root_render_func(context):
+            with instrumentation.measure(section):
+                yield from root_render_func(context)
+
+        template.root_render_func = timed_root_render_func
+
+        return template
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    """SQLAlchemy listener that records the start time of a query"""
+    connection.info.setdefault('query_started_on', []).append(time.perf_counter())
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    """SQLAlchemy listener that records the duration of a query"""
+    started_on = connection.info['query_started_on'].pop()
+    instrumentation.record_query(time.perf_counter() - started_on)
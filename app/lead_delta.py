@@ -0,0 +1,462 @@
+import os
+import json
+import time
+import fcntl
+import threading
+import numpy as np
+from contextlib import contextmanager
+from scipy import sparse
+from typing import List, Optional, Tuple
+from . import lead_matrix_index
+from .lead_matrix import LeadMatrix, LeadMatrixIndex, lead_matrix_lock
+
+
+class LeadOverlay:
+    """Lead matrix with the leads saved since it was built laid over it. The new leads are held in a sparse matrix
+        with a row for each user of the base matrix followed by the new users, so similarities are the sum of the
+        products with both matrices and the base matrix is never copied"""
+
+    def __init__(self, base: LeadMatrix, pairs: List[Tuple[str, str]]):
+        """LeadOverlay constructor. Leads of courses that are not in the base matrix, or that are already in it, are
+            skipped
+
+        :param base: Lead matrix
+        :param pairs: User and course identifiers of the new leads
+        """
+        self.base = base
+        self.new_users = {}
+        rows = []
+        columns = []
+
+        for user_id, course_id in pairs:
+            column = base.column_of(course_id)
+            if column is None:
+                continue
+
+            row = base.row_of(user_id)
+            if row is None:
+                row = base.number_of_users + self.new_users.setdefault(user_id, len(self.new_users))
+            elif column in base.matrix.indices[base.matrix.indptr[row]:base.matrix.indptr[row + 1]]:
+                continue
+
+            rows.append(row)
+            columns.append(column)
+
+        self.matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                                        shape=(base.number_of_users + len(self.new_users), base.matrix.shape[1]))
+        self.matrix.data[:] = 1
+        self.new_user_ids = np.array(list(self.new_users), dtype=str)
+
+        # Users whose leads have changed, candidates of every approximate search
+        self.changed_rows = np.flatnonzero(np.diff(self.matrix.indptr))
+
+    @property
+    def number_of_users(self) -> int:
+        """Returns the number of users of the base matrix and new users
+
+        :return: The number of users
+        """
+        return self.matrix.shape[0]
+
+    def row_of(self, user_id: str) -> Optional[int]:
+        """Returns the row of a user. New users come after the users of the base matrix
+
+        :param user_id: User identifier
+        :return: The row index or None if the user has no leads
+        """
+        row = self.base.row_of(user_id)
+        if row is None and user_id in self.new_users:
+            row = self.base.number_of_users + self.new_users[user_id]
+
+        return row
+
+    def vector(self, row: int) -> sparse.csr_matrix:
+        """Returns the sparse row of courses requested by the user of a row, including the new leads
+
+        :param row: Row of the user
+        :return: A 1 x number of courses sparse matrix
+        """
+        if row >= self.base.number_of_users:
+            return self.matrix[row]
+
+        return self.base.vector(row) + self.matrix[row]
+
+    def vectors(self, rows: np.ndarray) -> sparse.csr_matrix:
+        """Returns the sparse rows of courses requested by the users of some rows, including the new leads
+
+        :param rows: Rows of the users
+        :return: A number of rows x number of courses sparse matrix
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        in_base = rows < self.base.number_of_users
+        base_vectors = self.base.vectors(np.where(in_base, rows, 0))
+
+        return (sparse.diags(in_base.astype(np.float32)).dot(base_vectors) + self.matrix[rows]).tocsr()
+
+    def similarity_matrix(self, vectors: sparse.csr_matrix) -> sparse.csc_matrix:
+        """Computes the similarity of every user with several vectors of courses, including the new leads
+
+        :param vectors: Number of vectors x number of courses sparse matrix
+        :return: A number of users x number of vectors sparse matrix, with the number of courses in common
+        """
+        base = sparse.vstack([self.base.similarity_matrix(vectors),
+                              sparse.csr_matrix((len(self.new_users), vectors.shape[0]))])
+
+        return (base + self.matrix.dot(vectors.T)).tocsc()
+
+    def similarities(self, vector: sparse.csr_matrix, rows: np.ndarray) -> np.ndarray:
+        """Computes the similarity of some users with a vector of courses, including the new leads
+
+        :param vector: 1 x number of courses sparse matrix
+        :param rows: Rows of the users
+        :return: The number of courses in common of each user with the vector
+        """
+        matrix = self.matrix if len(rows) == self.number_of_users else self.matrix[rows]
+        similarities = np.asarray(matrix.dot(vector.T).todense()).ravel()
+
+        in_base = rows < self.base.number_of_users
+        if np.all(in_base):
+            similarities += self.base.similarities(vector, rows)
+        else:
+            similarities[in_base] += self.base.similarities(vector, rows[in_base])
+
+        return similarities
+
+    def candidates(self, row: int, num_hashes: int = 64, bands: int = 16) -> np.ndarray:
+        """Returns the users that may be similar to the user of a row: the candidates of the base matrix and every
+            user with new leads. New users are not in the locality sensitive hashing index, so every user is a
+            candidate
+
+        :param row: Row of the user
+        :param num_hashes: Number of hash functions of the signatures
+        :param bands: Number of bands
+        :return: Rows of the candidate users, including the user
+        """
+        if row >= self.base.number_of_users:
+            return np.arange(self.number_of_users)
+
+        return np.union1d(self.base.candidates(row, num_hashes, bands), self.changed_rows)
+
+    def users(self, rows=None) -> np.ndarray:
+        """Returns the identifiers of some users
+
+        :param rows: Rows of the users. If None, every user is returned
+        :return: An array of user identifiers
+        """
+        if rows is None:
+            return np.concatenate([self.base.users(), self.new_user_ids])
+
+        rows = np.asarray(rows)
+        in_base = rows < self.base.number_of_users
+        user_ids = np.empty(len(rows), dtype=object)
+        user_ids[in_base] = self.base.users(rows[in_base])
+        user_ids[~in_base] = self.new_user_ids[rows[~in_base] - self.base.number_of_users]
+
+        return user_ids.astype(str)
+
+
+class LeadDelta:
+    """Append-only log of the leads saved since the lead matrix file was written. Leads are appended to a delta file
+        next to the lead matrix file, which every worker reads from where it stopped, so the leads saved by any worker
+        are laid over the lead matrix when similar users are searched. The delta is periodically compacted into a new
+        lead matrix file, which every worker reloads, and the compacted leads are then removed from the delta file"""
+
+    def __init__(self, app=None):
+        """LeadDelta constructor
+
+        :param app: Flask application. If provided, the delta is configured from it
+        """
+        self.app = None
+        self.enabled = False
+        self.compact_interval = 300
+        self.compact_size = 1000
+        # Leads read from the delta file, and leads of previous delta files until the lead matrix holding them is used
+        self._pairs = []
+        self._compacted = []
+        self._courses = {}
+        self._checked_matrix = None
+        # Delta file being read and the offset of its next lead
+        self._file = None
+        self._offset = 0
+        self._generation = 0
+        self._overlay = None
+        self._overlay_key = None
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._compactor = None
+        self._pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the delta from the application config
+
+        :param app: Flask application
+        """
+        self.app = app
+        self.enabled = app.config.get('LEAD_DELTA_ENABLED', self.enabled)
+        self.compact_interval = app.config.get('LEAD_DELTA_COMPACT_INTERVAL', self.compact_interval)
+        self.compact_size = app.config.get('LEAD_DELTA_COMPACT_SIZE', self.compact_size)
+
+    @property
+    def path(self) -> str:
+        """Returns the path to the delta file, next to the lead matrix file
+
+        :return: Path to the delta file
+        """
+        return lead_matrix_index.path + '.delta'
+
+    @contextmanager
+    def delta_lock(self, operation: int):
+        """Holds a lock on the delta file. Appends share it, and the compaction only holds it exclusively while the
+            compacted leads are removed, so leads appended meanwhile are never written to a replaced file
+
+        :param operation: fcntl.LOCK_SH or fcntl.LOCK_EX
+        """
+        with open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def add(self, pairs: List[Tuple[str, str]]):
+        """Appends leads to the delta file, with a single write
+
+        :param pairs: User and course identifiers of the leads
+        """
+        if not self.enabled or len(pairs) == 0:
+            return
+
+        self.start()
+        lines = ''.join(json.dumps([user_id, str(course_id)]) + '\n' for (user_id, course_id) in pairs)
+
+        with self.delta_lock(fcntl.LOCK_SH):
+            descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(descriptor, lines.encode())
+            finally:
+                os.close(descriptor)
+
+        with self._lock:
+            self.refresh()
+
+            if len(self._pairs) >= self.compact_size:
+                self._wake.set()
+
+    def refresh(self):
+        """Reads the leads appended to the delta file since the last read. When the file has been replaced by a
+            compaction, the rest of the replaced file is read first, and the leads read from it are kept as compacted
+            until the lead matrix that holds them is used"""
+        with self._lock:
+            if self._file is not None:
+                self.read_appended()
+
+                try:
+                    if os.stat(self.path).st_ino == os.fstat(self._file).st_ino:
+                        return
+                except FileNotFoundError:
+                    return
+
+                os.close(self._file)
+                self._file = None
+                self._compacted.extend(self._pairs)
+                self._pairs = []
+                self._checked_matrix = None
+                self._generation += 1
+
+            try:
+                self._file = os.open(self.path, os.O_RDONLY)
+            except FileNotFoundError:
+                return
+
+            self._offset = 0
+            self.read_appended()
+
+            # Leads appended during the compaction are moved to the new file, so they are no longer compacted
+            if len(self._compacted) > 0 and len(self._pairs) > 0:
+                moved = set(self._pairs)
+                self._compacted = [pair for pair in self._compacted if pair not in moved]
+                self._courses = {}
+                for user_id, course_id in self._compacted + self._pairs:
+                    self._courses.setdefault(user_id, []).append(course_id)
+
+    def read_appended(self):
+        """Reads the leads appended to the open delta file. A lead being appended by another worker is read once it
+            is complete"""
+        data = b''
+        while True:
+            chunk = os.pread(self._file, 1 << 20, self._offset + len(data))
+            if len(chunk) == 0:
+                break
+            data += chunk
+
+        data = data[:data.rfind(b'\n') + 1]
+        if len(data) == 0:
+            return
+
+        for line in data.splitlines():
+            user_id, course_id = json.loads(line)
+            self._pairs.append((user_id, course_id))
+            self._courses.setdefault(user_id, []).append(course_id)
+
+        self._offset += len(data)
+        self._generation += 1
+
+    def courses_of(self, user_id: str) -> List[str]:
+        """Returns the courses of the leads of a user in the delta, including the compacted leads until the lead
+            matrix that holds them is used
+
+        :param user_id: User identifier
+        :return: Course identifiers
+        """
+        if not self.enabled:
+            return []
+
+        with self._lock:
+            self.refresh()
+
+            return list(self._courses.get(user_id, []))
+
+    def overlay(self, lead_matrix: LeadMatrix):
+        """Lays the delta over a lead matrix. The overlay is built once for each matrix and state of the delta
+
+        :param lead_matrix: Lead matrix
+        :return: A `LeadOverlay` or the lead matrix itself if there are no leads to lay over it. Matrices converted
+            from pickled dictionaries do not know the course of each column, so the delta cannot be laid over them
+        """
+        if not self.enabled or len(lead_matrix.course_ids) == 0:
+            return lead_matrix
+
+        with self._lock:
+            self.refresh()
+            self.release_compacted(lead_matrix)
+
+            pairs = self._compacted + self._pairs
+            if len(pairs) == 0:
+                return lead_matrix
+
+            key = (id(lead_matrix), self._generation)
+            if self._overlay_key != key:
+                self._overlay = LeadOverlay(lead_matrix, pairs)
+                self._overlay_key = key
+
+            return self._overlay
+
+    def release_compacted(self, lead_matrix: LeadMatrix):
+        """Removes the compacted leads once a lead matrix that holds all of them is used. Each matrix is checked once
+
+        :param lead_matrix: Lead matrix
+        """
+        if len(self._compacted) == 0 or self._checked_matrix == id(lead_matrix):
+            return
+
+        self._checked_matrix = id(lead_matrix)
+        if not all(self.holds(lead_matrix, user_id, course_id) for (user_id, course_id) in self._compacted):
+            return
+
+        self._compacted = []
+        self._courses = {}
+        for user_id, course_id in self._pairs:
+            self._courses.setdefault(user_id, []).append(course_id)
+        self._generation += 1
+
+    @staticmethod
+    def holds(lead_matrix: LeadMatrix, user_id: str, course_id: str) -> bool:
+        """Returns whether a lead is in a lead matrix. Leads of courses that are not in the matrix are never merged,
+            so they are considered held
+
+        :param lead_matrix: Lead matrix
+        :param user_id: User identifier
+        :param course_id: Course identifier
+        :return: True if the matrix holds the lead
+        """
+        column = lead_matrix.column_of(course_id)
+        if column is None:
+            return True
+
+        row = lead_matrix.row_of(user_id)
+        matrix = lead_matrix.matrix
+
+        return row is not None and column in matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]
+
+    def start(self):
+        """Starts the thread that compacts the delta periodically, once per process"""
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._compactor = threading.Thread(target=self.run, name='lead-delta', daemon=True)
+            self._compactor.start()
+
+    def run(self):
+        """Compacts the delta every compact interval, or as soon as it reaches the compact size"""
+        while True:
+            self._wake.wait(self.compact_interval)
+            self._wake.clear()
+
+            try:
+                self.compact()
+            except Exception:
+                self.app.logger.exception('Unable to compact the lead delta, it will be retried')
+
+    def compact(self):
+        """Writes a new lead matrix file with the leads of the delta file and then removes them from the delta file.
+            Workers compact one at a time, holding the lead matrix file lock, each one over the file written by the
+            previous one. If the lead matrix cannot be written, the delta file is left as it is"""
+        path = lead_matrix_index.path
+        started = time.perf_counter()
+
+        with lead_matrix_lock(path):
+            try:
+                with open(self.path, 'rb') as delta_file:
+                    inode = os.fstat(delta_file.fileno()).st_ino
+                    data = delta_file.read()
+            except FileNotFoundError:
+                return
+
+            data = data[:data.rfind(b'\n') + 1]
+            pairs = [tuple(json.loads(line)) for line in data.splitlines()]
+            if len(pairs) == 0:
+                return
+
+            # The file is read once the lock is held, so a file written meanwhile by another worker or by
+            # `build-similarities` is the one the leads are merged into
+            source = lead_matrix_index.source()
+            base = LeadMatrixIndex.load(source[0])
+            if len(base.course_ids) == 0:
+                self.app.logger.warning('The lead matrix file does not hold the course identifiers, the lead delta '
+                                        'is discarded until it is rebuilt')
+            else:
+                user_ids, course_ids = zip(*pairs)
+                lead_matrix = base.with_leads(list(user_ids), list(course_ids))
+
+                # Processes that do not take the lock may have replaced the file while the leads were merged
+                if lead_matrix_index.source() != source:
+                    raise RuntimeError('The lead matrix file has changed during the compaction')
+
+                lead_matrix.save(path)
+
+            # Leads appended during the compaction are moved to a new delta file
+            with self.delta_lock(fcntl.LOCK_EX):
+                with open(self.path, 'rb') as delta_file:
+                    if os.fstat(delta_file.fileno()).st_ino != inode:
+                        raise RuntimeError('The lead delta file has changed during the compaction')
+                    delta_file.seek(len(data))
+                    appended = delta_file.read()
+
+                temporary = '{}.{}'.format(self.path, os.getpid())
+                with open(temporary, 'wb') as delta_file:
+                    delta_file.write(appended)
+                os.replace(temporary, self.path)
+
+        self.app.logger.info('Compacted %d leads into the lead matrix in %.2f s', len(pairs),
+                             time.perf_counter() - started)
+
+
+lead_delta = LeadDelta()
@@ -0,0 +1,483 @@
+import os
+import json
+import fcntl
+import pickle
+import tempfile
+import threading
+import numpy as np
+from contextlib import contextmanager
+from scipy import sparse
+from typing import Dict, Iterator, List, Optional, Tuple
+from .lsh import MinHashLSHIndex
+from .similarity import top_k_similarities
+
+# Magic bytes and version of the memory mapped lead matrix file format. The magic bytes are followed by the version
+# and the length of a JSON header (two little endian 32 bit integers), the header and the arrays, each one aligned
+# to ARRAY_ALIGNMENT bytes. The header holds the matrix shape and the dtype, shape and offset of each array. Files
+# may also hold the course neighbour matrix, whose number of neighbours per course is stored as item_neighbours
+LEAD_MATRIX_MAGIC = b'LEADMTX\x00'
+LEAD_MATRIX_VERSION = 1
+ARRAY_ALIGNMENT = 64
+HEADER_FORMAT = np.dtype([('version', '<u4'), ('header_length', '<u4')])
+
+
+@contextmanager
+def lead_matrix_lock(path: str) -> Iterator[None]:
+    """Holds an exclusive lock on a lead matrix file while it is read and written. Every process that writes the file
+        takes it: the lead delta compaction, `build-similarities` and `convert-lead-matrix`, so none of them replaces
+        the file written by another one with a matrix read before
+
+    :param path: Path to the lead matrix file
+    """
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class LeadMatrix:
+    """User-course lead matrix. Each row holds the courses requested by a user. Rows are sorted by user identifier,
+        so a user is found with a binary search and the arrays can be memory mapped as they are"""
+
+    def __init__(self, matrix: sparse.csr_matrix, user_ids, course_ids=None):
+        """LeadMatrix constructor. If the user identifiers are not sorted, the rows are reordered
+
+        :param matrix: Sparse matrix with one row per user and one column per course
+        :param user_ids: User identifiers, in the same order as the matrix rows
+        :param course_ids: Course identifier of each matrix column, if known
+        """
+        user_ids = np.asarray(user_ids)
+        if user_ids.dtype.kind != 'S':
+            user_ids = np.char.encode(user_ids.astype(str), 'utf-8') if len(user_ids) else user_ids.astype('S1')
+
+        if len(user_ids) > 1 and not np.all(user_ids[1:] >= user_ids[:-1]):
+            order = np.argsort(user_ids, kind='stable')
+            user_ids = user_ids[order]
+            matrix = matrix[order]
+
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.course_ids = np.asarray(course_ids if course_ids is not None else [], dtype=str)
+        self.path = None
+        self.mtime = None
+        self._lsh_indexes = {}
+        self._item_neighbours = {}
+        self._course_columns = None
+
+    @classmethod
+    def from_user_map(cls, user_courses_map: Dict) -> 'LeadMatrix':
+        """Creates a lead matrix from a dictionary of sparse rows indexed by user identifier
+
+        :param user_courses_map: Dictionary whose keys are the user identifiers and values are sparse row vectors
+        :return: A lead matrix
+        """
+        user_ids = list(user_courses_map.keys())
+        rows = [user_courses_map[user_id] for user_id in user_ids]
+
+        if len(rows) == 0:
+            return cls(sparse.csr_matrix((0, 0)), user_ids)
+
+        return cls(sparse.vstack(rows, format='csr'), user_ids)
+
+    @classmethod
+    def open(cls, path: str) -> 'LeadMatrix':
+        """Opens a lead matrix file. The arrays are memory mapped read only, so every process opening the same file
+            shares its pages
+
+        :param path: Path to the lead matrix file
+        :return: The lead matrix
+        """
+        with open(path, 'rb') as lead_matrix_file:
+            magic = lead_matrix_file.read(len(LEAD_MATRIX_MAGIC))
+            if magic != LEAD_MATRIX_MAGIC:
+                raise ValueError('{} is not a lead matrix file'.format(path))
+
+            version, header_length = np.frombuffer(lead_matrix_file.read(HEADER_FORMAT.itemsize), HEADER_FORMAT)[0]
+            if version != LEAD_MATRIX_VERSION:
+                raise ValueError('Unsupported lead matrix file version {}'.format(version))
+
+            header = json.loads(lead_matrix_file.read(header_length).decode())
+
+            # Arrays are mapped from the open file, so they belong to the file whose modification time is kept even
+            # if it is replaced meanwhile
+            mtime = os.fstat(lead_matrix_file.fileno()).st_mtime
+            arrays = {}
+            for (name, array) in header['arrays'].items():
+                if array['shape'][0] == 0:
+                    arrays[name] = np.empty(array['shape'], dtype=array['dtype'])
+                else:
+                    arrays[name] = np.memmap(lead_matrix_file, dtype=array['dtype'], mode='r', offset=array['offset'],
+                                             shape=tuple(array['shape']))
+
+        matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                   shape=tuple(header['shape']), copy=False)
+
+        lead_matrix = cls(matrix, arrays['user_ids'], arrays['course_ids'])
+        lead_matrix.path = path
+        lead_matrix.mtime = mtime
+
+        if 'neighbour_indptr' in arrays:
+            number_of_courses = header['shape'][1]
+            lead_matrix._item_neighbours[header['item_neighbours']] = sparse.csr_matrix(
+                (arrays['neighbour_data'], arrays['neighbour_indices'], arrays['neighbour_indptr']),
+                shape=(number_of_courses, number_of_courses), copy=False)
+
+        return lead_matrix
+
+    def save(self, path: str):
+        """Writes the lead matrix file atomically. The course neighbour matrix is written too if it has been built
+
+        :param path: Path to the lead matrix file
+        """
+        course_ids = self.course_ids
+        index_dtype = np.int32 if self.matrix.nnz < np.iinfo(np.int32).max else np.int64
+        arrays = {
+            'indptr': self.matrix.indptr.astype(index_dtype, copy=False),
+            'indices': self.matrix.indices.astype(index_dtype, copy=False),
+            'data': self.matrix.data.astype(np.float32, copy=False),
+            'user_ids': self.user_ids,
+            'course_ids': np.char.encode(course_ids, 'utf-8') if len(course_ids) else course_ids.astype('S1'),
+        }
+
+        header = {'shape': list(self.matrix.shape), 'arrays': {}}
+
+        if self._item_neighbours:
+            header['item_neighbours'] = max(self._item_neighbours)
+            neighbours = self._item_neighbours[header['item_neighbours']]
+            arrays.update({
+                'neighbour_indptr': neighbours.indptr.astype(index_dtype, copy=False),
+                'neighbour_indices': neighbours.indices.astype(np.int32, copy=False),
+                'neighbour_data': neighbours.data.astype(np.float32, copy=False),
+            })
+
+        offset = 0
+        for (name, array) in arrays.items():
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset = self.align(offset + array.nbytes)
+
+        # Offsets are relative to the start of the arrays until the header length is known. The arrays start after
+        # some spare bytes, so the header still fits once the offsets become absolute
+        encoded_header = json.dumps(header).encode()
+        start = self.align(len(LEAD_MATRIX_MAGIC) + HEADER_FORMAT.itemsize + len(encoded_header) + 256)
+        for array in header['arrays'].values():
+            array['offset'] += start
+        encoded_header = json.dumps(header).encode()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as temporary_file:
+                temporary_file.write(LEAD_MATRIX_MAGIC)
+                temporary_file.write(np.array([(LEAD_MATRIX_VERSION, len(encoded_header))], HEADER_FORMAT).tobytes())
+                temporary_file.write(encoded_header)
+
+                for (name, array) in arrays.items():
+                    temporary_file.seek(header['arrays'][name]['offset'])
+                    temporary_file.write(np.ascontiguousarray(array).tobytes())
+
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+            os.replace(temporary_path, path)
+        except Exception:
+            os.remove(temporary_path)
+            raise
+
+    @staticmethod
+    def align(offset: int) -> int:
+        """Rounds an offset up to the array alignment
+
+        :param offset: File offset
+        :return: The aligned offset
+        """
+        return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    @property
+    def number_of_users(self) -> int:
+        """Returns the number of users (rows) in the matrix
+
+        :return: The number of users
+        """
+        return self.matrix.shape[0]
+
+    def row_of(self, user_id: str) -> Optional[int]:
+        """Returns the matrix row of a user
+
+        :param user_id: User identifier
+        :return: The row index or None if the user has no leads in the matrix
+        """
+        key = user_id.encode('utf-8')
+        row = int(np.searchsorted(self.user_ids, key))
+
+        if row == len(self.user_ids) or self.user_ids[row] != key:
+            return None
+
+        return row
+
+    def users(self, rows=None) -> np.ndarray:
+        """Returns the identifiers of some users
+
+        :param rows: Matrix rows of the users. If None, every user is returned
+        :return: An array of user identifiers
+        """
+        user_ids = self.user_ids if rows is None else self.user_ids[rows]
+
+        return np.char.decode(user_ids, 'utf-8')
+
+    def lsh_index(self, num_hashes: int = 64, bands: int = 16) -> MinHashLSHIndex:
+        """Returns the locality sensitive hashing index of the matrix, building it on first use
+
+        :param num_hashes: Number of hash functions of the signatures
+        :param bands: Number of bands
+        :return: The LSH index
+        """
+        key = (num_hashes, bands)
+        if key not in self._lsh_indexes:
+            self._lsh_indexes[key] = MinHashLSHIndex(self.matrix, num_hashes, bands)
+
+        return self._lsh_indexes[key]
+
+    def item_neighbours(self, k: int = 20) -> sparse.csr_matrix:
+        """Returns the course neighbour matrix, building it on first use. Each row holds the cosine similarities of
+            a course with the k courses most often requested by the same users
+
+        :param k: Number of neighbours kept for each course
+        :return: A number of courses x number of courses sparse matrix
+        """
+        if k not in self._item_neighbours:
+            courses = self.matrix.T.tocsr().astype(np.float32)
+            norms = np.sqrt(np.asarray(courses.multiply(courses).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            courses = sparse.diags(1 / norms).dot(courses).tocsr()
+
+            rows, columns, values = [], [], []
+            for (chunk_rows, chunk_columns, chunk_values) in top_k_similarities(courses, k):
+                rows.append(chunk_rows)
+                columns.append(chunk_columns)
+                values.append(chunk_values)
+
+            shape = (courses.shape[0], courses.shape[0])
+            if rows:
+                self._item_neighbours[k] = sparse.csr_matrix(
+                    (np.concatenate(values).astype(np.float32), (np.concatenate(rows), np.concatenate(columns))),
+                    shape=shape)
+            else:
+                self._item_neighbours[k] = sparse.csr_matrix(shape, dtype=np.float32)
+
+        return self._item_neighbours[k]
+
+    def column_of(self, course_id: str) -> Optional[int]:
+        """Returns the matrix column of a course
+
+        :param course_id: Course identifier
+        :return: The column index or None if the course is not in the matrix
+        """
+        if self._course_columns is None:
+            self._course_columns = {course_id: column for (column, course_id) in enumerate(self.course_ids.tolist())}
+
+        return self._course_columns.get(str(course_id))
+
+    def columns_of(self, course_ids: List[str]) -> np.ndarray:
+        """Returns the matrix columns of some courses. Courses that are not in the matrix are skipped
+
+        :param course_ids: Course identifiers
+        :return: An array of column indexes
+        """
+        columns = [self.column_of(course_id) for course_id in course_ids]
+
+        return np.array([column for column in columns if column is not None], dtype=np.int64)
+
+    def vector(self, row: int) -> sparse.csr_matrix:
+        """Returns the sparse row of courses requested by the user of a matrix row
+
+        :param row: Matrix row
+        :return: A 1 x number of courses sparse matrix
+        """
+        return self.matrix[row]
+
+    def vectors(self, rows: np.ndarray) -> sparse.csr_matrix:
+        """Returns the sparse rows of courses requested by the users of some matrix rows
+
+        :param rows: Matrix rows
+        :return: A number of rows x number of courses sparse matrix
+        """
+        return self.matrix[rows]
+
+    def similarity_matrix(self, vectors: sparse.csr_matrix) -> sparse.csc_matrix:
+        """Computes the similarity of every user with several vectors of courses, in a single sparse matrix product
+
+        :param vectors: Number of vectors x number of courses sparse matrix
+        :return: A number of users x number of vectors sparse matrix, with the number of courses in common
+        """
+        return self.matrix.dot(vectors.T).tocsc()
+
+    def similarities(self, vector: sparse.csr_matrix, rows: np.ndarray) -> np.ndarray:
+        """Computes the similarity of some users with a vector of courses, in a single sparse matrix-vector product
+
+        :param vector: 1 x number of courses sparse matrix
+        :param rows: Matrix rows of the users
+        :return: The number of courses in common of each user with the vector
+        """
+        matrix = self.matrix if len(rows) == self.number_of_users else self.matrix[rows]
+
+        return np.asarray(matrix.dot(vector.T).todense()).ravel()
+
+    def candidates(self, row: int, num_hashes: int = 64, bands: int = 16) -> np.ndarray:
+        """Returns the users that may be similar to the user of a row, found with the locality sensitive hashing index
+
+        :param row: Matrix row of the user
+        :param num_hashes: Number of hash functions of the signatures
+        :param bands: Number of bands
+        :return: Matrix rows of the candidate users, including the user
+        """
+        return self.lsh_index(num_hashes, bands).candidates(row)
+
+    def with_leads(self, user_ids: List[str], course_ids: List[str]) -> 'LeadMatrix':
+        """Returns a copy of the lead matrix with some leads added. Leads of courses that are not in the matrix are
+            skipped, and the course neighbours are kept as they are
+
+        :param user_ids: User identifier of each lead
+        :param course_ids: Course identifier of each lead
+        :return: The new lead matrix
+        """
+        number_of_users, number_of_courses = self.matrix.shape
+        new_users = {}
+        rows = []
+        columns = []
+
+        for user_id, course_id in zip(user_ids, course_ids):
+            column = self.column_of(course_id)
+            if column is None:
+                continue
+
+            row = self.row_of(user_id)
+            if row is None:
+                row = number_of_users + new_users.setdefault(user_id, len(new_users))
+
+            rows.append(row)
+            columns.append(column)
+
+        shape = (number_of_users + len(new_users), number_of_courses)
+        leads = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=shape)
+        matrix = (sparse.vstack([self.matrix, sparse.csr_matrix((len(new_users), number_of_courses))],
+                                format='csr') + leads).tocsr()
+        matrix.data[:] = 1
+
+        lead_matrix = LeadMatrix(matrix, np.concatenate([self.users(), np.array(list(new_users), dtype=str)]),
+                                 self.course_ids)
+        lead_matrix._item_neighbours = dict(self._item_neighbours)
+
+        return lead_matrix
+
+    def user_vector(self, user_id: str) -> sparse.csr_matrix:
+        """Returns the sparse row of courses requested by a user
+
+        :param user_id: User identifier
+        :return: A 1 x number of courses sparse matrix
+        """
+        row = self.row_of(user_id)
+        if row is None:
+            raise KeyError(user_id)
+
+        return self.matrix[row]
+
+
+class LeadMatrixIndex:
+    """Process-wide access point to the lead matrix. The matrix file is loaded lazily, once per process, and
+        reloaded when its modification time changes"""
+
+    def __init__(self, app=None, path: str = None, legacy_path: str = None):
+        """LeadMatrixIndex constructor
+
+        :param app: Flask application. If provided, the index is configured from it
+        :param path: Path to the lead matrix file
+        :param legacy_path: Path to the pickled lead matrix read while the lead matrix file does not exist
+        """
+        self.path = path
+        self.legacy_path = legacy_path
+        self.approximate = False
+        self.lsh_num_hashes = 64
+        self.lsh_bands = 16
+        self.lsh_min_leads = 3
+        self.item_based = False
+        self.item_neighbours = 20
+        self._lead_matrix = None
+        self._source = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the index from the application config
+
+        :param app: Flask application
+        """
+        self.path = app.config.get('LEAD_MATRIX_FILE', self.path)
+        self.legacy_path = app.config.get('LEAD_MATRIX_LEGACY_FILE', self.legacy_path)
+        self.approximate = app.config.get('NEIGHBOUR_SEARCH', 'exact') == 'lsh'
+        self.lsh_num_hashes = app.config.get('LSH_NUM_HASHES', self.lsh_num_hashes)
+        self.lsh_bands = app.config.get('LSH_BANDS', self.lsh_bands)
+        self.lsh_min_leads = app.config.get('LSH_MIN_LEADS', self.lsh_min_leads)
+        self.item_based = app.config.get('COLLABORATIVE_FILTERING', 'user') == 'item'
+        self.item_neighbours = app.config.get('ITEM_NEIGHBOURS', self.item_neighbours)
+
+    def get(self) -> LeadMatrix:
+        """Returns the lead matrix, loading it if it has not been loaded yet or if the file has changed
+
+        :return: The lead matrix
+        """
+        source = self.source()
+
+        if self._lead_matrix is not None and source == self._source:
+            return self._lead_matrix
+
+        with self._lock:
+            if self._lead_matrix is None or source != self._source:
+                self._lead_matrix = self.load(source[0])
+                self._source = source
+
+        return self._lead_matrix
+
+    def source(self) -> Tuple[str, float]:
+        """Returns the file the lead matrix is read from: the lead matrix file or, until it is written by
+            `build-similarities` or `convert-lead-matrix`, the legacy pickled lead matrix
+
+        :return: A tuple with the path to the file and its modification time
+        """
+        try:
+            return self.path, os.path.getmtime(self.path)
+        except FileNotFoundError:
+            if not self.legacy_path:
+                raise
+
+        return self.legacy_path, os.path.getmtime(self.legacy_path)
+
+    @staticmethod
+    def load(path: str) -> LeadMatrix:
+        """Loads a lead matrix from a file. Memory mapped lead matrix files are opened as they are, and pickled
+            dictionaries of sparse rows indexed by user identifier are read into memory
+
+        :param path: Path to the lead matrix file
+        :return: The lead matrix
+        """
+        if LeadMatrixIndex.is_lead_matrix_file(path):
+            return LeadMatrix.open(path)
+
+        with open(path, 'rb') as filename:
+            user_courses_map = pickle.load(filename)
+
+        return LeadMatrix.from_user_map(user_courses_map)
+
+    @staticmethod
+    def is_lead_matrix_file(path: str) -> bool:
+        """Returns whether a file is a memory mapped lead matrix file
+
+        :param path: Path to the file
+        :return: True if the file starts with the lead matrix magic bytes
+        """
+        with open(path, 'rb') as lead_matrix_file:
+            return lead_matrix_file.read(len(LEAD_MATRIX_MAGIC)) == LEAD_MATRIX_MAGIC
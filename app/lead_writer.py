@@ -0,0 +1,259 @@
+import os
+import glob
+import json
+import uuid
+import fcntl
+import atexit
+import threading
+from typing import Dict, List
+from .models import Lead, LeadRepository
+
+
+class BufferedLeadWriter:
+    """Write-behind lead writer. Leads are appended to a local spool file and buffered in memory, and the buffer is
+        persisted with a multi-row insert by a background thread when it reaches a size or an age. Each process holds
+        a lock on its own spool files, so spool files left by stopped workers are the unlocked ones, and they are
+        persisted by the next flush of any worker"""
+
+    def __init__(self, app=None):
+        """BufferedLeadWriter constructor
+
+        :param app: Flask application. If provided, the writer is configured from it
+        """
+        self.app = None
+        self.enabled = False
+        self.batch_size = 100
+        self.flush_interval = 2.0
+        self.max_attempts = 5
+        self.spool_dir = None
+        self.lead_repository = LeadRepository()
+        self._buffer = []
+        self._spool = None
+        # Batches being persisted, with the spool file that holds their leads
+        self._pending = []
+        # Failed attempts of each spool file, until it is persisted or quarantined
+        self._failures = {}
+        self._wake = threading.Event()
+        self._lock = threading.RLock()
+        # Leads being written to each spool file, which is not persisted until they are written
+        self._writing = {}
+        self._written = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._pid = None
+
+        # Buffered leads are persisted on shutdown. Disabled writers have nothing to flush
+        atexit.register(self.flush)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the writer from the application config
+
+        :param app: Flask application
+        """
+        self.app = app
+        self.enabled = app.config.get('LEAD_WRITER_ENABLED', self.enabled)
+        self.batch_size = app.config.get('LEAD_WRITER_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('LEAD_WRITER_FLUSH_INTERVAL', self.flush_interval)
+        self.max_attempts = app.config.get('LEAD_WRITER_MAX_ATTEMPTS', self.max_attempts)
+        self.spool_dir = app.config.get('LEAD_WRITER_SPOOL_DIR', self.spool_dir)
+
+        if self.enabled:
+            os.makedirs(self.spool_dir, exist_ok=True)
+
+    @property
+    def spool_file(self) -> str:
+        """Returns the spool file of the current process
+
+        :return: Path to the spool file or None if no lead has been written yet
+        """
+        return None if self._spool is None else self._spool.name
+
+    def write(self, lead: Lead):
+        """Records a lead. If the writer is disabled, the lead is persisted immediately. Otherwise it is spooled and
+            buffered, and a full buffer wakes the flusher thread, so the request never waits for the insert. The lead
+            is written and synced without holding the lock, so requests do not wait for each other's disk writes
+
+        :param lead: The lead to record
+        """
+        if not self.enabled:
+            self.lead_repository.save(lead)
+            return
+
+        record = lead.to_record()
+
+        with self._lock:
+            self.start()
+
+            spool = self._spool
+            self._writing[spool] = self._writing.get(spool, 0) + 1
+
+        written = False
+        try:
+            # A single write to a file opened for appending, so concurrent leads are never interleaved
+            os.write(spool.fileno(), (json.dumps(record) + '\n').encode())
+            os.fsync(spool.fileno())
+            written = True
+        finally:
+            with self._lock:
+                # The buffer may have been swapped meanwhile, the lead then belongs to the batch of its spool file
+                if written and spool is self._spool:
+                    self._buffer.append(record)
+                elif written:
+                    next(records for (records, pending) in self._pending if pending is spool).append(record)
+
+                self._writing[spool] -= 1
+                if self._writing[spool] == 0:
+                    del self._writing[spool]
+                    self._written.notify_all()
+
+                if len(self._buffer) >= self.batch_size:
+                    self._wake.set()
+
+    def start(self):
+        """Opens the spool file and starts the thread that flushes the buffer periodically, once per process"""
+        if self._pid == os.getpid():
+            return
+
+        # After a fork the buffer and the spool files belong to the parent process, which keeps their locks
+        for spool in [self._spool] + [spool for (_, spool) in self._pending]:
+            if spool is not None:
+                spool.close()
+
+        self._pid = os.getpid()
+        self._buffer = []
+        self._pending = []
+        self._failures = {}
+        self._writing = {}
+        self._spool = self.open_spool()
+        self._flusher = threading.Thread(target=self.run, name='lead-writer', daemon=True)
+        self._flusher.start()
+
+    def open_spool(self):
+        """Creates a new spool file and locks it. Spool files are named after the process and a random identifier,
+            so a process never reuses the spool file of a stopped process with the same identifier
+
+        :return: The spool file, open for appending
+        """
+        path = os.path.join(self.spool_dir, 'leads-{}-{}.spool'.format(os.getpid(), uuid.uuid4().hex))
+        spool = open(path, 'a')
+        fcntl.flock(spool, fcntl.LOCK_EX)
+
+        return spool
+
+    def run(self):
+        """Flushes the buffer every flush interval, or as soon as it is full"""
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Unable to flush the buffered leads, they will be retried')
+
+    def flush(self):
+        """Persists the buffered leads and the leads of the spool files of stopped workers. The buffer is swapped
+            for an empty one with a new spool file, so leads are still written while the batch is inserted"""
+        if not self.enabled:
+            return
+
+        with self.app.app_context():
+            self.recover()
+
+            # The buffer of a forked process that has not written any lead belongs to its parent process
+            if self._pid != os.getpid():
+                return
+
+            with self._lock:
+                if len(self._buffer) > 0:
+                    self._pending.append((self._buffer, self._spool))
+                    self._buffer = []
+                    self._spool = self.open_spool()
+
+            # Batches are inserted in order, one flush at a time. A failed batch is retried by the next flush
+            with self._flush_lock:
+                while len(self._pending) > 0:
+                    records, spool = self._pending[0]
+
+                    with self._lock:
+                        self._written.wait_for(lambda: spool not in self._writing)
+
+                    self.persist(records, spool.name)
+
+                    with self._lock:
+                        self._pending.pop(0)
+                        spool.close()
+
+    def persist(self, records: List[Dict], path: str):
+        """Inserts a batch of leads and removes its spool file. A batch that fails `max_attempts` times is
+            quarantined, so it does not block the later batches: its spool file is renamed to `.failed`, which is
+            not recovered, and kept to be inserted by hand
+
+        :param records: The lead records of the batch
+        :param path: Path to the spool file of the batch
+        :raise Exception: If the batch failed and will be retried
+        """
+        try:
+            self.lead_repository.save_many(records)
+        except Exception:
+            failures = self._failures.get(path, 0) + 1
+            if failures < self.max_attempts:
+                self._failures[path] = failures
+                raise
+
+            quarantine = os.path.splitext(path)[0] + '.failed'
+            os.rename(path, quarantine)
+            self._failures.pop(path, None)
+            self.app.logger.exception('Unable to insert {} leads after {} attempts, they are kept in {}'
+                                      .format(len(records), failures, quarantine))
+            return
+
+        self._failures.pop(path, None)
+        os.remove(path)
+
+    def recover(self):
+        """Persists the leads of the spool files that are not locked, whose process is no longer running"""
+        for path in glob.glob(os.path.join(self.spool_dir, 'leads-*.spool')):
+            try:
+                spool = open(path)
+            except OSError:
+                continue
+
+            with spool:
+                try:
+                    fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+
+                # The file may have been recovered by another worker while it was being locked
+                try:
+                    if os.stat(path).st_ino != os.fstat(spool.fileno()).st_ino:
+                        continue
+                except FileNotFoundError:
+                    continue
+
+                self.persist(self.read_spool(path), path)
+
+    @staticmethod
+    def read_spool(path: str) -> List[Dict]:
+        """Reads the leads of a spool file. An incomplete last line, written while the process stopped, is ignored
+
+        :param path: Path to the spool file
+        :return: The lead records
+        """
+        records = []
+
+        with open(path) as spool:
+            for line in spool:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        return records
+
+
+lead_writer = BufferedLeadWriter()
@@ -0,0 +1,86 @@
+import numpy as np
+from scipy import sparse
+
+
+class MinHashLSHIndex:
+    """Locality sensitive hashing index of the sets of courses requested by each user. Users are hashed with MinHash
+        signatures split in bands, and users sharing the bucket of any band are candidates to be similar. More bands
+        of fewer rows find more candidates, improving recall at the cost of latency"""
+
+    # Mersenne prime larger than any course column, used by the universal hash functions
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, matrix: sparse.csr_matrix, num_hashes: int = 64, bands: int = 16, seed: int = 0):
+        """MinHashLSHIndex constructor. Computes the signatures and the buckets of each band
+
+        :param matrix: User-course lead matrix
+        :param num_hashes: Number of hash functions of the signatures
+        :param bands: Number of bands. It must divide the number of hash functions
+        :param seed: Seed of the hash functions
+        """
+        if num_hashes % bands != 0:
+            raise ValueError('The number of hashes must be a multiple of the number of bands')
+
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.rows_per_band = num_hashes // bands
+
+        random = np.random.RandomState(seed)
+        self.a = random.randint(1, self.PRIME, size=num_hashes).astype(np.int64)
+        self.b = random.randint(0, self.PRIME, size=num_hashes).astype(np.int64)
+
+        self.signatures = self.sign(matrix)
+
+        # For each band, users sorted by bucket and the bucket of each user
+        self.band_buckets = []
+        self.band_users = []
+        self.band_sorted_buckets = []
+
+        for band in range(bands):
+            columns = self.signatures[:, band * self.rows_per_band:(band + 1) * self.rows_per_band]
+            keys = np.ascontiguousarray(columns).view(np.dtype((np.void, columns.dtype.itemsize * columns.shape[1])))
+            _, buckets = np.unique(keys.ravel(), return_inverse=True)
+
+            order = np.argsort(buckets, kind='stable')
+            self.band_buckets.append(buckets)
+            self.band_users.append(order)
+            self.band_sorted_buckets.append(buckets[order])
+
+    def sign(self, matrix: sparse.csr_matrix) -> np.ndarray:
+        """Computes the MinHash signature of each row of a matrix
+
+        :param matrix: User-course lead matrix
+        :return: An array of number of users x number of hashes. Users without courses get the maximum value
+        """
+        matrix = matrix.tocsr()
+        signatures = np.full((matrix.shape[0], self.num_hashes), self.PRIME, dtype=np.int64)
+
+        non_empty = np.flatnonzero(np.diff(matrix.indptr) > 0)
+        if len(non_empty) == 0:
+            return signatures
+
+        courses = matrix.indices.astype(np.int64)
+        starts = matrix.indptr[non_empty]
+
+        for index in range(self.num_hashes):
+            hashes = (self.a[index] * courses + self.b[index]) % self.PRIME
+            signatures[non_empty, index] = np.minimum.reduceat(hashes, starts)
+
+        return signatures
+
+    def candidates(self, row: int) -> np.ndarray:
+        """Returns the users that share a bucket with a user in any band
+
+        :param row: Matrix row of the user
+        :return: Matrix rows of the candidate users, including the user
+        """
+        candidates = []
+
+        for band in range(self.bands):
+            bucket = self.band_buckets[band][row]
+            sorted_buckets = self.band_sorted_buckets[band]
+            start = np.searchsorted(sorted_buckets, bucket, side='left')
+            end = np.searchsorted(sorted_buckets, bucket, side='right')
+            candidates.append(self.band_users[band][start:end])
+
+        return np.unique(np.concatenate(candidates))
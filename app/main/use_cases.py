@@ -1,7 +1,12 @@
 from ..models import CourseRepository, CategoryRepository, Paginator
-from ..models import Lead, LeadRepository
+from ..models import Lead
+from ..lead_writer import lead_writer
+from ..refresher import recommendation_refresher
+from ..catalog import catalog_index
 from ..recommender import Recommender
-from typing import Dict, Optional
+from ..instrumentation import timed
+from flask import current_app
+from typing import Dict, Iterator, List, Optional
 import hashlib
 
 
@@ -23,11 +28,12 @@ class RetrieveCourseCatalogCommand:
     SORT_LEADS = 'leads'
     SORT_RATING = 'rating'
 
-    def __init__(self, page: int, sort_by: str, category: int):
+    def __init__(self, page: int, sort_by: str, category: int, after: str = None):
         """Initializes the command
         :param page: Page number
         :param sort_by: rating|leads
         :param category: Category identifier
+        :param after: Identifier of the last course of the previous page. If provided, keyset pagination is used
         """
 
         if sort_by != self.SORT_LEADS and sort_by != self.SORT_RATING:
@@ -36,12 +42,14 @@ class RetrieveCourseCatalogCommand:
         self.page = int(page)
         self.sort_by = sort_by
         self.category = category
+        self.after = after
 
 
 class RetrieveCourseCatalog:
     """Use case class to retrieve the course catalog"""
 
     @staticmethod
+    @timed()
     def execute(command: RetrieveCourseCatalogCommand) -> Dict:
         """ Retrieve the course catalog, a list of categories, the current category from database.
             It also returns information to create the paginator
@@ -59,15 +67,16 @@ class RetrieveCourseCatalog:
 
         courses_per_page = 20
         paginator = Paginator(page, items_per_page=courses_per_page)
-        course_repository = CourseRepository(paginator)
+        course_repository = catalog_index.course_repository(paginator)
 
         if sort_by == RetrieveCourseCatalogCommand.SORT_LEADS:
-            courses = course_repository.find_sorted_by_leads(category_id)
+            courses = course_repository.find_sorted_by_leads(category_id, after=command.after)
         if sort_by == RetrieveCourseCatalogCommand.SORT_RATING:
-            courses = course_repository.find_sorted_by_rating(category_id)
+            courses = course_repository.find_sorted_by_rating(category_id, after=command.after)
 
         prev_page = page - 1 if page >= 1 else None
         next_page = page + 1 if page < paginator.page_count else None
+        last_course_id = list(courses.keys())[-1] if len(courses) > 0 else None
 
         category_repository = CategoryRepository()
 
@@ -85,6 +94,7 @@ class RetrieveCourseCatalog:
                 'current_page': page,
                 'total_pages': paginator.page_count,
                 'next_page': next_page,
+                'next_after': last_course_id if next_page else None,
                 'prev_page': prev_page,
                 'sort_by': sort_by}
 
@@ -106,6 +116,7 @@ class RetrieveCourseData:
     """Use case class to retrieve data from a course"""
 
     @staticmethod
+    @timed()
     def execute(command: RetrieveCourseDataCommand):
         """Retrieves data from a course, recommendations based on it and rank based recommendations
 
@@ -115,11 +126,14 @@ class RetrieveCourseData:
         course_repository = CourseRepository()
 
         course = course_repository.find(str(command.course_id))
-        recommender = Recommender()
-        recommender.make_recommendations_by_course(course.id).make_rank_recommendations(course.category_id,
-                                                                                        str(course.id))
+        strategies = [('make_course_page_recommendations', {'course_id': course.id,
+                                                            'category_id': course.category_id})]
+
         if command.user_id:
-            recommender.make_recommendations_for_user(command.user_id)
+            strategies.append(('make_recommendations_for_user', {'user_id': command.user_id}))
+
+        recommender = Recommender()
+        recommender.dispatch(strategies)
 
         return {'course': course,
                 'recommendations': recommender}
@@ -142,6 +156,7 @@ class PlaceAnInfoRequest:
     """Use case class to place an information request"""
 
     @staticmethod
+    @timed()
     def execute(command: PlaceAnInfoRequestCommand) -> Dict:
         """Places an information request and returns recommendations based on the course and the user
 
@@ -149,7 +164,6 @@ class PlaceAnInfoRequest:
         :return: A dictionary with recommendations
         """
         course_repository = CourseRepository()
-        lead_repository = LeadRepository()
 
         course = course_repository.find(command.course_id)
         # Hashing the user email
@@ -159,11 +173,16 @@ class PlaceAnInfoRequest:
         success = True
         recommender = Recommender()
         try:
-            lead_repository.save(lead)
+            lead_writer.write(lead)
             recommender.make_recommendations_by_course(course.id)
         except Exception:
             success = False
 
+        if success and current_app.config.get('RECOMMENDATIONS_STORE_ENABLED', False):
+            # The user and their similar users are refreshed in the background, stale recommendations are served
+            # meanwhile
+            recommendation_refresher.enqueue(user_id, exclude_course_ids=[course.id])
+
         return {
             'success': success,
             'user_id': user_id,
@@ -188,6 +207,7 @@ class RetrieveHomeRecommendations:
     """Use case class to make recommendations to a user"""
 
     @staticmethod
+    @timed()
     def execute(command: RetrieveHomeRecommendationsCommand) -> Dict:
         """Makes recommendations to a specific user
 
@@ -196,7 +216,10 @@ class RetrieveHomeRecommendations:
         """
         recommendations = Recommender()
 
-        recommendations.make_rank_recommendations().make_recommendations_for_user(command.user_id)
+        recommendations.dispatch([('make_rating_recommendations', {}),
+                                  ('make_number_of_leads_recommendations', {}),
+                                  ('make_recommendations_for_user', {'user_id': command.user_id,
+                                                                     'with_user_courses': True})])
 
         category_repository = CategoryRepository()
 
@@ -209,6 +232,7 @@ class RetrieveCategories:
     """Use case class to retrieve a dictionary of popular categories based on the number of leads"""
 
     @staticmethod
+    @timed()
     def execute() -> Dict:
         """Retrieves a list of popular categories
 
@@ -217,3 +241,101 @@ class RetrieveCategories:
         category_repository = CategoryRepository()
 
         return {'categories': category_repository.find_popular(min_weighted_rating=0.0)}
+
+
+class RetrieveBulkRecommendationsCommand:
+    """Request command containing the user identifiers or the course identifiers"""
+
+    def __init__(self, user_ids: List[str] = None, course_ids: List[str] = None, max_recommendations: int = 10):
+        """Initializes the command
+
+        :param user_ids: User identifiers, to make the recommendations of each user
+        :param course_ids: Course identifiers, to make the user interaction based recommendations of each course
+        :param max_recommendations: Maximum number of recommendations of each user or course
+        """
+        if (user_ids is None) == (course_ids is None):
+            raise ValueError('Either user_ids or course_ids must be provided.')
+
+        ids = user_ids if user_ids is not None else course_ids
+        if not isinstance(ids, list) or not all(isinstance(value, (str, int)) and not isinstance(value, bool)
+                                                for value in ids):
+            raise ValueError('Identifiers must be a list of strings.')
+
+        if len(ids) == 0:
+            raise ValueError('At least one identifier must be provided.')
+
+        if not isinstance(max_recommendations, int) or isinstance(max_recommendations, bool) \
+                or max_recommendations < 1:
+            raise ValueError('max_recommendations must be a positive integer.')
+
+        self.user_ids = None if user_ids is None else [str(user_id) for user_id in user_ids]
+        self.course_ids = None if course_ids is None else [str(course_id) for course_id in course_ids]
+        self.max_recommendations = max_recommendations
+
+    @property
+    def ids(self) -> List[str]:
+        """Returns the identifiers of the command, either user or course identifiers
+
+        :return: The identifiers
+        """
+        return self.user_ids if self.user_ids is not None else self.course_ids
+
+
+class RetrieveBulkRecommendations:
+    """Use case class to make the recommendations of many users or courses at once"""
+
+    @staticmethod
+    def execute(command: RetrieveBulkRecommendationsCommand) -> Iterator[Dict]:
+        """Makes the recommendations in batches, each one with a single similarity computation and a single query,
+            and yields them as they are made, in the order of the command
+
+        :param command: Request command containing the user or course identifiers
+        :return: An iterator of dictionaries with a user or course identifier and its recommendations
+        """
+        batch_size = current_app.config.get('BULK_RECOMMENDATIONS_BATCH_SIZE', 500)
+        recommender = Recommender()
+
+        if command.user_ids is not None:
+            key = 'user_id'
+            make_recommendations = recommender.make_recommendations_for_users
+        else:
+            key = 'course_id'
+            make_recommendations = recommender.make_recommendations_by_courses
+
+        for start in range(0, len(command.ids), batch_size):
+            batch = command.ids[start:start + batch_size]
+            recommendations = make_recommendations(batch, max_recommendations=command.max_recommendations)
+
+            for identifier in batch:
+                yield {key: identifier, 'recommendations': recommendations[identifier]}
+
+
+class SearchCoursesCommand:
+    """Request command containing the search query"""
+
+    def __init__(self, query: str, prefix: bool = False):
+        """Initializes the command
+
+        :param query: Text of the query
+        :param prefix: Whether the last word of the query also matches the words that start with it
+        """
+        self.query = (query or '').strip()
+        self.prefix = prefix
+
+
+class SearchCourses:
+    """Use case class to search the courses of the catalog by title and description"""
+
+    @staticmethod
+    @timed()
+    def execute(command: SearchCoursesCommand) -> Dict:
+        """Searches the courses in the search snapshot, which indexes every course of the catalog, listable or not
+
+        :param command: Request command containing the search query
+        :return: A dictionary with the query and the matching courses, sorted by relevance
+        """
+        max_results = current_app.config.get('SEARCH_MAX_SUGGESTIONS' if command.prefix else 'SEARCH_MAX_RESULTS',
+                                             10 if command.prefix else 50)
+        courses = catalog_index.get_search().search(command.query, max_results, command.prefix) if command.query else {}
+
+        return {'query': command.query, 'courses': courses}
@@ -1,10 +1,17 @@
-from flask import render_template, request, abort, session, redirect, url_for
+import hmac
+import json
+from typing import Dict
+from flask import render_template, request, abort, session, redirect, url_for, current_app, Response, jsonify
+from flask import stream_with_context
 from . import main
+from ..page_cache import cached_page
 from .use_cases import RetrieveCourseCatalog, RetrieveCourseCatalogCommand
 from .use_cases import RetrieveCourseData, RetrieveCourseDataCommand
 from .use_cases import PlaceAnInfoRequest, PlaceAnInfoRequestCommand
 from .use_cases import RetrieveHomeRecommendations, RetrieveHomeRecommendationsCommand
 from .use_cases import RetrieveCategories
+from .use_cases import RetrieveBulkRecommendations, RetrieveBulkRecommendationsCommand
+from .use_cases import SearchCourses, SearchCoursesCommand
 
 users = [
     '1460318498c1f53bb880ce2e6d9ef64b',
@@ -47,6 +54,7 @@ def logout():
 
 
 @main.route('/', methods=['GET'])
+@cached_page
 def home():
     command = RetrieveHomeRecommendationsCommand(user_id=session.get('user_id'))
     response = RetrieveHomeRecommendations.execute(command)
@@ -57,6 +65,7 @@ def home():
 
 
 @main.route('/categories', methods=['GET'])
+@cached_page
 def categories():
     response = RetrieveCategories.execute()
 
@@ -64,16 +73,36 @@ def categories():
 
 
 @main.route('/catalog', methods=['GET'])
+@cached_page
 def catalog():
     command = RetrieveCourseCatalogCommand(page=request.args.get('page', default=1),
                                            sort_by=request.args.get('sort_by', default='leads'),
-                                           category=request.args.get('category'))
+                                           category=request.args.get('category'),
+                                           after=request.args.get('after'))
 
     response = RetrieveCourseCatalog.execute(command)
 
     return render_template('course-catalog.html', response=response)
 
 
+@main.route('/search', methods=['GET'])
+@cached_page
+def search():
+    command = SearchCoursesCommand(request.args.get('q'))
+    response = SearchCourses.execute(command)
+
+    return render_template('search.html', response=response)
+
+
+@main.route('/search/suggest', methods=['GET'])
+def search_suggest():
+    command = SearchCoursesCommand(request.args.get('q'), prefix=True)
+    response = SearchCourses.execute(command)
+
+    return jsonify([{'id': str(course_id), 'title': course.title, 'url': url_for('main.course', course_id=course_id)}
+                    for course_id, course in response['courses'].items()])
+
+
 @main.route('/course/<int:course_id>', methods=['GET'])
 def course(course_id):
     command = RetrieveCourseDataCommand(course_id, session.get('user_id'))
@@ -97,3 +126,54 @@ def request_information():
         return abort(500)
 
     return render_template('request-information.html', response=response)
+
+
+@main.route('/api/recommendations', methods=['POST'])
+def bulk_recommendations():
+    # The API is disabled until a token is configured, and clients send it as a bearer token
+    token = current_app.config.get('BULK_RECOMMENDATIONS_TOKEN')
+    if not token:
+        return abort(403)
+
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.encode(), token.encode()):
+        return abort(401)
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return abort(400)
+
+    max_ids = current_app.config.get('BULK_RECOMMENDATIONS_MAX_IDS', 1000)
+
+    try:
+        command = RetrieveBulkRecommendationsCommand(user_ids=body.get('user_ids'),
+                                                     course_ids=body.get('course_ids'),
+                                                     max_recommendations=body.get('max_recommendations', 10))
+    except ValueError as error:
+        return abort(400, str(error))
+
+    if len(command.ids) > max_ids:
+        return abort(413)
+
+    def generate():
+        for result in RetrieveBulkRecommendations.execute(command):
+            result['recommendations'] = [course_to_json(course) for course in result['recommendations'].values()]
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def course_to_json(course) -> Dict:
+    """Returns the fields of a recommended course that are sent by the API
+
+    :param course: Course
+    :return: A dictionary that can be serialized to JSON
+    """
+    return {'id': str(course.id),
+            'title': course.title,
+            'center': course.center,
+            'category_id': course.category_id,
+            'category_name': course.category_name,
+            'number_of_leads': course.number_of_leads,
+            'number_of_reviews': course.number_of_reviews,
+            'weighted_rating': None if course.weighted_rating is None else float(course.weighted_rating)}
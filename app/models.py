@@ -1,14 +1,25 @@
 import math
 import datetime
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Union, List
+from collections import Counter
+from typing import Dict, Any, Union, List, Tuple
+from flask import current_app
 from sqlalchemy.sql import text
 from . import db
+from .cache import MemoryCacheBackend, cached_query, query_cache
+from .lead_delta import lead_delta
 
 
 class Paginator:
     """Paginator class. Allows to make queries to database"""
 
+    # Seconds during which the row count of a query is reused
+    COUNT_CACHE_TTL = 300
+
+    # Row counts of the recent queries. The least recently used ones are evicted beyond QUERY_CACHE_MAX_ENTRIES, and
+    # all of them are removed when the query cache is invalidated
+    _count_cache = MemoryCacheBackend()
+
     def __init__(self, page: int, items_per_page: int):
         """Paginator constructor
 
@@ -22,20 +33,59 @@ class Paginator:
         self.page_count = 0
 
     def set_counts(self, query: str, **params):
-        """Performs a query to database and sets the number of rows and the number o pages
+        """Counts the rows of a query and sets the number of rows and the number o pages. The count is performed
+            wrapping the query in a SELECT COUNT(*) and it is cached for each query and parameters
 
         :param query: Query to database
         :param params: Query parameters
         """
-        result = db.engine.execute(text(query), **params)
+        key = repr((query, tuple(sorted(params.items()))))
+        count_cache = self.count_cache()
+        row_count = count_cache.get(key)
+
+        if row_count is not None:
+            self.set_row_count(row_count)
+            return
+
+        count_query = 'SELECT COUNT(*) AS row_count FROM ({}) AS counted_rows'.format(query)
+        row_count = db.engine.execute(text(count_query), **params).scalar()
+
+        count_cache.set(key, row_count, self.COUNT_CACHE_TTL)
+        self.set_row_count(row_count)
+
+    @classmethod
+    def count_cache(cls) -> MemoryCacheBackend:
+        """Returns the cache of row counts, bounded by the QUERY_CACHE_MAX_ENTRIES setting of the application
+
+        :return: The cache backend
+        """
+        cls._count_cache.max_entries = current_app.config.get('QUERY_CACHE_MAX_ENTRIES', 1024)
+
+        return cls._count_cache
+
+    def set_row_count(self, row_count: int):
+        """Sets the number of rows and the number of pages
 
-        self.row_count = result.rowcount
+        :param row_count: The total number of rows
+        """
+        self.row_count = row_count
         self.page_count = int(math.ceil(self.row_count / self.items_per_page))
 
+    @classmethod
+    def clear_counts(cls):
+        """Removes the cached row counts, so the pages are counted again after leads or courses are written"""
+        cls._count_cache.clear()
+
+
+query_cache.on_invalidate(Paginator.clear_counts)
+
 
 class Repository(ABC):
     """Repository base class. Performs queries to database and builds the response"""
 
+    # Whether responses built with `cached_query` can be served from the query cache
+    cacheable = True
+
     def __init__(self, paginator: Paginator = None):
         """Repository constructor
 
@@ -70,6 +120,19 @@ class Repository(ABC):
 
         return db.engine.execute(text(query), **kwargs)
 
+    @staticmethod
+    def in_clause(name: str, values: List) -> Tuple[str, Dict]:
+        """Creates the placeholders and parameters of an IN clause
+
+        :param name: Parameter base name
+        :param values: Values of the IN clause
+        :return: A tuple with the placeholders, ex: ':name_0, :name_1', and the query parameters
+        """
+        params = {'{}_{}'.format(name, index): value for (index, value) in enumerate(values)}
+        placeholders = ', '.join([':{}'.format(param) for param in params.keys()])
+
+        return placeholders, params
+
     @abstractmethod
     def build_response(self, query: str, **kwargs) -> Any:
         """Creates a collection of entities from a query
@@ -83,6 +146,8 @@ class Repository(ABC):
 class Category:
     """Category entity """
 
+    __slots__ = ('id', 'name', 'number_of_leads', 'weighted_rating')
+
     def __init__(self, id: int, name: str):
         """Category constructor. Initializes the object
 
@@ -110,7 +175,17 @@ class Category:
 
 
 class CategoryRepository(Repository):
-    """Category repository. Manages the queries that concern the categories"""
+    """Category repository. Manages the queries that concern the categories. When the category stats are enabled,
+        the aggregates of the courses of each category are read from the `category_stats` table instead of being
+        computed on each query"""
+
+    @staticmethod
+    def stats_enabled() -> bool:
+        """Returns whether the category aggregates are read from the `category_stats` table
+
+        :return: True if the category stats are enabled in the application config
+        """
+        return current_app.config.get('CATEGORY_STATS_ENABLED', False)
 
     def find_all(self, max_rows: int = None) -> Dict[int, Category]:
         """Returns a collection of categories
@@ -118,6 +193,14 @@ class CategoryRepository(Repository):
         :param max_rows: Maximum number of categories to retrieve
         :return: A collection of categories
         """
+        if self.stats_enabled():
+            query = '''SELECT category_id AS id, name, number_of_courses AS num_courses,
+                        number_of_leads AS cat_number_of_leads, rating_sum / number_of_courses AS cat_weighted_rating
+                         FROM category_stats
+                         ORDER BY num_courses DESC'''
+
+            return self.build_response(query, limit=max_rows)
+
         query = '''SELECT cat.id, cat.name, count(c.category_id) AS num_courses
                      FROM categories cat
                      JOIN courses c ON cat.id = c.category_id
@@ -133,6 +216,16 @@ class CategoryRepository(Repository):
         :param min_weighted_rating: Minimum weighted rating to be listed
         :return: A collection of popular categories
         """
+        if self.stats_enabled():
+            query = '''SELECT category_id AS id, name, number_of_leads AS cat_number_of_leads,
+                        active_rating_sum / active_courses AS cat_weighted_rating
+                         FROM category_stats
+                         WHERE active_courses > 0
+                         AND active_rating_sum / active_courses >= :min_weighted_rating
+                         ORDER BY cat_number_of_leads DESC, cat_weighted_rating DESC'''
+
+            return self.build_response(query, limit=max_rows, min_weighted_rating=min_weighted_rating)
+
         query = '''SELECT cat.id, cat.name, SUM(c.number_of_leads) AS cat_number_of_leads,
                     AVG(c.weighted_rating) AS cat_weighted_rating
                      FROM categories cat
@@ -150,12 +243,18 @@ class CategoryRepository(Repository):
         :param category_id: The category identifier
         :return: A category
         """
-        query = '''SELECT cat.id, cat.name, SUM(c.number_of_leads) AS cat_number_of_leads,
-                    AVG(c.weighted_rating) AS cat_weighted_rating
-                     FROM categories cat
-                     JOIN courses c ON cat.id = c.category_id
-                     WHERE cat.id = :category_id
-                     GROUP BY cat.id, cat.name'''
+        if self.stats_enabled():
+            query = '''SELECT category_id AS id, name, number_of_leads AS cat_number_of_leads,
+                        rating_sum / number_of_courses AS cat_weighted_rating
+                         FROM category_stats
+                         WHERE category_id = :category_id'''
+        else:
+            query = '''SELECT cat.id, cat.name, SUM(c.number_of_leads) AS cat_number_of_leads,
+                        AVG(c.weighted_rating) AS cat_weighted_rating
+                         FROM categories cat
+                         JOIN courses c ON cat.id = c.category_id
+                         WHERE cat.id = :category_id
+                         GROUP BY cat.id, cat.name'''
 
         categories = self.build_response(query, category_id=category_id)
 
@@ -164,6 +263,73 @@ class CategoryRepository(Repository):
 
         return list(categories.values())[0]
 
+    def create_stats_table(self):
+        """Creates the table of category aggregates if it does not exist. Active courses are the courses with leads,
+            the ones considered by `find_popular`. Live leads are the leads saved since the number of leads of the
+            courses was last computed, which are included in the number of leads of the category"""
+        create_sql = '''CREATE TABLE IF NOT EXISTS category_stats (
+                        category_id INT NOT NULL,
+                        name VARCHAR(255) NOT NULL,
+                        number_of_courses INT NOT NULL,
+                        number_of_leads INT NOT NULL,
+                        rating_sum DOUBLE PRECISION NOT NULL,
+                        active_courses INT NOT NULL,
+                        active_rating_sum DOUBLE PRECISION NOT NULL,
+                        live_leads INT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (category_id))'''
+
+        db.engine.execute(text(create_sql))
+
+    def rebuild_stats(self, reset_live_leads: bool = False):
+        """Recomputes the aggregates of every category from the courses table, in a single transaction. The live
+            leads of each category are added to the number of leads of its courses, since the courses table is not
+            updated when a lead is saved
+
+        :param reset_live_leads: Whether to discard the live leads, once the number of leads of the courses has been
+            recomputed from the clean leads and already counts them
+        """
+        insert_sql = '''INSERT INTO category_stats (category_id, name, number_of_courses, number_of_leads, rating_sum,
+                        active_courses, active_rating_sum)
+                        SELECT cat.id, cat.name, COUNT(c.id), SUM(c.number_of_leads), SUM(c.weighted_rating),
+                            SUM(CASE WHEN c.number_of_leads >= 1 THEN 1 ELSE 0 END),
+                            SUM(CASE WHEN c.number_of_leads >= 1 THEN c.weighted_rating ELSE 0 END)
+                        FROM categories cat
+                        JOIN courses c ON cat.id = c.category_id
+                        GROUP BY cat.id, cat.name'''
+
+        update_sql = '''UPDATE category_stats SET number_of_leads = number_of_leads + :live_leads,
+                        live_leads = :live_leads
+                        WHERE category_id = :category_id'''
+
+        with db.engine.begin() as connection:
+            live_leads = [] if reset_live_leads else \
+                [{'category_id': row['category_id'], 'live_leads': row['live_leads']} for row in connection.execute(
+                    text('SELECT category_id, live_leads FROM category_stats WHERE live_leads > 0'))]
+
+            connection.execute(text('DELETE FROM category_stats'))
+            connection.execute(text(insert_sql))
+
+            if live_leads:
+                connection.execute(text(update_sql), live_leads)
+
+        query_cache.invalidate()
+
+    @staticmethod
+    def add_leads(leads_by_course: Dict[str, int], connection):
+        """Adds new leads to the number of leads and the live leads of the categories of their courses. The courses
+            table is left as it is, so courses that get their first lead become active with the next rebuild
+
+        :param leads_by_course: Number of new leads of each course identifier
+        :param connection: Connection of the transaction that saves the leads
+        """
+        update_sql = '''UPDATE category_stats SET number_of_leads = number_of_leads + :leads,
+                            live_leads = live_leads + :leads
+                        WHERE category_id = (SELECT category_id FROM courses WHERE id = :course_id)'''
+
+        connection.execute(text(update_sql), [{'course_id': course_id, 'leads': leads}
+                                              for (course_id, leads) in leads_by_course.items()])
+
+    @cached_query
     def build_response(self, query: str, **kwargs) -> Dict[int, Category]:
         """Executes the query to database and builds a collection of categories from the response
 
@@ -188,6 +354,9 @@ class CategoryRepository(Repository):
 class Course:
     """Course entity. Contains all information about a course"""
 
+    __slots__ = ('id', 'title', '_description', '_description_loaded', 'category', 'center', 'number_of_reviews',
+                 'weighted_rating', 'number_of_leads')
+
     def __init__(self, id: str, title: str, category: Category, center: str):
         """Course constructor. Initializes the object.
 
@@ -198,7 +367,8 @@ class Course:
         """
         self.id = id
         self.title = title
-        self.description = None
+        self._description = None
+        self._description_loaded = True
         self.category = category
         self.center = center
         self.number_of_reviews = None
@@ -231,7 +401,24 @@ class Course:
 
         :param description: The cours description
         """
-        self.description = description
+        self._description = description
+        self._description_loaded = True
+
+    def defer_description(self):
+        """Marks the description as not loaded. It will be retrieved from database the first time it is accessed"""
+        self._description = None
+        self._description_loaded = False
+
+    @property
+    def description(self) -> str:
+        """Returns the course description, retrieving it from database if it has not been loaded yet
+
+        :return: The course description
+        """
+        if not self._description_loaded:
+            self.set_description(CourseRepository().find_description(self.id))
+
+        return self._description
 
     @property
     def category_name(self) -> str:
@@ -253,12 +440,45 @@ class Course:
 class CourseRepository(Repository):
     """Category repository. Manages the queries that concern the courses"""
 
+    def __init__(self, paginator: Paginator = None):
+        """CourseRepository constructor
+
+        :param paginator: Paginator class. If None, queries wont be paginated
+        """
+        super().__init__(paginator)
+        self.categories = {}
+
+    # Sortable columns and the expression used to compare them in keyset conditions
+    SORT_COLUMNS = {'number_of_leads': '{}number_of_leads',
+                    'weighted_rating': 'ROUND({}weighted_rating, 2)',
+                    'num_reviews': '{}num_reviews',
+                    'c.id': '{}id'}
+
+    def find_all(self, with_description: bool = True) -> Dict[str, Course]:
+        """Returns every course of the catalog, whatever its number of leads and weighted rating, sorted by number of
+            leads
+
+        :param with_description: Whether to retrieve the descriptions. If False, they are loaded on access
+        :return: A collection of courses
+        """
+        description = 'c.description, ' if with_description else ''
+        query = '''SELECT c.id, c.title, {}c.category_id, cat.name AS category_name, c.center,
+                        c.number_of_leads, c.num_reviews, ROUND(c.weighted_rating, 2) AS weighted_rating
+                   FROM courses c
+                   JOIN categories cat ON c.category_id = cat.id
+                   ORDER BY c.number_of_leads DESC, ROUND(c.weighted_rating, 2) DESC, c.num_reviews DESC,
+                        c.id DESC'''.format(description)
+
+        return self.build_response(query)
+
     def find_all_by(self, category: int = None,
                     max_rows: int = None,
                     exclude: str = None,
                     min_number_of_leads: int = 1,
                     min_weighted_rating: float = 7.0,
-                    order_by: Union[Dict, List] = None) -> Dict[str, Course]:
+                    order_by: Union[Dict, List] = None,
+                    after: str = None,
+                    with_description: bool = True) -> Dict[str, Course]:
         """Returns a collection of courses that meet the parameters provided
 
         :param category: Category identifier
@@ -269,15 +489,19 @@ class CourseRepository(Repository):
         :param order_by: Columns by which the result will be sorted. It can be a list of columns and the result sorting
             will be in ascending order; or a dictionary whose keys must be the column names and the values must be the
             sorting direction of that column. Ex: {'num_reviews': 'ASC', 'weighted_rating': 'DESC'}
+        :param after: Identifier of the last course of the previous page. If provided, keyset pagination is used: the
+            courses that follow it in the sort order are retrieved instead of skipping rows with an offset
+        :param with_description: Whether to retrieve the descriptions. If False, they are loaded on access
         :return: A collection of courses
         """
-        query = '''SELECT c.id, c.title, c.description, c.category_id, cat.name AS category_name, c.center,
+        description = 'c.description, ' if with_description else ''
+        query = '''SELECT c.id, c.title, {}c.category_id, cat.name AS category_name, c.center,
                         c.number_of_leads, c.num_reviews, ROUND(c.weighted_rating, 2) AS weighted_rating
                    FROM courses c 
                    JOIN categories cat ON c.category_id = cat.id
                    WHERE c.number_of_leads >= :min_number_of_leads
                    AND c.weighted_rating >= :min_weighted_rating
-                   '''
+                   '''.format(description)
 
         if category:
             query = '{} AND c.category_id = :category_id'.format(query)
@@ -285,51 +509,107 @@ class CourseRepository(Repository):
         if exclude:
             query = '{} AND c.id <> :course_id'.format(query)
 
-        query = '{} GROUP BY c.id'.format(query)
+        params = {'category_id': category,
+                  'course_id': exclude,
+                  'min_number_of_leads': min_number_of_leads,
+                  'min_weighted_rating': min_weighted_rating}
 
-        if order_by:
-            if isinstance(order_by, list):
-                order_by = ', '.join(order_by)
-            elif isinstance(order_by, dict):
-                order_by = ', '.join([key + ' ' + value for (key, value) in order_by.items()])
+        if after:
+            seek_query = '{} AND {}'.format(query, self.keyset_condition(order_by))
+            seek_query = self.sorted_query('{} GROUP BY c.id'.format(seek_query), order_by)
 
-            query = '{} ORDER BY {}'.format(query, order_by)
+            # The count and page size are taken from the paginator, but rows are not skipped with an offset
+            if self.paginator:
+                self.paginator.set_counts(self.sorted_query('{} GROUP BY c.id'.format(query), order_by), **params)
+                max_rows = self.paginator.items_per_page
 
-        return self.build_response(query, limit=max_rows,
-                                   category_id=category,
-                                   course_id=exclude,
-                                   min_number_of_leads=min_number_of_leads,
-                                   min_weighted_rating=min_weighted_rating)
+            return self.build_response(seek_query, limit=max_rows, after_id=after, **params)
+
+        query = self.sorted_query('{} GROUP BY c.id'.format(query), order_by)
+
+        return self.build_response(query, limit=max_rows, **params)
+
+    @staticmethod
+    def sorted_query(query: str, order_by: Union[Dict, List] = None) -> str:
+        """Adds the ORDER BY clause to a query
+
+        :param query: Query to database
+        :param order_by: Columns by which the result will be sorted. See `find_all_by`
+        :return: The sorted query
+        """
+        if not order_by:
+            return query
+
+        if isinstance(order_by, list):
+            order_by = ', '.join(order_by)
+        elif isinstance(order_by, dict):
+            order_by = ', '.join([key + ' ' + value for (key, value) in order_by.items()])
+
+        return '{} ORDER BY {}'.format(query, order_by)
+
+    def keyset_condition(self, order_by: Dict) -> str:
+        """Creates the condition that selects the courses following the :after_id course in the sort order
+
+        :param order_by: Columns by which the result is sorted. All of them must be sorted in the same direction and
+            the last one must be unique
+        :return: A row comparison condition
+        """
+        if not isinstance(order_by, dict) or len(set([value.upper() for value in order_by.values()])) != 1:
+            raise ValueError('Keyset pagination requires all columns to be sorted in the same direction')
+
+        unknown_columns = set(order_by.keys()) - set(self.SORT_COLUMNS.keys())
+        if unknown_columns:
+            raise ValueError('Keyset pagination is not supported on columns {}'.format(', '.join(unknown_columns)))
+
+        operator = '<' if list(order_by.values())[0].upper() == 'DESC' else '>'
+        columns = ', '.join([self.SORT_COLUMNS[key].format('c.') for key in order_by.keys()])
+        after_columns = ', '.join([self.SORT_COLUMNS[key].format('') for key in order_by.keys()])
+
+        return '({}) {} (SELECT {} FROM courses WHERE id = :after_id)'.format(columns, operator, after_columns)
 
     def find_sorted_by_leads(self, category: int = None,
                              max_rows: int = None,
-                             exclude: str = None) -> Dict[str, Course]:
+                             exclude: str = None,
+                             after: str = None,
+                             with_description: bool = True) -> Dict[str, Course]:
         """Returns a collection of courses sorted by number of leads
 
         :param category: Category to which the courses belong
         :param max_rows: Maximum number of courses to retrieve. The limit in the select query
         :param exclude: Course ids excluded from search
+        :param after: Identifier of the last course of the previous page, to use keyset pagination
+        :param with_description: Whether to retrieve the descriptions. If False, they are loaded on access
         :return: A collection of courses
         """
         return self.find_all_by(category=category,
                                 max_rows=max_rows,
                                 exclude=exclude,
-                                order_by={'number_of_leads': 'DESC', 'weighted_rating': 'DESC', 'num_reviews': 'DESC'})
+                                order_by={'number_of_leads': 'DESC', 'weighted_rating': 'DESC', 'num_reviews': 'DESC',
+                                          'c.id': 'DESC'},
+                                after=after,
+                                with_description=with_description)
 
     def find_sorted_by_rating(self, category: int = None,
                               max_rows: int = None,
-                              exclude: str = None) -> Dict[str, Course]:
+                              exclude: str = None,
+                              after: str = None,
+                              with_description: bool = True) -> Dict[str, Course]:
         """Returns a collection of courses sorted by weighted rating
 
         :param category: Category to which the courses belong
         :param max_rows: Maximum number of courses to retrieve. The limit in the select query
         :param exclude: Course ids excluded from search
+        :param after: Identifier of the last course of the previous page, to use keyset pagination
+        :param with_description: Whether to retrieve the descriptions. If False, they are loaded on access
         :return: A collection of courses
         """
         return self.find_all_by(category=category,
                                 max_rows=max_rows,
                                 exclude=exclude,
-                                order_by={'weighted_rating': 'DESC', 'num_reviews': 'DESC', 'number_of_leads': 'DESC'})
+                                order_by={'weighted_rating': 'DESC', 'num_reviews': 'DESC', 'number_of_leads': 'DESC',
+                                          'c.id': 'DESC'},
+                                after=after,
+                                with_description=with_description)
 
     def find_similar_by_leads(self, course_id: str, max_rows: int = None) -> Dict[str, Course]:
         """Returns a collection of recommended courses. The courses have in common that the same user generated a
@@ -340,7 +620,7 @@ class CourseRepository(Repository):
         :return: A collection of similar courses
         """
 
-        query = '''SELECT r.recommended AS id, c.title, c.description, c.category_id, cat.name AS category_name,
+        query = '''SELECT r.recommended AS id, c.title, c.category_id, cat.name AS category_name,
                     c.center, c.number_of_leads, c.num_reviews, ROUND(c.weighted_rating, 2) AS weighted_rating
                 FROM recommended_courses_by_leads r
                 JOIN courses c ON r.recommended = c.id
@@ -357,7 +637,7 @@ class CourseRepository(Repository):
         :param max_rows: Maximum number of courses to retrieve. The limit in the select query
         :return: A collection of similar courses
         """
-        query = '''SELECT cs.another_course_id AS id, c.title, c.description, c.category_id, cat.name AS category_name,
+        query = '''SELECT cs.another_course_id AS id, c.title, c.category_id, cat.name AS category_name,
                     c.center, c.number_of_leads, c.num_reviews, ROUND(c.weighted_rating, 2) AS weighted_rating 
                 FROM courses_similarities cs
                 JOIN courses c ON cs.another_course_id = c.id
@@ -367,13 +647,116 @@ class CourseRepository(Repository):
 
         return self.build_response(query, course_id=course_id, limit=max_rows)
 
+    def find_by_ids(self, course_ids: List[str], with_description: bool = False) -> Dict[str, Course]:
+        """Returns the courses with the supplied identifiers
+
+        :param course_ids: Course identifiers
+        :param with_description: Whether to retrieve the descriptions. If False, they are loaded on access
+        :return: A collection of courses. The order is not guaranteed
+        """
+        if len(course_ids) == 0:
+            return {}
+
+        placeholders, params = self.in_clause('course_id', course_ids)
+        description = 'c.description, ' if with_description else ''
+
+        query = '''SELECT c.id, c.title, {}c.center, c.category_id, cat.name AS category_name,
+                   c.number_of_leads, c.num_reviews, ROUND(c.weighted_rating, 2) AS weighted_rating
+                FROM courses c
+                JOIN categories cat ON c.category_id = cat.id
+                WHERE c.id IN ({})'''.format(description, placeholders)
+
+        return self.build_response(query, **params)
+
+    def find_course_recommendations(self, course_id: str, category_id: int = None, max_rows: int = 10,
+                                    with_ranks: bool = True, min_number_of_leads: int = 1,
+                                    min_weighted_rating: float = 7.0) -> Dict[str, Dict[str, Course]]:
+        """Returns the recommendation lists of a course page in two queries: one that retrieves the identifiers of
+            every list and one that builds the courses of all of them. Courses in several lists are the same object
+
+        :param course_id: Course identifier from which we want to look for recommendations
+        :param category_id: Category of the course, to rank the courses of the same category
+        :param max_rows: Maximum number of courses of each list
+        :param with_ranks: Whether to retrieve the lists sorted by rating and by number of leads
+        :param min_number_of_leads: Minimum number of leads of the courses sorted by rating and by number of leads
+        :param min_weighted_rating: Minimum weighted rating of the courses sorted by rating and by number of leads
+        :return: A collection of courses for each list: by_leads, by_content, and by_rating and by_number_of_leads if
+            with_ranks is True
+        """
+        sections = ['''SELECT 'by_leads' AS section, ids.id, NULL AS score FROM (
+                        SELECT r.recommended AS id
+                        FROM recommended_courses_by_leads r
+                        JOIN courses c ON r.recommended = c.id
+                        WHERE r.course = :course_id
+                        ORDER BY c.number_of_leads DESC, ROUND(c.weighted_rating, 2) DESC, c.num_reviews DESC
+                        LIMIT :max_rows) ids''',
+                    '''SELECT 'by_content' AS section, ids.id, ids.similarity AS score FROM (
+                        SELECT cs.another_course_id AS id, cs.similarity
+                        FROM courses_similarities cs
+                        WHERE cs.a_course_id = :course_id
+                        ORDER BY cs.similarity DESC
+                        LIMIT :max_rows) ids''']
+
+        if with_ranks:
+            ranked = '''SELECT '{}' AS section, ids.id, NULL AS score FROM (
+                        SELECT c.id
+                        FROM courses c
+                        WHERE c.number_of_leads >= :min_number_of_leads
+                        AND c.weighted_rating >= :min_weighted_rating
+                        AND c.id <> :course_id {}
+                        ORDER BY {}
+                        LIMIT :max_rows) ids'''
+            category = 'AND c.category_id = :category_id' if category_id else ''
+
+            sections.append(ranked.format('by_rating', category, 'ROUND(c.weighted_rating, 2) DESC, '
+                                                                 'c.num_reviews DESC, c.number_of_leads DESC, '
+                                                                 'c.id DESC'))
+            sections.append(ranked.format('by_number_of_leads', category, 'c.number_of_leads DESC, '
+                                                                          'ROUND(c.weighted_rating, 2) DESC, '
+                                                                          'c.num_reviews DESC, c.id DESC'))
+
+        result = self.execute(' UNION ALL '.join(sections), course_id=course_id, category_id=category_id,
+                              max_rows=max_rows, min_number_of_leads=min_number_of_leads,
+                              min_weighted_rating=min_weighted_rating)
+
+        section_ids = {'by_leads': [], 'by_content': []}
+        if with_ranks:
+            section_ids.update({'by_rating': [], 'by_number_of_leads': []})
+
+        scores = {}
+        for row in result:
+            section_ids[row['section']].append(row['id'])
+            if row['section'] == 'by_content':
+                scores[row['id']] = row['score']
+
+        courses = self.find_by_ids(list(set([course_id for ids in section_ids.values() for course_id in ids])))
+
+        # The order of the rows of a union is not guaranteed, so each list is sorted again
+        sort_keys = {'by_leads': lambda course: (-(course.number_of_leads or 0), -(course.weighted_rating or 0),
+                                                 -(course.number_of_reviews or 0)),
+                     'by_content': lambda course: -scores[course.id],
+                     'by_rating': lambda course: (-(course.weighted_rating or 0), -(course.number_of_reviews or 0),
+                                                  -(course.number_of_leads or 0)),
+                     'by_number_of_leads': lambda course: (-(course.number_of_leads or 0),
+                                                           -(course.weighted_rating or 0),
+                                                           -(course.number_of_reviews or 0))}
+
+        recommendations = {}
+        for section, ids in section_ids.items():
+            section_courses = sorted([courses[course_id] for course_id in ids if course_id in courses],
+                                     key=lambda course: course.id, reverse=True)
+            section_courses = sorted(section_courses, key=sort_keys[section])
+            recommendations[section] = {course.id: course for course in section_courses}
+
+        return recommendations
+
     def find_requested_by_user(self, user_id: str) -> Dict[str, Course]:
         """Returns a collection of courses to which a user has generated a lead
 
         :param user_id: User identifier that generated the leads
         :return: A collection  of courses to which the same user has generated a lead
         """
-        query = '''SELECT c.id, c.title, c.description, c.center, c.category_id, cat.name AS category_name,
+        query = '''SELECT c.id, c.title, c.center, c.category_id, cat.name AS category_name,
                    c.number_of_leads, c.num_reviews, ROUND(c.weighted_rating, 2) AS weighted_rating
                 FROM clean_leads l
                 JOIN courses c ON l.course_id = c.id
@@ -382,6 +765,36 @@ class CourseRepository(Repository):
 
         return self.build_response(query, user_id=user_id)
 
+    def find_requested_by_users(self, user_ids: List[str]) -> Dict[str, Dict[str, Course]]:
+        """Returns the courses to which each one of several users has generated a lead, in a single query
+
+        :param user_ids: User identifiers that generated the leads
+        :return: A collection of courses for each user, indexed by user identifier
+        """
+        if len(user_ids) == 0:
+            return {}
+
+        placeholders, params = self.in_clause('user_id', user_ids)
+
+        query = '''SELECT l.user_id, c.id, c.title, c.center, c.category_id,
+                   cat.name AS category_name, c.number_of_leads, c.num_reviews,
+                   ROUND(c.weighted_rating, 2) AS weighted_rating
+                FROM clean_leads l
+                JOIN courses c ON l.course_id = c.id
+                JOIN categories cat ON c.category_id = cat.id
+                WHERE l.user_id IN ({})'''.format(placeholders)
+
+        users_courses = {}
+        courses = {}
+
+        for row in self.execute(query, **params):
+            if row['id'] not in courses:
+                courses[row['id']] = self.build_course(row, with_description=False)
+
+            users_courses.setdefault(row['user_id'], {})[row['id']] = courses[row['id']]
+
+        return users_courses
+
     def find(self, course_id: str) -> Course:
         """Returns the course entity with the supplied identifier
 
@@ -402,6 +815,17 @@ class CourseRepository(Repository):
 
         return list(courses.values())[0]
 
+    def find_description(self, course_id: str) -> str:
+        """Returns the description of a course
+
+        :param course_id: The course identifier
+        :return: The course description
+        """
+        query = 'SELECT description FROM courses WHERE id = :course_id'
+
+        return db.engine.execute(text(query), course_id=course_id).scalar()
+
+    @cached_query
     def build_response(self, query: str, **kwargs) -> Dict[str, Course]:
         """Executes the query to database and builds a collection of courses from the response
 
@@ -411,28 +835,59 @@ class CourseRepository(Repository):
         """
         courses = {}
         result = self.execute(query, **kwargs)
+        with_description = 'description' in result.keys()
 
         for row in result:
-            course = Course(row['id'],
-                            row['title'],
-                            Category(row['category_id'], row['category_name']),
-                            row['center'])
-
-            if row['description']:
-                course.set_description(row['description'])
-
-            course.set_weighted_rating(row['weighted_rating'])
-            course.set_number_of_reviews(row['num_reviews'])
-            course.set_number_of_leads(row['number_of_leads'])
+            course = self.build_course(row, with_description)
 
             courses[course.id] = course
 
         return courses
 
+    def build_course(self, row, with_description: bool = True) -> Course:
+        """Builds a course entity from a row of the response
+
+        :param row: Row of the query response
+        :param with_description: Whether the row contains the description. If not, it will be loaded on access
+        :return: A course
+        """
+        course = Course(row['id'],
+                        row['title'],
+                        self.category(row['category_id'], row['category_name']),
+                        row['center'])
+
+        if not with_description:
+            course.defer_description()
+        elif row['description']:
+            course.set_description(row['description'])
+
+        course.set_weighted_rating(row['weighted_rating'])
+        course.set_number_of_reviews(row['num_reviews'])
+        course.set_number_of_leads(row['number_of_leads'])
+
+        return course
+
+    def category(self, category_id: int, category_name: str) -> Category:
+        """Returns the category of a course. Categories are shared by all the courses built by this repository
+
+        :param category_id: Category identifier
+        :param category_name: Category name
+        :return: A category
+        """
+        category = self.categories.get(category_id)
+
+        if category is None:
+            category = Category(category_id, category_name)
+            self.categories[category_id] = category
+
+        return category
+
 
 class Lead:
     """Lead entity. Contains all information about a lead and the course"""
 
+    __slots__ = ('user_id', 'course', 'created_on')
+
     def __init__(self, user_id: str, course: Course, created_on: str = None):
         """Lead constructor. Initializes the object
 
@@ -452,6 +907,19 @@ class Lead:
         """
         return self.course.id
 
+    def to_record(self) -> Dict:
+        """Returns the values of the lead that are persisted
+
+        :return: A dictionary whose keys are the columns of the leads table
+        """
+        return {'user_id': self.user_id,
+                'course_id': self.course_id,
+                'course_title': self.course.title,
+                'course_description': self.course.description,
+                'center': self.course.center,
+                'course_category': self.course.category_name,
+                'created_on': str(self.created_on)}
+
 
 class LeadRepository(Repository):
     """Lead repository. Manages the queries that concern the leads"""
@@ -464,16 +932,103 @@ class LeadRepository(Repository):
 
         :param lead: The lead to persist
         """
-        insert_sql = '''INSERT INTO leads (user_id, course_id, course_title, 
+        self.save_many([lead.to_record()])
+
+    def save_many(self, records: List[Dict]):
+        """Persists several leads into the database with a single multi-row insert. If enabled, the category stats
+            are updated in the same transaction
+
+        :param records: The leads to persist, as returned by `Lead.to_record`
+        """
+        if len(records) == 0:
+            return
+
+        values = []
+        params = {}
+        columns = ['user_id', 'course_id', 'course_title', 'course_description', 'center', 'course_category',
+                   'created_on']
+
+        for index, record in enumerate(records):
+            values.append('({})'.format(', '.join([':{}_{}'.format(column, index) for column in columns])))
+            params.update({'{}_{}'.format(column, index): record[column] for column in columns})
+
+        insert_sql = '''INSERT INTO leads (user_id, course_id, course_title,
                         course_description, center, course_category, created_on)
-                        VALUES (:user_id, :course_id, :course_title, :course_description,
-                        :center, :course_category, :created_on)'''
-
-        self.execute(insert_sql,
-                     user_id=lead.user_id,
-                     course_id=lead.course_id,
-                     course_title=lead.course.title,
-                     course_description=lead.course.description,
-                     center=lead.course.center,
-                     course_category=lead.course.category_name,
-                     created_on=lead.created_on)
+                        VALUES {}'''.format(', '.join(values))
+
+        with db.engine.begin() as connection:
+            connection.execute(text(insert_sql), **params)
+
+            if CategoryRepository.stats_enabled():
+                CategoryRepository.add_leads(Counter([record['course_id'] for record in records]), connection)
+
+        lead_delta.add([(record['user_id'], record['course_id']) for record in records])
+        query_cache.invalidate()
+
+
+class UserRecommendationRepository(CourseRepository):
+    """User recommendation repository. Manages the precomputed recommendations of each user"""
+
+    # Recommendations are replaced one user at a time, so they are always read from database
+    cacheable = False
+
+    def create_table(self):
+        """Creates the table of precomputed recommendations if it does not exist"""
+        create_sql = '''CREATE TABLE IF NOT EXISTS user_recommendations (
+                        user_id VARCHAR(32) NOT NULL,
+                        position INT NOT NULL,
+                        course_id VARCHAR(32) NOT NULL,
+                        PRIMARY KEY (user_id, position))'''
+
+        db.engine.execute(text(create_sql))
+
+    def find_by_user(self, user_id: str, max_rows: int = None) -> Dict[str, Course]:
+        """Returns the precomputed recommendations of a user, sorted by relevance
+
+        :param user_id: User identifier
+        :param max_rows: Maximum number of courses to retrieve. The limit in the select query
+        :return: A collection of recommended courses
+        """
+        query = '''SELECT c.id, c.title, c.center, c.category_id, cat.name AS category_name,
+                   c.number_of_leads, c.num_reviews, ROUND(c.weighted_rating, 2) AS weighted_rating
+                FROM user_recommendations r
+                JOIN courses c ON r.course_id = c.id
+                JOIN categories cat ON c.category_id = cat.id
+                WHERE r.user_id = :user_id
+                ORDER BY r.position'''
+
+        return self.build_response(query, user_id=user_id, limit=max_rows)
+
+    def save(self, user_id: str, course_ids: List[str]):
+        """Replaces the precomputed recommendations of a user
+
+        :param user_id: User identifier
+        :param course_ids: Recommended course identifiers, sorted by relevance
+        """
+        self.save_many({user_id: course_ids})
+
+    def save_many(self, recommendations: Dict[str, List[str]]):
+        """Replaces the precomputed recommendations of several users in a single transaction, with a single
+            multi-row insert
+
+        :param recommendations: Recommended course identifiers of each user, sorted by relevance
+        """
+        if len(recommendations) == 0:
+            return
+
+        placeholders, user_params = self.in_clause('user_id', list(recommendations.keys()))
+        params = dict(user_params)
+        values = []
+
+        for user_index, course_ids in enumerate(recommendations.values()):
+            for position, course_id in enumerate(course_ids):
+                values.append('(:user_id_{0}, {1}, :course_id_{0}_{1})'.format(user_index, position))
+                params['course_id_{}_{}'.format(user_index, position)] = course_id
+
+        with db.engine.begin() as connection:
+            delete_sql = 'DELETE FROM user_recommendations WHERE user_id IN ({})'.format(placeholders)
+            connection.execute(text(delete_sql), **user_params)
+
+            if values:
+                insert_sql = 'INSERT INTO user_recommendations (user_id, position, course_id) VALUES {}'
+                connection.execute(text(insert_sql.format(', '.join(values))), **params)
@@ -0,0 +1,205 @@
+import os
+import time
+import atexit
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from scipy import sparse
+from typing import List, Optional, Tuple
+from .lead_matrix import LeadMatrix
+from .similarity import top_k_indexes
+
+# Lead matrix opened by each search process, with the modification time of its file
+_shard_matrix = None
+_shard_mtime = None
+
+
+def score_shard(path: str, mtime: float, shape: Tuple[int, int], start: int, end: int, columns: np.ndarray,
+                min_similarity: int, k: Optional[int], exclude_row: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Scores the users of a shard of the lead matrix against a set of courses. Runs in a search process, which
+        memory maps the lead matrix file, so the shards are shared through the page cache instead of being copied
+
+    :param path: Path to the lead matrix file
+    :param mtime: Modification time of the file opened by the requesting process. The shard process reopens the file
+        when it changes
+    :param shape: Shape of the matrix opened by the requesting process
+    :param start: First row of the shard
+    :param end: Row after the last row of the shard
+    :param columns: Columns of the courses
+    :param min_similarity: Minimum similarity of the users returned
+    :param k: Maximum number of users returned. If None, all the users with the minimum similarity are returned
+    :param exclude_row: Row of the user whose neighbours are searched, which is never returned
+    :return: The rows of the most similar users of the shard and their similarities
+    """
+    global _shard_matrix, _shard_mtime
+
+    if _shard_matrix is None or _shard_mtime != mtime:
+        _shard_matrix = LeadMatrix.open(path)
+        _shard_mtime = _shard_matrix.mtime
+
+    # The file was replaced after the requesting process opened it, so rows may not match
+    if _shard_mtime != mtime or _shard_matrix.matrix.shape != tuple(shape):
+        raise RuntimeError('The lead matrix file has changed')
+
+    vector = sparse.csr_matrix((np.ones(len(columns), dtype=np.float32), (np.zeros(len(columns)), columns)),
+                               shape=(1, shape[1]))
+    similarities = np.asarray(_shard_matrix.matrix[start:end].dot(vector.T).todense()).ravel()
+
+    if start <= exclude_row < end:
+        similarities[exclude_row - start] = 0
+
+    candidates = np.flatnonzero(similarities >= min_similarity)
+    if k is not None:
+        candidates = candidates[top_k_indexes(similarities[candidates], k, candidates)]
+
+    return candidates + start, similarities[candidates]
+
+
+class ShardedNeighbourSearch:
+    """Exact neighbour search over row shards of the lead matrix, scored in parallel by a persistent pool of
+        processes. Each shard returns its most similar users, and they are merged into the global ones"""
+
+    def __init__(self, app=None):
+        """ShardedNeighbourSearch constructor
+
+        :param app: Flask application. If provided, the search is configured from it
+        """
+        self.app = None
+        self.processes = 0
+        self.shards = None
+        self.min_users = 100000
+        self.timeout = 2.0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        # A single handler shuts down the pool that is current when the process exits
+        atexit.register(self.shutdown)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the search from the application config
+
+        :param app: Flask application
+        """
+        self.app = app
+        self.processes = app.config.get('NEIGHBOUR_SEARCH_PROCESSES', self.processes)
+        self.shards = app.config.get('NEIGHBOUR_SEARCH_SHARDS', self.shards)
+        self.min_users = app.config.get('NEIGHBOUR_SEARCH_MIN_USERS', self.min_users)
+        self.timeout = app.config.get('NEIGHBOUR_SEARCH_TIMEOUT', self.timeout)
+
+    def applies(self, lead_matrix: LeadMatrix) -> bool:
+        """Returns whether the neighbours of a lead matrix are searched in the process pool. Only memory mapped
+            files can be shared with the pool, and small matrices are faster to score in the requesting process
+
+        :param lead_matrix: Lead matrix
+        :return: True if the search is sharded
+        """
+        return self.processes > 0 and lead_matrix.path is not None and lead_matrix.number_of_users >= self.min_users
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """Returns the process pool, created on first use so that each worker process has its own. Search processes
+            are spawned, since forking a process with running threads is not safe
+
+        :return: The process pool
+        """
+        if self._pid != os.getpid() or self._executor is None:
+            with self._lock:
+                if self._pid != os.getpid() or self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                    self._pid = os.getpid()
+
+        return self._executor
+
+    def reset(self, executor: ProcessPoolExecutor, terminate: bool = False):
+        """Shuts down a broken or stuck process pool, so that the next search creates a new one
+
+        :param executor: The process pool
+        :param terminate: Whether to terminate its processes, which may be stuck scoring a shard
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+        if terminate:
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                process.terminate()
+
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        """Shuts down the process pool of the current process, if it has one"""
+        executor = self._executor
+
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=False)
+
+    def shard_bounds(self, matrix: sparse.csr_matrix) -> List[Tuple[int, int]]:
+        """Splits the rows of a matrix in shards with about the same number of leads
+
+        :param matrix: Lead matrix
+        :return: List of tuples with the first row and the row after the last row of each shard
+        """
+        shards = self.shards or self.processes
+        bounds = np.searchsorted(matrix.indptr, np.linspace(0, matrix.nnz, shards + 1)[1:-1])
+        bounds = np.unique(np.concatenate([[0], bounds, [matrix.shape[0]]]))
+
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    def search(self, leads, user_row: int, user_vector: sparse.csr_matrix, min_similarity: int = 1,
+               max_neighbours: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Finds the users most similar to a user. Users of the base matrix are scored by the process pool, and users
+            with leads laid over it are scored again with them. If the pool fails or does not score every shard within
+            the timeout, every user is scored in the requesting process, and a broken or stuck pool is replaced by the
+            next search
+
+        :param leads: Lead matrix or lead overlay returned by `LeadDelta.overlay`
+        :param user_row: Row of the user
+        :param user_vector: Courses requested by the user
+        :param min_similarity: Minimum similarity of the users returned
+        :param max_neighbours: Maximum number of users returned. If None, all similar users are returned
+        :return: The rows of the candidate users and their similarities
+        """
+        base = getattr(leads, 'base', leads)
+        changed_rows = getattr(leads, 'changed_rows', np.array([], dtype=np.int64))
+
+        # Changed users may take the place of unchanged ones in the top of a shard, so more users are requested
+        k = None if max_neighbours is None else max_neighbours + len(changed_rows)
+        columns = user_vector.indices.astype(np.int64)
+        executor = self.executor
+
+        try:
+            futures = [executor.submit(score_shard, base.path, base.mtime, base.matrix.shape, start, end, columns,
+                                       min_similarity, k, user_row)
+                       for (start, end) in self.shard_bounds(base.matrix)]
+            deadline = time.monotonic() + self.timeout
+            results = [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+        except Exception as error:
+            if isinstance(error, TimeoutError):
+                self.app.logger.warning('Neighbour search timed out in the process pool, the pool is replaced')
+                self.reset(executor, terminate=True)
+            else:
+                self.app.logger.exception('Unable to search the neighbours in the process pool')
+                if isinstance(error, BrokenProcessPool):
+                    self.reset(executor)
+            rows = np.arange(leads.number_of_users)
+            return rows, leads.similarities(user_vector, rows)
+
+        rows = np.concatenate([result[0] for result in results])
+        similarities = np.concatenate([result[1] for result in results])
+
+        if len(changed_rows) > 0:
+            unchanged = ~np.isin(rows, changed_rows)
+            rows = np.concatenate([rows[unchanged], changed_rows])
+            similarities = np.concatenate([similarities[unchanged], leads.similarities(user_vector, changed_rows)])
+
+        return rows, similarities
+
+
+sharded_search = ShardedNeighbourSearch()
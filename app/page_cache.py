@@ -0,0 +1,211 @@
+import os
+import time
+import uuid
+import hashlib
+import datetime
+import functools
+from typing import Callable, List
+from flask import make_response, request, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from .cache import QueryCache, query_cache
+
+
+class PageCache:
+    """Cache of rendered pages and template fragments. Pages are keyed on the route, the query string and the logged
+        in user, and are served with an ETag and a Last-Modified date, so clients revalidate them with conditional
+        requests. Both caches are cleared each time the query cache is invalidated, and their generation, part of
+        every key, is changed for all the workers of the host, so workers with their own memory backend do not serve
+        pages or fragments rendered before a lead was saved by another worker"""
+
+    def __init__(self, app=None):
+        """PageCache constructor
+
+        :param app: Flask application. If provided, the cache is configured from it
+        """
+        self.backend = None
+        self.ttl = 60
+        self.fragment_ttl = 300
+        self.max_age = 0
+        self.generation_path = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the cache from the application config. The fragment extension is always registered, and renders
+            fragments without caching them when no backend is configured
+
+        :param app: Flask application
+        """
+        self.ttl = app.config.get('PAGE_CACHE_TTL', self.ttl)
+        self.fragment_ttl = app.config.get('PAGE_CACHE_FRAGMENT_TTL', self.fragment_ttl)
+        self.max_age = app.config.get('PAGE_CACHE_MAX_AGE', self.max_age)
+        self.backend = QueryCache.create_backend('PAGE_CACHE_BACKEND', app.config.get('PAGE_CACHE_BACKEND'),
+                                                 app.config.get('PAGE_CACHE_MAX_ENTRIES', 1024),
+                                                 app.config.get('PAGE_CACHE_PATH'))
+        self.generation_path = os.path.splitext(app.config.get('PAGE_CACHE_PATH'))[0] + '.generation'
+
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+        if self.enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(self.generation_path)), mode=0o700, exist_ok=True)
+            query_cache.on_invalidate(self.clear)
+
+    @property
+    def enabled(self) -> bool:
+        """Returns whether a backend is configured
+
+        :return: True if pages and fragments are cached
+        """
+        return self.backend is not None
+
+    def clear(self):
+        """Removes all cached pages and fragments, and changes the generation of the caches of the other workers"""
+        if self.enabled:
+            self.backend.clear()
+            self.next_generation()
+
+    def generation(self) -> str:
+        """Returns the current generation of the cached pages and fragments, shared by the workers of the host
+
+        :return: The generation token or an empty string if the caches have never been invalidated
+        """
+        try:
+            with open(self.generation_path) as generation_file:
+                return generation_file.read()
+        except FileNotFoundError:
+            return ''
+
+    def next_generation(self):
+        """Replaces the generation token with a new random one. The file is replaced atomically, so it is never read
+            half written, and two workers invalidating at once still get a token that no entry was cached with"""
+        path = '{}.{}'.format(self.generation_path, uuid.uuid4().hex)
+
+        with open(path, 'w') as generation_file:
+            generation_file.write(uuid.uuid4().hex)
+
+        os.replace(path, self.generation_path)
+
+    def page_key(self) -> str:
+        """Creates the cache key of the current request
+
+        :return: The cache key
+        """
+        return QueryCache.make_key('page', self.generation(), request.path, sorted(request.args.items(multi=True)),
+                                   session.get('user_id'))
+
+    def page(self, view: Callable, *args, **kwargs):
+        """Returns the response of a view, from the cache if possible. Responses are conditional, so a client that
+            already has the page gets a 304 response
+
+        :param view: View function
+        :param args: View positional arguments
+        :param kwargs: View keyword arguments
+        :return: The response
+        """
+        if not self.enabled:
+            return view(*args, **kwargs)
+
+        key = self.page_key()
+        cached = self.backend.get(key)
+
+        if cached is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+
+            body = response.get_data()
+            cached = (body, response.mimetype, hashlib.sha1(body).hexdigest(), int(time.time()))
+            self.backend.set(key, cached, self.ttl)
+        else:
+            body, mimetype = cached[:2]
+            response = make_response(body)
+            response.mimetype = mimetype
+
+        etag, last_modified = cached[2:]
+        response.set_etag(etag)
+        response.last_modified = datetime.datetime.utcfromtimestamp(last_modified)
+        response.cache_control.max_age = self.max_age
+        response.cache_control.must_revalidate = True
+        # Flask only adds it when the session is not empty, and the anonymous page must not be served to users
+        response.vary.add('Cookie')
+        if session.get('user_id'):
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+
+        return response.make_conditional(request)
+
+    def fragment(self, name: str, values: List, render: Callable) -> Markup:
+        """Returns a rendered template fragment, from the cache if possible
+
+        :param name: Template and line of the fragment
+        :param values: Values the fragment depends on
+        :param render: Function that renders the fragment
+        :return: The rendered fragment
+        """
+        if not self.enabled:
+            return render()
+
+        key = QueryCache.make_key('fragment', self.generation(), name, values)
+        cached = self.backend.get(key)
+
+        if cached is None:
+            cached = str(render())
+            self.backend.set(key, cached, self.fragment_ttl)
+
+        return Markup(cached)
+
+
+page_cache = PageCache()
+
+
+def cached_page(view: Callable) -> Callable:
+    """Decorator for views whose response only depends on the route, the query string and the logged in user
+
+    :param view: View function
+    :return: The decorated view
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return page_cache.page(view, *args, **kwargs)
+
+    return wrapper
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja `cache` tag. The body is cached for the values listed in the tag, ex:
+        {% cache response.sort_by, response.category_id %}...{% endcache %}"""
+
+    tags = {'cache'}
+
+    def parse(self, parser) -> nodes.Node:
+        """Parses the tag
+
+        :param parser: Jinja parser
+        :return: A node that calls `render_fragment` with the body
+        """
+        lineno = next(parser.stream).lineno
+
+        values = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            values.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        name = nodes.Const('{}:{}'.format(parser.name, lineno))
+
+        return nodes.CallBlock(self.call_method('render_fragment', [name, nodes.List(values)]),
+                               [], [], body).set_lineno(lineno)
+
+    @staticmethod
+    def render_fragment(name: str, values: List, caller: Callable) -> Markup:
+        """Renders the body of the tag, from the cache if possible
+
+        :param name: Template and line of the tag
+        :param values: Values listed in the tag
+        :param caller: Function that renders the body
+        :return: The rendered body
+        """
+        return page_cache.fragment(name, values, caller)
@@ -0,0 +1,169 @@
+import weakref
+from typing import Dict, List
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql import text
+from . import db
+from .instrumentation import Counter, instrumentation, escape_label
+from .main.use_cases import RetrieveCourseCatalog, RetrieveCourseCatalogCommand
+from .main.use_cases import RetrieveHomeRecommendations, RetrieveHomeRecommendationsCommand
+
+
+class DatabasePool:
+    """Configures the connection pool of the database engine from the DB_POOL_* settings, opens connections and runs
+        the hot queries when a worker starts, and exposes the pool utilization as metrics"""
+
+    # Engine options set from each config key
+    ENGINE_OPTIONS = {'DB_POOL_SIZE': 'pool_size',
+                      'DB_POOL_MAX_OVERFLOW': 'max_overflow',
+                      'DB_POOL_TIMEOUT': 'pool_timeout',
+                      'DB_POOL_RECYCLE': 'pool_recycle',
+                      'DB_POOL_PRE_PING': 'pool_pre_ping'}
+
+    def __init__(self, app=None):
+        """DatabasePool constructor
+
+        :param app: Flask application. If provided, the pool is configured from it
+        """
+        self.app = None
+        self.warmup = False
+        self.warmup_connections = 2
+        self.connects = Counter('recommendations_db_pool_connects_total', 'Database connections opened', 'pool')
+        self.checkouts = Counter('recommendations_db_pool_checkouts_total', 'Connections checked out from the pool',
+                                 'pool')
+        self.invalidations = Counter('recommendations_db_pool_invalidations_total', 'Pooled connections found closed '
+                                     'or broken', 'pool')
+        self.gauges = PoolGauges(self.pools)
+        self._listened = weakref.WeakSet()
+
+        if app is not None:
+            self.init_app(app)
+
+    @classmethod
+    def engine_options(cls, config) -> Dict:
+        """Returns the engine options of the pool settings. SQLite databases do not use a connection queue, so they
+            get no options
+
+        :param config: Application config
+        :return: A dictionary of `create_engine` arguments
+        """
+        if make_url(config['SQLALCHEMY_DATABASE_URI']).drivername.startswith('sqlite'):
+            return {}
+
+        return {option: config[key] for (key, option) in cls.ENGINE_OPTIONS.items() if config.get(key) is not None}
+
+    def init_app(self, app):
+        """Sets the engine options from the application config, unless they are set in SQLALCHEMY_ENGINE_OPTIONS, and
+            registers the pool metrics. It must be called before the engine is created. Connections are not opened
+            until `warm_up` is called by the server, once per worker
+
+        :param app: Flask application
+        """
+        self.app = app
+        self.warmup = app.config.get('DB_POOL_WARMUP', self.warmup)
+        self.warmup_connections = app.config.get('DB_POOL_WARMUP_CONNECTIONS', self.warmup_connections)
+
+        options = self.engine_options(app.config)
+        options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+        if instrumentation.enabled:
+            with app.app_context():
+                self.listen(db.engine)
+
+            for collector in (self.gauges, self.connects, self.checkouts, self.invalidations):
+                if collector not in instrumentation.collectors:
+                    instrumentation.collectors.append(collector)
+
+    def listen(self, engine):
+        """Counts the connections opened, checked out and invalidated by the pool of an engine
+
+        :param engine: Database engine
+        """
+        if engine in self._listened:
+            return
+
+        self._listened.add(engine)
+        pool = self.pool_name(engine)
+
+        event.listen(engine, 'connect', lambda *args: self.connects.increment(1, pool))
+        event.listen(engine, 'checkout', lambda *args: self.checkouts.increment(1, pool))
+        event.listen(engine, 'invalidate', lambda *args: self.invalidations.increment(1, pool))
+
+    @staticmethod
+    def pool_name(engine) -> str:
+        """Returns the name of the pool of an engine, without credentials
+
+        :param engine: Database engine
+        :return: The database host and name
+        """
+        return '{}/{}'.format(engine.url.host or engine.url.drivername, engine.url.database or '')
+
+    def pools(self) -> List:
+        """Returns the engines whose pool is reported
+
+        :return: The engines of the application
+        """
+        with self.app.app_context():
+            return [db.engine]
+
+    def warm_up(self):
+        """Opens connections up to the warm-up size and runs the use cases of the most visited pages, so their queries
+            reach the database caches and fill the query cache. It is called by the server when a worker starts, see
+            `gunicorn.conf.py`, and not when the application is created, so maintenance commands do not connect.
+            Failures are logged, so a worker starts even if the database is not reachable"""
+        if not self.warmup:
+            return
+
+        with self.app.app_context():
+            try:
+                connections = [db.engine.connect() for _ in range(self.warmup_connections)]
+                try:
+                    for connection in connections:
+                        connection.execute(text('SELECT 1'))
+                finally:
+                    for connection in connections:
+                        connection.close()
+
+                # Anonymous home page and first catalog pages
+                RetrieveHomeRecommendations.execute(RetrieveHomeRecommendationsCommand())
+                for sort_by in (RetrieveCourseCatalogCommand.SORT_LEADS, RetrieveCourseCatalogCommand.SORT_RATING):
+                    RetrieveCourseCatalog.execute(RetrieveCourseCatalogCommand(1, sort_by, None))
+            except Exception:
+                self.app.logger.exception('Unable to warm up the database connection pool')
+
+
+class PoolGauges:
+    """Connection pool utilization gauges, read from the pools when the metrics are rendered"""
+
+    # Gauge name and description of each pool status method
+    GAUGES = (('size', 'recommendations_db_pool_size', 'Connections kept by the pool'),
+              ('checkedout', 'recommendations_db_pool_checked_out', 'Connections in use'),
+              ('checkedin', 'recommendations_db_pool_checked_in', 'Idle connections in the pool'),
+              ('overflow', 'recommendations_db_pool_overflow', 'Connections opened beyond the pool size'))
+
+    def __init__(self, engines):
+        """PoolGauges constructor
+
+        :param engines: Function that returns the engines whose pool is reported
+        """
+        self.engines = engines
+
+    def render(self) -> List[str]:
+        """Renders the gauges of every pool that reports its status
+
+        :return: The lines of the metrics
+        """
+        engines = [engine for engine in self.engines() if hasattr(engine.pool, 'checkedout')]
+        lines = []
+
+        for method, name, description in self.GAUGES:
+            lines.extend(['# HELP {} {}'.format(name, description), '# TYPE {} gauge'.format(name)])
+            for engine in engines:
+                lines.append('{}{{pool="{}"}} {}'.format(name, escape_label(DatabasePool.pool_name(engine)),
+                                                         getattr(engine.pool, method)()))
+
+        return lines
+
+
+database_pool = DatabasePool()
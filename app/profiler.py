@@ -0,0 +1,247 @@
+import os
+import sys
+import atexit
+import time
+import signal
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+from flask import request
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+class SamplingProfiler:
+    """Statistical profiler for live workers. A profiling timer interrupts the process every interval of CPU time, and
+        the stacks of the threads serving a request are aggregated as collapsed stacks per endpoint, the input of flame
+        graph tools. Samples are written to a file on demand, by sending the dump signal to the worker"""
+
+    # Maximum number of frames kept of each stack
+    MAX_DEPTH = 128
+
+    def __init__(self, app=None):
+        """SamplingProfiler constructor
+
+        :param app: Flask application. If provided, the profiler is configured from it
+        """
+        self.enabled = False
+        self.interval = 0.01
+        self.output_dir = None
+        # Resolved when the profiler is enabled, since real time signals do not exist on every platform
+        self.dump_signal = None
+        self._samples = {}
+        self._labels = {}
+        self._pid = None
+        self._stopped_at_exit = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the profiler from the application config. When enabled, it installs the signal handlers and the
+            request hooks that label the sampled threads. The profiling timer is started by the first request of each
+            process
+
+        :param app: Flask application
+        """
+        self.enabled = app.config.get('PROFILER_ENABLED', self.enabled)
+        self.interval = app.config.get('PROFILER_INTERVAL', self.interval)
+        self.output_dir = app.config.get('PROFILER_OUTPUT_DIR', self.output_dir)
+
+        if not self.enabled:
+            return
+
+        self.dump_signal = self.parse_signal(app.config.get('PROFILER_DUMP_SIGNAL', 'SIGRTMIN+1'))
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.install()
+
+        if 'sampling_profiler' not in app.extensions:
+            app.before_request(self.start_request)
+            app.teardown_request(self.finish_request)
+            app.extensions['sampling_profiler'] = self
+
+    @staticmethod
+    def parse_signal(name: str) -> int:
+        """Returns the number of a signal
+
+        :param name: Signal name, ex: SIGUSR1, or real time signal name, ex: SIGRTMIN+1
+        :return: The signal number
+        """
+        base, _, offset = name.partition('+')
+
+        return int(getattr(signal, base)) + int(offset or 0)
+
+    def install(self):
+        """Installs the sampling and dump signal handlers. Handlers can only be installed from the main thread. They
+            are installed when the application is created, and inherited by forked workers, and again by the first
+            request of each process served from the main thread, since servers such as gunicorn reset the handlers of
+            their own signals in each worker"""
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.signal(self.dump_signal, self.handle_dump)
+
+    def start(self):
+        """Starts the profiling timer, once per process. Timers are not inherited by forked workers, and the timer is
+            only started if the sampling handler is installed"""
+        if self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._samples = {}
+        self._labels = {}
+        self.install()
+
+        if signal.getsignal(signal.SIGPROF) == self.sample:
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+            # The default action of an unhandled SIGPROF terminates the process, and handlers are removed at shutdown
+            if not self._stopped_at_exit:
+                atexit.register(self.stop)
+                self._stopped_at_exit = True
+
+    def stop(self):
+        """Stops the profiling timer"""
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        self._pid = None
+
+    def start_request(self):
+        """Labels the current thread with the endpoint of the request"""
+        self.start()
+        self._labels[threading.get_ident()] = request.endpoint or 'unknown'
+
+    def finish_request(self, exception=None):
+        """Removes the label of the current thread, so it is no longer sampled
+
+        :param exception: Exception raised by the request, if any
+        """
+        self._labels.pop(threading.get_ident(), None)
+
+    def current_label(self) -> Optional[str]:
+        """Returns the label of the current thread
+
+        :return: The endpoint being served by the thread or None if it is not sampled
+        """
+        return self._labels.get(threading.get_ident())
+
+    @contextmanager
+    def track(self, label: Optional[str]):
+        """Context manager that samples the current thread with a label, used for work done in another thread on
+            behalf of a request
+
+        :param label: Label returned by `current_label` in the requesting thread. If None, nothing is sampled
+        """
+        if not self.enabled or label is None:
+            yield
+            return
+
+        # Python runs signal handlers in the main thread. Blocking the timer signal here makes the kernel deliver it
+        # to the main thread, which is interrupted even while it waits for this thread
+        if threading.current_thread() is not threading.main_thread():
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGPROF})
+
+        ident = threading.get_ident()
+        self._labels[ident] = label
+        try:
+            yield
+        finally:
+            self._labels.pop(ident, None)
+
+    def sample(self, signal_number, frame):
+        """SIGPROF handler. Adds the stack of each labelled thread to the samples
+
+        :param signal_number: Signal number
+        :param frame: Frame interrupted in the main thread
+        """
+        labels = dict(self._labels)
+        if not labels:
+            return
+
+        samples = self._samples
+        for (ident, thread_frame) in sys._current_frames().items():
+            label = labels.get(ident)
+            if label is None:
+                continue
+
+            # The handler frame itself is not part of the sampled stack
+            if thread_frame.f_code is SamplingProfiler.sample.__code__:
+                thread_frame = thread_frame.f_back
+
+            stack = self.collapse(thread_frame, label)
+            samples[stack] = samples.get(stack, 0) + 1
+
+    def handle_dump(self, signal_number, frame):
+        """Dump signal handler. Writes the samples collected since the previous dump
+
+        :param signal_number: Signal number
+        :param frame: Frame interrupted in the main thread
+        """
+        self.dump()
+
+    def collapse(self, frame, label: str) -> str:
+        """Converts a stack to the collapsed format: frames from the outermost, separated by semicolons
+
+        :param frame: Innermost frame
+        :param label: Label placed as the root frame
+        :return: The collapsed stack
+        """
+        frames = []
+        while frame is not None and len(frames) < self.MAX_DEPTH:
+            code = frame.f_code
+            frames.append('{} ({}:{})'.format(code.co_name, self.module_path(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+
+        frames.append(label)
+
+        return ';'.join(reversed(frames))
+
+    @staticmethod
+    def module_path(filename: str) -> str:
+        """Shortens a source file path, relative to the project or to the installed packages directory
+
+        :param filename: Source file path
+        :return: The shortened path
+        """
+        if filename.startswith(basedir):
+            return os.path.relpath(filename, basedir)
+
+        position = filename.rfind('site-packages' + os.sep)
+        if position >= 0:
+            return filename[position + len('site-packages' + os.sep):]
+
+        return os.path.basename(filename)
+
+    def dump(self, path: str = None) -> Optional[str]:
+        """Writes the samples collected since the previous dump as collapsed stacks, one per line followed by its
+            number of samples, and starts a new collection
+
+        :param path: Output file. If None, a file named after the process and the time is created in the output
+            directory
+        :return: The path of the file or None if there were no samples
+        """
+        samples, self._samples = self._samples, {}
+        if not samples:
+            return None
+
+        if path is None:
+            path = os.path.join(self.output_dir, 'profile-{}-{}.folded'.format(os.getpid(),
+                                                                                time.strftime('%Y%m%d%H%M%S')))
+
+        with open(path, 'w') as output:
+            for stack, count in sorted(samples.items(), key=lambda item: item[1], reverse=True):
+                output.write('{} {}\n'.format(stack, count))
+
+        return path
+
+    @property
+    def samples(self) -> Dict[str, int]:
+        """Returns the samples collected since the previous dump
+
+        :return: A dictionary whose keys are collapsed stacks and values are numbers of samples
+        """
+        return dict(self._samples)
+
+
+sampling_profiler = SamplingProfiler()
@@ -1,47 +1,107 @@
 import numpy as np
-import os
-from .models import CourseRepository
-import pickle
-
-
-def find_similar_users(user_id: str, min_similarity: int = 1) -> np.ndarray:
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app
+from typing import Dict, List, Tuple
+from . import lead_matrix_index
+from .catalog import catalog_index
+from .instrumentation import bind_timings, current_timings, timed
+from .lead_delta import lead_delta
+from .lead_matrix import LeadMatrix
+from .neighbour_search import sharded_search
+from .profiler import sampling_profiler
+from .similarity import top_k_indexes
+from .models import Course, CourseRepository, UserRecommendationRepository
+
+
+def find_similar_users(user_id: str, min_similarity: int = 1, lead_matrix: LeadMatrix = None,
+                       max_neighbours: int = None, approximate: bool = False) -> np.ndarray:
     """Creates an array of similar users based on leads generated on the same courses
 
     :param user_id: User id for which we want to find similar users
     :param min_similarity: Minimum similarity between users to be listed
+    :param lead_matrix: User-course lead matrix. If None, the process-wide lead matrix will be used
+    :param max_neighbours: Maximum number of similar users to retrieve. If None, all similar users will be retrieved
+    :param approximate: If True, only the candidates found by the locality sensitive hashing index are scored. Users
+        with few leads are always scored against every user
     :return numpy.array: Array of similar users sorted by similarity
     """
-    # Loading sparse leads user-item matrix from file
-    dirname = os.path.dirname(os.path.abspath(__file__))
-    user_map_courses_file = '{}/../data/user_requested_courses_map.pickle'.format(dirname)
+    if lead_matrix is None:
+        lead_matrix = lead_matrix_index.get()
+
+    # Leads saved since the lead matrix file was written are laid over it
+    leads = lead_delta.overlay(lead_matrix)
+
+    user_row = leads.row_of(user_id)
+    if user_row is None:
+        return np.array([])
+
+    user_vector = leads.vector(user_row)
 
-    with open(user_map_courses_file, 'rb') as filename:
-        user_courses_map = pickle.load(filename)
+    if approximate and user_vector.nnz >= lead_matrix_index.lsh_min_leads:
+        rows = leads.candidates(user_row, lead_matrix_index.lsh_num_hashes, lead_matrix_index.lsh_bands)
+        similarities = leads.similarities(user_vector, rows)
+    elif sharded_search.applies(lead_matrix):
+        # Only the most similar users of each shard are returned
+        rows, similarities = sharded_search.search(leads, user_row, user_vector, min_similarity, max_neighbours)
+    else:
+        # Similarity with every user in a single sparse matrix-vector product
+        rows = np.arange(leads.number_of_users)
+        similarities = leads.similarities(user_vector, rows)
 
-    user_courses = np.array(user_courses_map[user_id].todense())[0]
+    eligible = (similarities >= min_similarity) & (rows != user_row)
+    candidates = np.flatnonzero(eligible)
 
-    similarities = dict()
+    if max_neighbours is not None:
+        candidates = candidates[top_k_indexes(similarities[candidates], max_neighbours, rows[candidates])]
 
-    for another_user_id, another_user_courses in user_courses_map.items():
-        if user_id == another_user_id:
-            continue
+    # Sorted by descending similarity, ties keep the matrix order
+    candidates = candidates[np.lexsort((rows[candidates], -similarities[candidates]))]
 
-        similarity = np.dot(user_courses, np.array(another_user_courses.todense())[0])
-        if similarity < min_similarity:
-            continue
+    return leads.users(rows[candidates])
+
+
+def find_similar_courses(course_ids: List[str], lead_matrix: LeadMatrix = None, max_courses: int = 10,
+                         exclude: List[str] = None, k: int = 20) -> np.ndarray:
+    """Creates an array of the courses most similar to a set of courses, scored by adding up the neighbour rows of
+        every course of the set
+
+    :param course_ids: Identifiers of the courses, usually the ones requested by a user
+    :param lead_matrix: User-course lead matrix. If None, the process-wide lead matrix will be used
+    :param max_courses: Maximum number of courses to retrieve
+    :param exclude: Course identifiers excluded from the result, besides the courses of the set
+    :param k: Number of neighbours of each course
+    :return numpy.array: Array of course identifiers sorted by score
+    """
+    if lead_matrix is None:
+        lead_matrix = lead_matrix_index.get()
 
-        similarities[another_user_id] = similarity
+    columns = lead_matrix.columns_of(course_ids)
+    if len(columns) == 0:
+        return np.array([])
 
-    sorted_similarities = sorted(similarities.items(), key=lambda item: item[1], reverse=True)
+    # Only the neighbour rows of the requested courses are read, so the cost does not depend on the number of users
+    scores = np.asarray(lead_matrix.item_neighbours(k)[columns].sum(axis=0)).ravel()
+    scores[columns] = 0
+    scores[lead_matrix.columns_of(exclude or [])] = 0
 
-    return np.array([user_id for (user_id, similarity) in sorted_similarities])
+    candidates = np.flatnonzero(scores > 0)
+    candidates = candidates[top_k_indexes(scores[candidates], max_courses, candidates)]
+
+    # Sorted by descending score, ties keep the matrix order
+    candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+
+    return lead_matrix.course_ids[candidates]
 
 
 class Recommender:
     """Makes courses recommendations"""
 
-    def __init__(self):
-        """Recommender constructor. Initializes the object."""
+    def __init__(self, lead_matrix: LeadMatrix = None):
+        """Recommender constructor. Initializes the object.
+
+        :param lead_matrix: User-course lead matrix. If None, the process-wide lead matrix will be used
+        """
 
         self.user_courses = {}
         self.by_leads = {}
@@ -50,19 +110,72 @@ class Recommender:
         self.by_number_of_leads = {}
         self.by_user = {}
         self.course_repository = CourseRepository()
+        self.user_recommendation_repository = UserRecommendationRepository()
+        self.lead_matrix = lead_matrix
 
+    @timed()
     def make_recommendations_by_course(self, course_id, max_recommendations: int = 10) -> 'Recommender':
         """Make user interaction and content based recommendations
 
+        :param course_id: Identifier of the course for which we want to find similar
+        :param max_recommendations: Maximum number of recommendations
+        :return: `Recommender` class
+        """
+        return self.make_recommendations_by_leads(course_id, max_recommendations) \
+            .make_recommendations_by_content(course_id, max_recommendations)
+
+    @timed()
+    def make_course_page_recommendations(self, course_id, category_id: int = None,
+                                         max_recommendations: int = 10) -> 'Recommender':
+        """Make the user interaction, content and rank based recommendations of a course page at once, fetching all
+            of them in a single query and building each recommended course only once
+
+        :param course_id: Identifier of the course for which we want to find similar
+        :param category_id: Category identifier of the course, for the rank based recommendations
+        :param max_recommendations: Maximum number of recommendations of each type
+        :return: `Recommender` class
+        """
+        # Rank based recommendations are read from the catalog snapshot when it is available
+        with_ranks = not catalog_index.enabled
+
+        recommendations = self.course_repository.find_course_recommendations(str(course_id), category_id,
+                                                                             max_recommendations, with_ranks)
+        self.by_leads = recommendations['by_leads']
+        self.by_content = recommendations['by_content']
+
+        if with_ranks:
+            self.by_rating = recommendations['by_rating']
+            self.by_number_of_leads = recommendations['by_number_of_leads']
+        else:
+            self.make_rank_recommendations(category_id, str(course_id), max_recommendations)
+
+        return self
+
+    @timed()
+    def make_recommendations_by_leads(self, course_id, max_recommendations: int = 10) -> 'Recommender':
+        """Make user interaction based recommendations: courses requested by the users that requested a course
+
         :param course_id: Identifier of the course for which we want to find similar
         :param max_recommendations: Maximum number of recommendations
         :return: `Recommender` class
         """
         self.by_leads = self.course_repository.find_similar_by_leads(course_id, max_recommendations)
+
+        return self
+
+    @timed()
+    def make_recommendations_by_content(self, course_id, max_recommendations: int = 10) -> 'Recommender':
+        """Make content based recommendations: courses with similar title and description
+
+        :param course_id: Identifier of the course for which we want to find similar
+        :param max_recommendations: Maximum number of recommendations
+        :return: `Recommender` class
+        """
         self.by_content = self.course_repository.find_similar_by_content(course_id, max_recommendations)
 
         return self
 
+    @timed()
     def make_rank_recommendations(self, category_id: int = None, exclude_course_id: str = None,
                                   max_recommendations: int = 10) -> 'Recommender':
         """Make rank based recommendations
@@ -72,50 +185,443 @@ class Recommender:
         :param max_recommendations: Maximum number of recommendations
         :return: `Recommender` class
         """
-        self.by_rating = self.course_repository.find_sorted_by_rating(category=category_id,
-                                                                      max_rows=max_recommendations,
-                                                                      exclude=exclude_course_id)
-        self.by_number_of_leads = self.course_repository.find_sorted_by_leads(category=category_id,
-                                                                              max_rows=max_recommendations,
-                                                                              exclude=exclude_course_id)
+        return self.make_rating_recommendations(category_id, exclude_course_id, max_recommendations) \
+            .make_number_of_leads_recommendations(category_id, exclude_course_id, max_recommendations)
+
+    @timed()
+    def make_rating_recommendations(self, category_id: int = None, exclude_course_id: str = None,
+                                    max_recommendations: int = 10) -> 'Recommender':
+        """Make recommendations of the courses with the best weighted rating
+
+        :param category_id: Category identifier if we want to make recommendations of this category
+        :param exclude_course_id: Course identifier if we want to exclude it from the recommendations
+        :param max_recommendations: Maximum number of recommendations
+        :return: `Recommender` class
+        """
+        self.by_rating = catalog_index.course_repository().find_sorted_by_rating(category=category_id,
+                                                                                 max_rows=max_recommendations,
+                                                                                 exclude=exclude_course_id,
+                                                                                 with_description=False)
 
         return self
 
-    def make_recommendations_for_user(self, user_id: str = None, max_recommendations: int = 10) -> 'Recommender':
-        """Makes neighbourhood based recommendations
+    @timed()
+    def make_number_of_leads_recommendations(self, category_id: int = None, exclude_course_id: str = None,
+                                             max_recommendations: int = 10) -> 'Recommender':
+        """Make recommendations of the most requested courses
+
+        :param category_id: Category identifier if we want to make recommendations of this category
+        :param exclude_course_id: Course identifier if we want to exclude it from the recommendations
+        :param max_recommendations: Maximum number of recommendations
+        :return: `Recommender` class
+        """
+        self.by_number_of_leads = catalog_index.course_repository().find_sorted_by_leads(category=category_id,
+                                                                                         max_rows=max_recommendations,
+                                                                                         exclude=exclude_course_id,
+                                                                                         with_description=False)
+
+        return self
+
+    def dispatch(self, strategies: List[Tuple[str, Dict]]) -> 'Recommender':
+        """Makes several independent types of recommendations. Depending on the configuration, they are made one
+            after the other or concurrently
+
+        :param strategies: List of tuples with the name of a `make_*` method and its parameters
+        :return: `Recommender` class
+        """
+        strategy_dispatcher.run(self, strategies)
+
+        return self
+
+    @timed()
+    def make_recommendations_for_user(self, user_id: str = None, max_recommendations: int = 10,
+                                      max_neighbours: int = 50, with_user_courses: bool = False) -> 'Recommender':
+        """Makes neighbourhood based recommendations. If the recommendations store is enabled and the user has
+            precomputed recommendations, those are served with a single keyed read instead of computing them
 
         :param user_id: User identifier for which we want to make recommendations
         :param max_recommendations: Maximum number of recommendations
+        :param max_neighbours: Maximum number of similar users considered
+        :param with_user_courses: Whether to retrieve the courses requested by the user when the recommendations are
+            served from the store. They are always retrieved when the recommendations are computed
         :return: `Recommender` class
         """
         if not user_id:
             return self
 
+        if current_app.config.get('RECOMMENDATIONS_STORE_ENABLED', False):
+            self.by_user = self.user_recommendation_repository.find_by_user(user_id, max_recommendations)
+
+            if len(self.by_user) > 0:
+                if with_user_courses:
+                    self.user_courses = self.course_repository.find_requested_by_user(user_id)
+
+                return self
+
         self.user_courses = self.course_repository.find_requested_by_user(user_id)
-        user_courses_ids = np.array(list(self.user_courses.keys()))
+        user_course_ids = list(self.user_courses.keys())
 
-        if len(user_courses_ids) == 0:
+        # Leads that are not in the clean leads yet, so new users get recommendations right away
+        user_course_ids += [course_id for course_id in lead_delta.courses_of(user_id)
+                            if course_id not in self.user_courses]
+
+        if len(user_course_ids) == 0:
             return self
 
-        rec_courses_ids = np.array([])
-        sim_users_courses = {}
+        self.by_user = self.compute_recommendations_for_user(user_id, user_course_ids, max_recommendations,
+                                                             max_neighbours)
+
+        return self
+
+    def compute_recommendations_for_user(self, user_id: str, user_course_ids: List[str],
+                                         max_recommendations: int = 10,
+                                         max_neighbours: int = 50) -> Dict[str, Course]:
+        """Computes neighbourhood based recommendations from the courses requested by the most similar users or,
+            with item based collaborative filtering, from the neighbours of the courses requested by the user
+
+        :param user_id: User identifier for which we want to make recommendations
+        :param user_course_ids: Identifiers of the courses already requested by the user, excluded from the result
+        :param max_recommendations: Maximum number of recommendations
+        :param max_neighbours: Maximum number of similar users considered
+        :return: A collection of recommended courses
+        """
+        if self.lead_matrix is None:
+            self.lead_matrix = lead_matrix_index.get()
+
+        # Lead matrices converted from pickled dictionaries do not know the course of each column
+        if lead_matrix_index.item_based and len(self.lead_matrix.course_ids) > 0:
+            return self.compute_item_recommendations(user_course_ids, max_recommendations)
 
-        similar_users = find_similar_users(user_id)
+        similar_users = find_similar_users(user_id, lead_matrix=self.lead_matrix, max_neighbours=max_neighbours,
+                                           approximate=lead_matrix_index.approximate)
+        sim_users_courses = self.course_repository.find_requested_by_users(similar_users.tolist())
+        user_course_ids = set(user_course_ids)
+
+        # Merging the courses of the similar users, from the most to the least similar, until there are enough
+        by_user = {}
         for similar_user_id in similar_users:
-            sim_user_courses = self.course_repository.find_requested_by_user(similar_user_id)
-            sim_users_courses.update(sim_user_courses)
+            for course_id, course in sim_users_courses.get(similar_user_id, {}).items():
+                if len(by_user) >= max_recommendations:
+                    break
 
-            new_recs = np.setdiff1d(np.array(list(sim_user_courses.keys())), user_courses_ids, assume_unique=True)
-            rec_courses_ids = np.unique(np.concatenate([new_recs, rec_courses_ids], axis=0))
+                if course_id not in user_course_ids and course_id not in by_user:
+                    by_user[course_id] = course
 
-            if len(rec_courses_ids) > max_recommendations:
-                break
+        return by_user
 
-        if len(rec_courses_ids) == 0:
-            return self
+    def compute_item_recommendations(self, user_course_ids: List[str],
+                                     max_recommendations: int = 10) -> Dict[str, Course]:
+        """Computes item based recommendations: the courses that are most often requested together with the
+            courses requested by the user
+
+        :param user_course_ids: Identifiers of the courses already requested by the user
+        :param max_recommendations: Maximum number of recommendations
+        :return: A collection of recommended courses, sorted by score
+        """
+        course_ids = find_similar_courses(user_course_ids, lead_matrix=self.lead_matrix,
+                                          max_courses=max_recommendations,
+                                          k=lead_matrix_index.item_neighbours).tolist()
+        courses = {str(course.id): course
+                   for course in self.course_repository.find_by_ids(course_ids, with_description=False).values()}
+
+        return {course_id: courses[course_id] for course_id in course_ids if course_id in courses}
+
+    @timed()
+    def make_recommendations_for_users(self, user_ids: List[str], max_recommendations: int = 10,
+                                       max_neighbours: int = 50) -> Dict[str, Dict[str, Course]]:
+        """Makes the recommendations of several users at once. Similarities are computed with a single sparse matrix
+            product and the recommended courses are built with a single query. Precomputed recommendations are not
+            read, so they are always up to date
+
+        :param user_ids: User identifiers for which we want to make recommendations
+        :param max_recommendations: Maximum number of recommendations of each user
+        :param max_neighbours: Maximum number of similar users considered for each user
+        :return: A collection of recommended courses for each user, indexed by user identifier
+        """
+        if self.lead_matrix is None:
+            self.lead_matrix = lead_matrix_index.get()
+
+        # Lead matrices converted from pickled dictionaries do not know the course of each column
+        if len(self.lead_matrix.course_ids) == 0:
+            users_courses = self.course_repository.find_requested_by_users(list(user_ids))
+            return {user_id: self.compute_recommendations_for_user(user_id, list(users_courses.get(user_id, {})),
+                                                                   max_recommendations, max_neighbours)
+                    for user_id in user_ids}
+
+        leads = lead_delta.overlay(self.lead_matrix)
+        rows = {user_id: leads.row_of(user_id) for user_id in user_ids}
+        known = [user_id for user_id in user_ids if rows[user_id] is not None]
+        if len(known) == 0:
+            return {user_id: {} for user_id in user_ids}
+
+        user_rows = np.array([rows[user_id] for user_id in known], dtype=np.int64)
+        vectors = leads.vectors(user_rows)
+
+        if lead_matrix_index.item_based:
+            columns = self.item_columns_for_users(vectors, max_recommendations)
+        else:
+            columns = self.neighbour_columns_for_users(leads, user_rows, vectors, max_recommendations,
+                                                       max_neighbours)
+
+        recommendations = self.build_course_lists([self.lead_matrix.course_ids[recommended].tolist()
+                                                   for recommended in columns])
+        by_user = dict(zip(known, recommendations))
+
+        return {user_id: by_user.get(user_id, {}) for user_id in user_ids}
+
+    @staticmethod
+    def neighbour_columns_for_users(leads, user_rows: np.ndarray, vectors, max_recommendations: int,
+                                    max_neighbours: int, min_similarity: int = 1) -> List[np.ndarray]:
+        """Selects the courses requested by the most similar users of several users, from the most to the least
+            similar user, like `compute_recommendations_for_user`
+
+        :param leads: Lead matrix or lead overlay
+        :param user_rows: Rows of the users
+        :param vectors: Courses requested by each user
+        :param max_recommendations: Maximum number of courses of each user
+        :param max_neighbours: Maximum number of similar users considered for each user
+        :param min_similarity: Minimum similarity between users
+        :return: The columns of the courses of each user
+        """
+        similarities = leads.similarity_matrix(vectors)
+        columns = []
+
+        for index, user_row in enumerate(user_rows):
+            rows = similarities.indices[similarities.indptr[index]:similarities.indptr[index + 1]]
+            values = similarities.data[similarities.indptr[index]:similarities.indptr[index + 1]]
+
+            eligible = (values >= min_similarity) & (rows != user_row)
+            rows, values = rows[eligible], values[eligible]
+            top = top_k_indexes(values, max_neighbours, rows)
+            rows, values = rows[top], values[top]
+            neighbours = rows[np.lexsort((rows, -values))]
+
+            # Courses in the order of the first neighbour that requested them
+            courses = leads.vectors(neighbours).indices
+            _, first = np.unique(courses, return_index=True)
+            courses = courses[np.sort(first)]
+            requested = vectors.indices[vectors.indptr[index]:vectors.indptr[index + 1]]
+            courses = courses[~np.isin(courses, requested)]
+
+            columns.append(courses[:max_recommendations])
+
+        return columns
+
+    def item_columns_for_users(self, vectors, max_recommendations: int) -> List[np.ndarray]:
+        """Selects the courses with the highest sum of similarities to the courses requested by several users, like
+            `find_similar_courses`, with a single sparse matrix product
+
+        :param vectors: Courses requested by each user
+        :param max_recommendations: Maximum number of courses of each user
+        :return: The columns of the courses of each user
+        """
+        scores = vectors.dot(self.lead_matrix.item_neighbours(lead_matrix_index.item_neighbours)).tocsr()
+        columns = []
+
+        for index in range(vectors.shape[0]):
+            courses = scores.indices[scores.indptr[index]:scores.indptr[index + 1]]
+            values = scores.data[scores.indptr[index]:scores.indptr[index + 1]]
+
+            requested = vectors.indices[vectors.indptr[index]:vectors.indptr[index + 1]]
+            eligible = (values > 0) & ~np.isin(courses, requested)
+            courses, values = courses[eligible], values[eligible]
+            top = top_k_indexes(values, max_recommendations, courses)
+            courses, values = courses[top], values[top]
+
+            columns.append(courses[np.lexsort((courses, -values))])
+
+        return columns
+
+    @timed()
+    def make_recommendations_by_courses(self, course_ids: List[str],
+                                        max_recommendations: int = 10) -> Dict[str, Dict[str, Course]]:
+        """Makes the user interaction based recommendations of several courses at once: the courses most often
+            requested by the users that requested each course, counted with a single sparse matrix product, and built
+            with a single query
+
+        :param course_ids: Identifiers of the courses for which we want to find similar
+        :param max_recommendations: Maximum number of recommendations of each course
+        :return: A collection of recommended courses for each course, indexed by course identifier
+        """
+        if self.lead_matrix is None:
+            self.lead_matrix = lead_matrix_index.get()
+
+        course_ids = [str(course_id) for course_id in course_ids]
+
+        if len(self.lead_matrix.course_ids) == 0:
+            return {course_id: self.course_repository.find_similar_by_leads(course_id, max_recommendations)
+                    for course_id in course_ids}
+
+        known = [course_id for course_id in course_ids if self.lead_matrix.column_of(course_id) is not None]
+        if len(known) == 0:
+            return {course_id: {} for course_id in course_ids}
+
+        course_columns = self.lead_matrix.columns_of(known)
+
+        # Number of users that requested each pair of courses
+        matrix = self.lead_matrix.matrix
+        co_leads = matrix[:, course_columns].T.dot(matrix).tocsr()
+
+        columns = []
+        for index, course_column in enumerate(course_columns):
+            courses = co_leads.indices[co_leads.indptr[index]:co_leads.indptr[index + 1]]
+            values = co_leads.data[co_leads.indptr[index]:co_leads.indptr[index + 1]]
+
+            eligible = (values > 0) & (courses != course_column)
+            courses, values = courses[eligible], values[eligible]
+            top = top_k_indexes(values, max_recommendations, courses)
+            courses, values = courses[top], values[top]
+
+            columns.append(courses[np.lexsort((courses, -values))])
+
+        recommendations = self.build_course_lists([self.lead_matrix.course_ids[recommended].tolist()
+                                                   for recommended in columns])
+        by_course = dict(zip(known, recommendations))
 
-        rec_courses_ids = rec_courses_ids[:max_recommendations]
-        self.by_user = {course_id: course for (course_id, course) in sim_users_courses.items()
-                        if course_id in rec_courses_ids}
+        return {course_id: by_course.get(course_id, {}) for course_id in course_ids}
+
+    def build_course_lists(self, course_id_lists: List[List[str]]) -> List[Dict[str, Course]]:
+        """Builds several lists of courses with a single query. Courses in several lists are the same object
+
+        :param course_id_lists: Lists of course identifiers
+        :return: A collection of courses for each list, in the same order as the identifiers
+        """
+        course_ids = sorted({course_id for course_ids in course_id_lists for course_id in course_ids})
+        courses = {str(course.id): course
+                   for course in self.course_repository.find_by_ids(course_ids, with_description=False).values()}
+
+        return [{course_id: courses[course_id] for course_id in course_ids if course_id in courses}
+                for course_ids in course_id_lists]
+
+    def refresh_recommendations_for_user(self, user_id: str, max_recommendations: int = 10,
+                                         refresh_neighbours: int = 0,
+                                         exclude_course_ids: List[str] = None) -> 'Recommender':
+        """Computes and stores the recommendations of a user and, optionally, of their most similar users, whose
+            recommendations may change when the user requests a new course
+
+        :param user_id: User identifier whose recommendations have to be refreshed
+        :param max_recommendations: Maximum number of recommendations
+        :param refresh_neighbours: Number of similar users whose recommendations are also refreshed
+        :param exclude_course_ids: Course identifiers requested by the user that are not in the leads yet
+        :return: `Recommender` class
+        """
+        if self.lead_matrix is None:
+            self.lead_matrix = lead_matrix_index.get()
+
+        user_ids = [user_id]
+        if refresh_neighbours > 0:
+            user_ids += find_similar_users(user_id, lead_matrix=self.lead_matrix, max_neighbours=refresh_neighbours,
+                                           approximate=lead_matrix_index.approximate).tolist()
+
+        users_courses = self.course_repository.find_requested_by_users(user_ids)
+
+        for affected_user_id in user_ids:
+            user_course_ids = list(users_courses.get(affected_user_id, {}).keys())
+            if affected_user_id == user_id and exclude_course_ids:
+                user_course_ids += exclude_course_ids
+
+            recommendations = self.compute_recommendations_for_user(affected_user_id, user_course_ids,
+                                                                    max_recommendations)
+            self.user_recommendation_repository.save(affected_user_id, list(recommendations.keys()))
 
         return self
+
+
+class StrategyDispatcher:
+    """Runs recommendation strategies. When concurrency is enabled, strategies run in a bounded thread pool that
+        shares the database engine, and a strategy that fails or exceeds the timeout leaves its section empty"""
+
+    # Recommender attributes filled by the strategies
+    SECTIONS = ('user_courses', 'by_leads', 'by_content', 'by_rating', 'by_number_of_leads', 'by_user')
+
+    def __init__(self, app=None):
+        """StrategyDispatcher constructor
+
+        :param app: Flask application. If provided, the dispatcher is configured from it
+        """
+        self.concurrent = False
+        self.max_workers = 5
+        self.timeout = 2.0
+        self._executor = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the dispatcher from the application config
+
+        :param app: Flask application
+        """
+        self.concurrent = app.config.get('RECOMMENDER_CONCURRENT_STRATEGIES', self.concurrent)
+        self.max_workers = app.config.get('RECOMMENDER_MAX_WORKERS', self.max_workers)
+        self.timeout = app.config.get('RECOMMENDER_STRATEGY_TIMEOUT', self.timeout)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Returns the thread pool, created on first use so that each worker process has its own
+
+        :return: The thread pool
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='recommender')
+
+        return self._executor
+
+    def run(self, recommender: Recommender, strategies: List[Tuple[str, Dict]]):
+        """Runs the strategies and fills the sections of a recommender
+
+        :param recommender: The recommender whose sections are filled
+        :param strategies: List of tuples with the name of a `make_*` method and its parameters
+        """
+        if not self.concurrent:
+            for method, params in strategies:
+                getattr(recommender, method)(**params)
+
+            return
+
+        app = current_app._get_current_object()
+        timings = current_timings()
+        label = sampling_profiler.current_label()
+        futures = {self.executor.submit(self.run_strategy, app, recommender.lead_matrix, method, params, timings,
+                                        label): method for (method, params) in strategies}
+
+        done, not_done = wait(futures.keys(), timeout=self.timeout)
+
+        for future in not_done:
+            app.logger.warning('Recommendation strategy %s timed out', futures[future])
+
+        for future in done:
+            if future.exception() is not None:
+                app.logger.error('Recommendation strategy %s failed', futures[future],
+                                 exc_info=future.exception())
+                continue
+
+            # Each strategy runs on its own recommender, so one that times out cannot alter the response later
+            for section in self.SECTIONS:
+                value = getattr(future.result(), section)
+                if len(value) > 0:
+                    setattr(recommender, section, value)
+
+    @staticmethod
+    def run_strategy(app, lead_matrix: LeadMatrix, method: str, params: Dict, timings=None,
+                     label: str = None) -> Recommender:
+        """Runs a strategy in a pool thread
+
+        :param app: Flask application, whose context is pushed in the thread
+        :param lead_matrix: User-course lead matrix shared with the requesting recommender
+        :param method: Name of the `make_*` method
+        :param params: Method parameters
+        :param timings: Timings of the requesting request, to which the strategy adds its own
+        :param label: Profiler label of the requesting thread, under which the strategy is sampled
+        :return: A recommender with the sections filled by the strategy
+        """
+        with app.app_context(), sampling_profiler.track(label):
+            bind_timings(timings)
+            return getattr(Recommender(lead_matrix), method)(**params)
+
+
+strategy_dispatcher = StrategyDispatcher()
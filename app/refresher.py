@@ -0,0 +1,104 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+
+class RecommendationRefresher:
+    """Refreshes the stored recommendations of the users that request information about a course, and of their most
+        similar users, in a background thread of each process. Refreshes of the same user waiting in the queue are
+        merged, so a user is refreshed once with every course requested since the refresh was queued"""
+
+    def __init__(self, app=None):
+        """RecommendationRefresher constructor
+
+        :param app: Flask application. If provided, the refresher is configured from it
+        """
+        self.app = None
+        self.refresh_neighbours = 10
+        self.max_queue_size = 10000
+        # Courses of the queued users that may not be in the leads yet, by user identifier
+        self._queue = OrderedDict()
+        self._condition = threading.Condition()
+        self._refresh_lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the refresher from the application config
+
+        :param app: Flask application
+        """
+        self.app = app
+        self.refresh_neighbours = app.config.get('RECOMMENDATIONS_STORE_REFRESH_NEIGHBOURS', self.refresh_neighbours)
+        self.max_queue_size = app.config.get('RECOMMENDATIONS_STORE_REFRESH_QUEUE_SIZE', self.max_queue_size)
+
+    def enqueue(self, user_id: str, exclude_course_ids: List[str] = None) -> bool:
+        """Queues the refresh of the recommendations of a user and their most similar users
+
+        :param user_id: User identifier
+        :param exclude_course_ids: Course identifiers requested by the user that are not in the leads yet
+        :return: False if the queue is full and the refresh is dropped
+        """
+        with self._condition:
+            self.start()
+
+            if user_id not in self._queue and len(self._queue) >= self.max_queue_size:
+                self.app.logger.warning('Recommendation refresh queue is full, user %s is not refreshed', user_id)
+                return False
+
+            self._queue.setdefault(user_id, set()).update(exclude_course_ids or [])
+            self._condition.notify()
+
+        return True
+
+    def start(self):
+        """Starts the thread that refreshes the queued users, once per process"""
+        if self._pid == os.getpid():
+            return
+
+        # Users queued by the parent process before a fork are refreshed by the parent process
+        self._pid = os.getpid()
+        self._queue = OrderedDict()
+        self._worker = threading.Thread(target=self.run, name='recommendation-refresher', daemon=True)
+        self._worker.start()
+
+    def run(self):
+        """Refreshes the queued users as they arrive"""
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._queue) > 0)
+
+            self.refresh_pending()
+
+    def refresh_pending(self):
+        """Refreshes the queued users in the calling thread. Errors are logged, since stale recommendations are still
+            served"""
+        from .recommender import Recommender
+
+        with self._refresh_lock, self.app.app_context():
+            while True:
+                with self._condition:
+                    if len(self._queue) == 0:
+                        return
+                    user_id, exclude_course_ids = self._queue.popitem(last=False)
+
+                try:
+                    Recommender().refresh_recommendations_for_user(user_id, refresh_neighbours=self.refresh_neighbours,
+                                                                   exclude_course_ids=sorted(exclude_course_ids))
+                except Exception:
+                    self.app.logger.exception('Unable to refresh the recommendations of user %s', user_id)
+
+    @property
+    def pending(self) -> int:
+        """Returns the number of users waiting to be refreshed
+
+        :return: The size of the queue
+        """
+        return len(self._queue)
+
+
+recommendation_refresher = RecommendationRefresher()
@@ -0,0 +1,144 @@
+import re
+import unicodedata
+import numpy as np
+from collections import Counter
+from scipy import sparse
+from typing import List
+from .similarity import top_k_indexes
+
+WORD_PATTERN = re.compile(r'(?u)\w+')
+
+
+def tokenize(document: str) -> List[str]:
+    """Splits a text in lowercase words without accents
+
+    :param document: Text
+    :return: The words of the text
+    """
+    normalized = unicodedata.normalize('NFKD', (document or '').lower())
+    normalized = ''.join(character for character in normalized if not unicodedata.combining(character))
+
+    return WORD_PATTERN.findall(normalized)
+
+
+class CourseSearchIndex:
+    """In-memory inverted index of the titles and descriptions of some courses. The BM25 score of each term in each
+        course is computed when the index is built, so a query only adds up the posting rows of its terms. Terms are
+        kept sorted, and the last word of a query can also match the terms that start with it, for type-ahead"""
+
+    # BM25 term frequency saturation and length normalization
+    K1 = 1.2
+    B = 0.75
+    # Each occurrence of a term in the title counts as this many occurrences in the description
+    TITLE_WEIGHT = 3
+    # Maximum number of terms matched by a prefix, the ones found in more courses
+    MAX_EXPANSIONS = 50
+
+    def __init__(self, titles: List[str], descriptions: List[str], order: np.ndarray = None):
+        """CourseSearchIndex constructor. Builds the postings of every term
+
+        :param titles: Title of each course
+        :param descriptions: Description of each course
+        :param order: Rank of each course, used to sort courses with the same score. If None, the course order is used
+        """
+        documents = []
+        for title, description in zip(titles, descriptions):
+            counts = Counter()
+            for term in tokenize(title):
+                counts[term] += self.TITLE_WEIGHT
+            counts.update(tokenize(description))
+            documents.append(counts)
+
+        self.terms = np.array(sorted({term for counts in documents for term in counts}), dtype=str)
+        self.order = np.arange(len(documents)) if order is None else np.asarray(order)
+        term_ids = {term: term_id for (term_id, term) in enumerate(self.terms.tolist())}
+
+        rows, columns, frequencies = [], [], []
+        for document, counts in enumerate(documents):
+            for term, frequency in counts.items():
+                rows.append(term_ids[term])
+                columns.append(document)
+                frequencies.append(frequency)
+
+        postings = sparse.csr_matrix((np.array(frequencies, dtype=np.float64), (rows, columns)),
+                                     shape=(len(self.terms), len(documents)))
+
+        lengths = np.asarray(postings.sum(axis=0)).ravel()
+        average_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+        self.document_frequencies = np.diff(postings.indptr)
+        idf = np.log(1 + (len(documents) - self.document_frequencies + 0.5) / (self.document_frequencies + 0.5))
+
+        # Score of each posting: the idf of the term times its saturated frequency in the course
+        frequencies = postings.data
+        norms = self.K1 * (1 - self.B + self.B * lengths[postings.indices] / average_length)
+        term_of_posting = np.repeat(np.arange(len(self.terms)), self.document_frequencies)
+        postings.data = idf[term_of_posting] * frequencies * (self.K1 + 1) / (frequencies + norms)
+        self.scores = postings
+
+    @property
+    def number_of_courses(self) -> int:
+        """Returns the number of indexed courses
+
+        :return: The number of courses
+        """
+        return self.scores.shape[1]
+
+    def term_ids(self, terms: List[str]) -> np.ndarray:
+        """Returns the identifiers of the indexed terms among some terms
+
+        :param terms: Terms
+        :return: Term identifiers
+        """
+        if len(terms) == 0:
+            return np.array([], dtype=np.int64)
+
+        positions = np.searchsorted(self.terms, terms)
+        found = [position for (position, term) in zip(positions, terms)
+                 if position < len(self.terms) and self.terms[position] == term]
+
+        return np.array(found, dtype=np.int64)
+
+    def prefix_term_ids(self, prefix: str) -> np.ndarray:
+        """Returns the identifiers of the terms that start with a prefix, the ones found in more courses first
+
+        :param prefix: Prefix
+        :return: Term identifiers
+        """
+        start = np.searchsorted(self.terms, prefix, side='left')
+        end = np.searchsorted(self.terms, prefix + '\uffff', side='left')
+        term_ids = np.arange(start, end)
+
+        if len(term_ids) > self.MAX_EXPANSIONS:
+            term_ids = term_ids[np.argsort(-self.document_frequencies[term_ids], kind='stable')[:self.MAX_EXPANSIONS]]
+
+        return term_ids
+
+    def search(self, query: str, max_results: int = 10, prefix: bool = False) -> np.ndarray:
+        """Finds the courses that best match a query. Courses match any of the words of the query
+
+        :param query: Text of the query
+        :param max_results: Maximum number of courses to retrieve
+        :param prefix: If True, the last word of the query also matches the terms that start with it. Only its best
+            matching term is scored for each course
+        :return: The indexes of the courses, sorted by descending score
+        """
+        words = tokenize(query)
+        if len(words) == 0 or self.number_of_courses == 0:
+            return np.array([], dtype=np.int64)
+
+        scores = np.zeros(self.number_of_courses)
+
+        if prefix:
+            *words, last_word = words
+            expansions = self.prefix_term_ids(last_word)
+            if len(expansions) > 0:
+                scores += self.scores[expansions].max(axis=0).toarray().ravel()
+
+        term_ids = self.term_ids(words)
+        if len(term_ids) > 0:
+            scores += np.asarray(self.scores[term_ids].sum(axis=0)).ravel()
+
+        candidates = np.flatnonzero(scores > 0)
+        candidates = candidates[top_k_indexes(scores[candidates], max_results, self.order[candidates])]
+
+        return candidates[np.lexsort((self.order[candidates], -scores[candidates]))]
@@ -0,0 +1,50 @@
+import numpy as np
+from scipy import sparse
+from typing import Iterator, Tuple
+
+
+def top_k_similarities(matrix: sparse.csr_matrix, k: int,
+                       chunk_size: int = 256) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Computes the k most similar rows of each row of a matrix, as the sparse product of chunks of rows by the
+        transposed matrix, so the full similarity matrix is never held in memory. Similarities of a row with itself
+        and null similarities are discarded
+
+    :param matrix: Sparse matrix whose rows are the items to compare
+    :param k: Number of similar items kept for each row
+    :param chunk_size: Number of rows multiplied at once
+    :return: Iterator of tuples with the row indexes, the similar row indexes and the similarities
+    """
+    transposed = matrix.T.tocsr()
+    top = min(k, matrix.shape[0])
+
+    for start in range(0, matrix.shape[0], chunk_size):
+        end = min(start + chunk_size, matrix.shape[0])
+        similarities = matrix[start:end].dot(transposed).toarray()
+        similarities[np.arange(end - start), np.arange(start, end)] = 0
+
+        columns = np.argpartition(-similarities, top - 1, axis=1)[:, :top]
+        values = np.take_along_axis(similarities, columns, axis=1).ravel()
+        rows = np.repeat(np.arange(start, end), top)
+        keep = values > 0
+
+        yield rows[keep], columns.ravel()[keep], values[keep]
+
+
+def top_k_indexes(values: np.ndarray, k: int, order: np.ndarray) -> np.ndarray:
+    """Returns the indexes of the k largest values without sorting them all. Ties at the k-th value are resolved in
+        favour of the lowest order, so the selection does not depend on how the values are partitioned
+
+    :param values: Array of values
+    :param k: Number of indexes
+    :param order: Tie-breaking order of each value
+    :return: The indexes of the k largest values, unsorted
+    """
+    if len(values) <= k:
+        return np.arange(len(values))
+
+    threshold = np.partition(values, len(values) - k)[len(values) - k]
+    above = np.flatnonzero(values > threshold)
+    ties = np.flatnonzero(values == threshold)
+    ties = ties[np.argsort(order[ties], kind='stable')[:k - len(above)]]
+
+    return np.concatenate([above, ties])
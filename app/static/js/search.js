@@ -0,0 +1,31 @@
+(function () {
+    var input = document.getElementById('search-input');
+    var suggestions = document.getElementById('search-suggestions');
+    var timer = null;
+
+    if (!input || !suggestions) {
+        return;
+    }
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            var query = input.value.trim();
+            if (query.length < 2) {
+                suggestions.innerHTML = '';
+                return;
+            }
+
+            fetch(input.dataset.suggestUrl + '?q=' + encodeURIComponent(query))
+                .then(function (response) { return response.json(); })
+                .then(function (courses) {
+                    suggestions.innerHTML = '';
+                    courses.forEach(function (course) {
+                        var option = document.createElement('option');
+                        option.value = course.title;
+                        suggestions.appendChild(option);
+                    });
+                });
+        }, 150);
+    });
+})();
@@ -0,0 +1 @@
+"""Benchmarks of the recommender and repository hot paths, run against a generated SQLite database"""
@@ -0,0 +1,48 @@
+import sys
+import json
+import click
+from typing import Dict
+
+
+def index_results(report: Dict) -> Dict:
+    """Indexes the case statistics of a report by scale and case
+
+    :param report: Report written by `benchmarks.run`
+    :return: A dictionary whose keys are (scale, case) tuples and values are the case statistics
+    """
+    return {(result['scale'], case): statistics
+            for result in report['results'] for (case, statistics) in result['cases'].items()}
+
+
+@click.command()
+@click.argument('before', type=click.File())
+@click.argument('after', type=click.File())
+@click.option('--statistic', default='median_ms', help='Statistic compared: min_ms, median_ms, mean_ms or p95_ms')
+@click.option('--fail-above', default=None, type=float,
+              help='Exit with an error if any case is slower than this ratio, for instance 1.10')
+def main(before, after, statistic: str, fail_above: float):
+    """Compares two benchmark reports. Ratios above 1 are regressions"""
+    before_results = index_results(json.load(before))
+    after_results = index_results(json.load(after))
+
+    regressions = 0
+    click.echo('{:<8} {:<32} {:>12} {:>12} {:>8}'.format('scale', 'case', 'before', 'after', 'ratio'))
+
+    for key in sorted(set(before_results) & set(after_results)):
+        before_value = before_results[key][statistic]
+        after_value = after_results[key][statistic]
+        ratio = after_value / before_value if before_value else float('inf')
+
+        if fail_above is not None and ratio > fail_above:
+            regressions += 1
+
+        click.echo('{:<8} {:<32} {:>12.3f} {:>12.3f} {:>8.2f}'.format(key[0], key[1], before_value, after_value,
+                                                                      ratio))
+
+    if regressions:
+        click.echo('{} cases are slower than {:.2f} times the previous run'.format(regressions, fail_above), err=True)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
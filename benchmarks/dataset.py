@@ -0,0 +1,220 @@
+import os
+import json
+import hashlib
+import sqlite3
+import numpy as np
+from scipy import sparse
+from typing import Dict
+from app.lead_matrix import LeadMatrix
+
+# Dataset sizes. Leads per user is the mean number of courses requested by each user
+SCALES = {
+    'small': {'courses': 1000, 'categories': 20, 'users': 10000, 'leads_per_user': 4},
+    'medium': {'courses': 5000, 'categories': 50, 'users': 100000, 'leads_per_user': 4},
+    'large': {'courses': 20000, 'categories': 100, 'users': 1000000, 'leads_per_user': 4},
+}
+
+SCHEMA = '''
+CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE courses (id TEXT PRIMARY KEY, title TEXT, description TEXT, category_id INTEGER, center TEXT,
+                      number_of_leads INTEGER, num_reviews INTEGER, weighted_rating REAL);
+CREATE INDEX courses_category_id ON courses (category_id);
+CREATE TABLE leads (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, course_id TEXT, course_title TEXT,
+                    course_description TEXT, center TEXT, course_category TEXT, created_on TEXT);
+CREATE TABLE clean_leads (user_id TEXT, course_id TEXT);
+CREATE INDEX clean_leads_user_id ON clean_leads (user_id);
+CREATE TABLE recommended_courses_by_leads (course TEXT, recommended TEXT);
+CREATE INDEX recommended_courses_by_leads_course ON recommended_courses_by_leads (course);
+CREATE TABLE courses_similarities (a_course_id TEXT, another_course_id TEXT, similarity REAL);
+CREATE INDEX courses_similarities_a_course_id ON courses_similarities (a_course_id);
+'''
+
+WORDS = ('python data web design marketing finance cloud security java sql excel management sales english '
+         'photography nursing accounting law logistics cooking yoga music art psychology coaching').split()
+
+
+class SyntheticDataset:
+    """Generates a catalog, its leads and the similarity tables into an SQLite database, together with the lead
+        matrix file. Course popularity follows a power law, so a few courses get most of the leads"""
+
+    DATABASE_FILE = 'catalog.sqlite'
+    LEAD_MATRIX_FILE = 'lead_matrix.leads'
+    META_FILE = 'dataset.json'
+
+    def __init__(self, directory: str, courses: int, categories: int, users: int, leads_per_user: int,
+                 similar_courses: int = 10, seed: int = 0):
+        """SyntheticDataset constructor
+
+        :param directory: Directory where the database and the lead matrix file are written
+        :param courses: Number of courses
+        :param categories: Number of categories
+        :param users: Number of users with leads
+        :param leads_per_user: Mean number of courses requested by each user
+        :param similar_courses: Number of rows of each course in the similarity tables
+        :param seed: Seed of the random generator
+        """
+        self.directory = directory
+        self.parameters = {'courses': courses, 'categories': categories, 'users': users,
+                           'leads_per_user': leads_per_user, 'similar_courses': similar_courses, 'seed': seed}
+
+    @property
+    def database_file(self) -> str:
+        """Returns the path to the SQLite database
+
+        :return: Path to the SQLite database
+        """
+        return os.path.join(self.directory, self.DATABASE_FILE)
+
+    @property
+    def lead_matrix_file(self) -> str:
+        """Returns the path to the lead matrix file
+
+        :return: Path to the lead matrix file
+        """
+        return os.path.join(self.directory, self.LEAD_MATRIX_FILE)
+
+    @property
+    def meta_file(self) -> str:
+        """Returns the path to the file holding the parameters of the generated dataset
+
+        :return: Path to the file holding the parameters of the generated dataset
+        """
+        return os.path.join(self.directory, self.META_FILE)
+
+    def exists(self) -> bool:
+        """Returns whether the dataset was already generated in the directory with the same parameters
+
+        :return: True if the dataset can be reused
+        """
+        if not os.path.exists(self.meta_file):
+            return False
+
+        with open(self.meta_file) as meta_file:
+            return json.load(meta_file) == self.parameters
+
+    def generate(self):
+        """Writes the database and the lead matrix file, replacing any previous dataset"""
+        os.makedirs(self.directory, exist_ok=True)
+        for path in (self.database_file, self.lead_matrix_file, self.meta_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+        random = np.random.RandomState(self.parameters['seed'])
+        number_of_courses = self.parameters['courses']
+        course_ids = [str(course_id) for course_id in range(1, number_of_courses + 1)]
+
+        popularity = 1 / np.arange(1, number_of_courses + 1) ** 0.8
+        popularity = random.permutation(popularity / popularity.sum())
+
+        lead_matrix, user_ids = self.leads(random, popularity)
+        number_of_leads = np.asarray(lead_matrix.sum(axis=0)).ravel().astype(int)
+
+        connection = sqlite3.connect(self.database_file)
+        try:
+            connection.executescript(SCHEMA)
+            self.write_catalog(connection, random, course_ids, number_of_leads)
+            self.write_clean_leads(connection, lead_matrix, user_ids, course_ids)
+            self.write_similarities(connection, random, course_ids, popularity)
+            connection.commit()
+        finally:
+            connection.close()
+
+        LeadMatrix(lead_matrix, user_ids, course_ids).save(self.lead_matrix_file)
+
+        with open(self.meta_file, 'w') as meta_file:
+            json.dump(self.parameters, meta_file)
+
+    def leads(self, random: np.random.RandomState, popularity: np.ndarray):
+        """Draws the courses requested by each user
+
+        :param random: Random generator
+        :param popularity: Probability of each course being requested
+        :return: The binary user-course lead matrix and the user identifiers
+        """
+        number_of_users = self.parameters['users']
+        leads_per_user = 1 + random.poisson(self.parameters['leads_per_user'] - 1, size=number_of_users)
+
+        rows = np.repeat(np.arange(number_of_users), leads_per_user)
+        columns = random.choice(len(popularity), size=len(rows), p=popularity)
+
+        lead_matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                                        shape=(number_of_users, len(popularity)))
+        lead_matrix.data[:] = 1
+
+        user_ids = [hashlib.md5('user{}@example.com'.format(user).encode()).hexdigest()
+                    for user in range(number_of_users)]
+
+        return lead_matrix, user_ids
+
+    def write_catalog(self, connection: sqlite3.Connection, random: np.random.RandomState, course_ids,
+                      number_of_leads: np.ndarray):
+        """Writes the categories and the courses
+
+        :param connection: Database connection
+        :param random: Random generator
+        :param course_ids: Course identifiers
+        :param number_of_leads: Number of leads of each course
+        """
+        number_of_categories = self.parameters['categories']
+        connection.executemany('INSERT INTO categories (id, name) VALUES (?, ?)',
+                               [(category, 'Category {}'.format(category))
+                                for category in range(1, number_of_categories + 1)])
+
+        categories = random.randint(1, number_of_categories + 1, size=len(course_ids))
+        reviews = random.poisson(20, size=len(course_ids))
+        ratings = random.uniform(5, 10, size=len(course_ids))
+        words = random.randint(0, len(WORDS), size=(len(course_ids), 40))
+
+        connection.executemany('''INSERT INTO courses (id, title, description, category_id, center, number_of_leads,
+                                  num_reviews, weighted_rating) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                               ((course_id,
+                                 'Course {} {}'.format(course_id, ' '.join(WORDS[word] for word in words[index, :3])),
+                                 ' '.join(WORDS[word] for word in words[index]),
+                                 int(categories[index]),
+                                 'Center {}'.format(index % 200),
+                                 int(number_of_leads[index]),
+                                 int(reviews[index]),
+                                 float(ratings[index])) for (index, course_id) in enumerate(course_ids)))
+
+    @staticmethod
+    def write_clean_leads(connection: sqlite3.Connection, lead_matrix: sparse.csr_matrix, user_ids, course_ids):
+        """Writes one clean lead per non zero entry of the lead matrix
+
+        :param connection: Database connection
+        :param lead_matrix: User-course lead matrix
+        :param user_ids: User identifier of each row
+        :param course_ids: Course identifier of each column
+        """
+        rows = np.repeat(np.arange(lead_matrix.shape[0]), np.diff(lead_matrix.indptr))
+        leads = zip(rows, lead_matrix.indices)
+        connection.executemany('INSERT INTO clean_leads (user_id, course_id) VALUES (?, ?)',
+                               ((user_ids[row], course_ids[column]) for (row, column) in leads))
+
+    def write_similarities(self, connection: sqlite3.Connection, random: np.random.RandomState, course_ids,
+                           popularity: np.ndarray):
+        """Writes the co-lead and content similarity tables. Similar courses are drawn by popularity
+
+        :param connection: Database connection
+        :param random: Random generator
+        :param course_ids: Course identifiers
+        :param popularity: Probability of each course being requested
+        """
+        similar_courses = self.parameters['similar_courses']
+        similar = random.choice(len(course_ids), size=(len(course_ids), similar_courses), p=popularity)
+        similarities = np.sort(random.uniform(0, 1, size=similar.shape), axis=1)[:, ::-1]
+
+        connection.executemany('INSERT INTO recommended_courses_by_leads (course, recommended) VALUES (?, ?)',
+                               ((course_id, course_ids[other]) for (index, course_id) in enumerate(course_ids)
+                                for other in similar[index]))
+        connection.executemany('''INSERT INTO courses_similarities (a_course_id, another_course_id, similarity)
+                                  VALUES (?, ?, ?)''',
+                               ((course_id, course_ids[other], float(similarity))
+                                for (index, course_id) in enumerate(course_ids)
+                                for (other, similarity) in zip(similar[index], similarities[index])))
+
+    def describe(self) -> Dict:
+        """Returns the dataset parameters
+
+        :return: A dictionary with the dataset parameters
+        """
+        return dict(self.parameters)
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import click
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import scipy
+from typing import Callable, Dict, List
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def measure(function: Callable, arguments: List, repeat: int, warmup: int) -> Dict:
+    """Times a function, calling it with each argument in turn
+
+    :param function: Function to time. It receives one argument
+    :param arguments: Arguments of the calls. They are cycled if there are fewer arguments than calls
+    :param repeat: Number of timed calls
+    :param warmup: Number of untimed calls made before
+    :return: A dictionary with the statistics of the call times, in milliseconds
+    """
+    for index in range(warmup):
+        function(arguments[index % len(arguments)])
+
+    timings = []
+    for index in range(repeat):
+        argument = arguments[(warmup + index) % len(arguments)]
+        start = time.perf_counter()
+        function(argument)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings = np.array(timings)
+
+    return {'calls': repeat,
+            'min_ms': float(timings.min()),
+            'median_ms': float(np.median(timings)),
+            'mean_ms': float(timings.mean()),
+            'p95_ms': float(np.percentile(timings, 95)),
+            'max_ms': float(timings.max())}
+
+
+def run_scale(scale: str, parameters: Dict, directory: str, repeat: int, warmup: int, overrides: Dict) -> Dict:
+    """Generates the dataset of a scale, if needed, and times every benchmark case against it. It is run in a fresh
+        process, so the process-wide caches of the application start empty
+
+    :param scale: Scale name
+    :param parameters: Dataset parameters
+    :param directory: Directory of the dataset
+    :param repeat: Number of timed calls of each case
+    :param warmup: Number of untimed calls of each case
+    :param overrides: Configuration values replacing the defaults
+    :return: A dictionary with the dataset and the statistics of each case
+    """
+    from config import Config
+    from benchmarks.dataset import SyntheticDataset
+
+    dataset = SyntheticDataset(directory, **parameters)
+    generation_time = None
+    if not dataset.exists():
+        start = time.perf_counter()
+        dataset.generate()
+        generation_time = time.perf_counter() - start
+
+    settings = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(dataset.database_file),
+                'LEAD_MATRIX_FILE': dataset.lead_matrix_file}
+    settings.update(overrides)
+
+    from app import create_app, lead_matrix_index
+    from app.lead_matrix import LeadMatrixIndex
+    from app.recommender import Recommender, find_similar_users
+    from app.main.use_cases import (RetrieveCourseCatalog, RetrieveCourseCatalogCommand, RetrieveCourseData,
+                                    RetrieveCourseDataCommand)
+
+    application = create_app(type('BenchmarkConfig', (Config,), settings))
+
+    start = time.perf_counter()
+    LeadMatrixIndex.load(dataset.lead_matrix_file)
+    load_time = time.perf_counter() - start
+
+    random = np.random.RandomState(parameters.get('seed', 0))
+    number_of_calls = warmup + repeat
+
+    with application.app_context():
+        lead_matrix = lead_matrix_index.get()
+        user_ids = lead_matrix.users(random.randint(0, lead_matrix.number_of_users, size=number_of_calls)).tolist()
+        course_ids = [str(course_id) for course_id in random.randint(1, parameters['courses'] + 1,
+                                                                     size=number_of_calls)]
+        catalog_commands = [RetrieveCourseCatalogCommand(page=int(page), sort_by=sort_by, category=category)
+                            for (page, sort_by, category) in zip(
+                                random.randint(1, 6, size=number_of_calls),
+                                random.choice([RetrieveCourseCatalogCommand.SORT_LEADS,
+                                               RetrieveCourseCatalogCommand.SORT_RATING], size=number_of_calls),
+                                [None if category == 0 else int(category)
+                                 for category in random.randint(0, parameters['categories'] + 1,
+                                                                size=number_of_calls)])]
+        course_commands = [RetrieveCourseDataCommand(course_id, user_id)
+                           for (course_id, user_id) in zip(course_ids, user_ids)]
+
+        cases = {
+            'find_similar_users': measure(lambda user_id: find_similar_users(user_id, max_neighbours=50),
+                                          user_ids, repeat, warmup),
+            'make_recommendations_for_user': measure(
+                lambda user_id: Recommender().make_recommendations_for_user(user_id), user_ids, repeat, warmup),
+            'retrieve_course_catalog': measure(RetrieveCourseCatalog.execute, catalog_commands, repeat, warmup),
+            'retrieve_course_data': measure(RetrieveCourseData.execute, course_commands, repeat, warmup),
+        }
+
+    return {'scale': scale,
+            'dataset': dataset.describe(),
+            'generation_s': generation_time,
+            'lead_matrix_load_ms': load_time * 1000,
+            'cases': cases}
+
+
+def git_commit() -> str:
+    """Returns the commit of the working tree
+
+    :return: The commit hash or None if it is not a git repository
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=basedir,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_overrides(values: List[str]) -> Dict:
+    """Parses KEY=VALUE configuration overrides. Values are read as JSON, or as strings if they are not valid JSON
+
+    :param values: Overrides given in the command line
+    :return: A dictionary of configuration values
+    """
+    overrides = {}
+    for value in values:
+        key, separator, raw = value.partition('=')
+        if not separator:
+            raise click.BadParameter('{} must be KEY=VALUE'.format(value))
+        try:
+            overrides[key] = json.loads(raw)
+        except ValueError:
+            overrides[key] = raw
+
+    return overrides
+
+
+@click.command()
+@click.option('--scales', default='small', help='Comma separated scales: small, medium and large')
+@click.option('--repeat', default=50, help='Number of timed calls of each case')
+@click.option('--warmup', default=5, help='Number of untimed calls of each case')
+@click.option('--data-dir', default=None, help='Directory where datasets are kept and reused. Temporary if omitted')
+@click.option('--set', 'overrides', multiple=True, help='Configuration override, as KEY=VALUE')
+@click.option('--output', default=None, help='JSON results file. Printed to stdout if omitted')
+def main(scales: str, repeat: int, warmup: int, data_dir: str, overrides: List[str], output: str):
+    """Times the recommender and repository hot paths at several dataset scales"""
+    from benchmarks.dataset import SCALES
+
+    names = [name.strip() for name in scales.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCALES]
+    if unknown:
+        raise click.BadParameter('Unknown scales: {}'.format(', '.join(unknown)))
+
+    settings = parse_overrides(overrides)
+    temporary_directory = None
+    if data_dir is None:
+        temporary_directory = tempfile.TemporaryDirectory(prefix='recommendations-benchmarks-')
+        data_dir = temporary_directory.name
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    try:
+        for name in names:
+            click.echo('Running the {} scale'.format(name), err=True)
+            with context.Pool(1) as pool:
+                results.append(pool.apply(run_scale, (name, SCALES[name], os.path.join(data_dir, name), repeat,
+                                                      warmup, settings)))
+    finally:
+        if temporary_directory is not None:
+            temporary_directory.cleanup()
+
+    report = {'metadata': {'commit': git_commit(),
+                           'created_on': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                           'python': platform.python_version(),
+                           'numpy': np.__version__,
+                           'scipy': scipy.__version__,
+                           'platform': platform.platform(),
+                           'repeat': repeat,
+                           'warmup': warmup,
+                           'config': settings},
+              'results': results}
+
+    if output is None:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        with open(output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
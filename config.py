@@ -1,4 +1,9 @@
 
+import os
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
 class Config:
     DEBUG = False
     TESTING = False
@@ -12,6 +17,99 @@ class Config:
                                                            DB_HOST,
                                                            DB_NAME)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool. Connections idle for longer than DB_POOL_RECYCLE seconds are replaced before the server closes
+    # them, and connections are tested before each checkout. When gunicorn starts a worker, the worker opens
+    # DB_POOL_WARMUP_CONNECTIONS connections and runs the queries of the most visited pages
+    DB_POOL_SIZE = 5
+    DB_POOL_MAX_OVERFLOW = 5
+    DB_POOL_TIMEOUT = 10
+    DB_POOL_RECYCLE = 280
+    DB_POOL_PRE_PING = True
+    DB_POOL_WARMUP = False
+    DB_POOL_WARMUP_CONNECTIONS = 2
+    # Memory mapped lead matrix file, shared by all the worker processes. Pickled dictionaries of sparse rows are
+    # still read, and can be converted with `python manage.py convert-lead-matrix`. Until the lead matrix file is
+    # written, the pickled lead matrix of previous versions is read instead
+    LEAD_MATRIX_FILE = os.path.join(basedir, 'data', 'user_requested_courses.leads')
+    LEAD_MATRIX_LEGACY_FILE = os.path.join(basedir, 'data', 'user_requested_courses_map.pickle')
+    # Neighbour search: 'exact' scores every user, 'lsh' only the candidates of a MinHash LSH index. More bands of
+    # fewer hashes increase recall and latency
+    NEIGHBOUR_SEARCH = 'exact'
+    LSH_NUM_HASHES = 64
+    LSH_BANDS = 16
+    LSH_MIN_LEADS = 3
+    # Exact neighbour search over row shards of the memory mapped lead matrix, scored by a pool of processes. It is
+    # disabled with 0 processes, and only used for matrices with at least NEIGHBOUR_SEARCH_MIN_USERS users. Searches
+    # that take longer than NEIGHBOUR_SEARCH_TIMEOUT seconds are scored in the worker, and the pool is replaced
+    NEIGHBOUR_SEARCH_PROCESSES = 0
+    NEIGHBOUR_SEARCH_SHARDS = None
+    NEIGHBOUR_SEARCH_MIN_USERS = 100000
+    NEIGHBOUR_SEARCH_TIMEOUT = 2.0
+    # Collaborative filtering of the user recommendations: 'user' merges the courses of the most similar users,
+    # 'item' sums the precomputed neighbours of the courses requested by the user
+    COLLABORATIVE_FILTERING = 'user'
+    ITEM_NEIGHBOURS = 20
+    # Stored recommendations of the users that request information, and of their most similar users, are refreshed
+    # by a background thread of each worker. Users beyond the queue size are refreshed by the next build
+    RECOMMENDATIONS_STORE_ENABLED = False
+    RECOMMENDATIONS_STORE_REFRESH_NEIGHBOURS = 10
+    RECOMMENDATIONS_STORE_REFRESH_QUEUE_SIZE = 10000
+    # Category aggregates are read from the category_stats table, updated with each lead, and rebuilt from the courses
+    # with `python manage.py rebuild-category-stats`. The courses table is not updated with each lead
+    CATEGORY_STATS_ENABLED = False
+    CATALOG_SNAPSHOT_ENABLED = False
+    CATALOG_SNAPSHOT_TTL = 600
+    # Course search, served from an inverted index of every course rebuilt every CATALOG_SNAPSHOT_TTL seconds
+    SEARCH_MAX_RESULTS = 50
+    SEARCH_MAX_SUGGESTIONS = 8
+    # Query cache backend: None (disabled), 'memory' (per worker) or 'shared' (all the workers of the host). Saving a
+    # lead only clears the memory cache of the worker that saved it, so other workers may serve stale responses for up
+    # to QUERY_CACHE_TTL seconds. The shared cache file is only readable by the user running the application
+    QUERY_CACHE_BACKEND = None
+    QUERY_CACHE_TTL = 300
+    QUERY_CACHE_MAX_ENTRIES = 1024
+    QUERY_CACHE_PATH = os.path.join(basedir, 'data', 'cache', 'query-cache.sqlite')
+    # Rendered page and fragment cache, with the same backends as the query cache. Pages are revalidated by clients
+    # with their ETag after PAGE_CACHE_MAX_AGE seconds. Saving a lead changes a generation token, stored next to
+    # PAGE_CACHE_PATH, that every worker of the host reads, so the memory backend does not serve stale entries
+    PAGE_CACHE_BACKEND = None
+    PAGE_CACHE_TTL = 60
+    PAGE_CACHE_FRAGMENT_TTL = 300
+    PAGE_CACHE_MAX_AGE = 0
+    PAGE_CACHE_MAX_ENTRIES = 1024
+    PAGE_CACHE_PATH = os.path.join(basedir, 'data', 'cache', 'page-cache.sqlite')
+    # Recommendation strategies of a page run concurrently, each one using its own database connection
+    RECOMMENDER_CONCURRENT_STRATEGIES = False
+    RECOMMENDER_MAX_WORKERS = 5
+    RECOMMENDER_STRATEGY_TIMEOUT = 2.0
+    # Leads are spooled to disk and inserted in batches instead of one insert per request
+    LEAD_WRITER_ENABLED = False
+    LEAD_WRITER_BATCH_SIZE = 100
+    LEAD_WRITER_FLUSH_INTERVAL = 2.0
+    # Batches that fail this many times are moved aside, to *.failed spool files, so later batches are inserted
+    LEAD_WRITER_MAX_ATTEMPTS = 5
+    LEAD_WRITER_SPOOL_DIR = os.path.join(basedir, 'data', 'spool')
+    # Saved leads are appended to a delta file next to the lead matrix file and laid over the lead matrix until they
+    # are compacted into the lead matrix file. Both files must be writable by the workers
+    LEAD_DELTA_ENABLED = False
+    LEAD_DELTA_COMPACT_INTERVAL = 300
+    LEAD_DELTA_COMPACT_SIZE = 1000
+    # Bulk recommendations API: bearer token of the clients, identifiers accepted per request and recommendations made
+    # per similarity computation. The API is disabled if no token is set
+    BULK_RECOMMENDATIONS_TOKEN = os.environ.get('BULK_RECOMMENDATIONS_TOKEN')
+    BULK_RECOMMENDATIONS_MAX_IDS = 1000
+    BULK_RECOMMENDATIONS_BATCH_SIZE = 500
+    # Per request timings in a Server-Timing header and latency histograms in the Prometheus format at /metrics
+    INSTRUMENTATION_ENABLED = False
+    INSTRUMENTATION_SERVER_TIMING = True
+    INSTRUMENTATION_METRICS_PATH = '/metrics'
+    # Sampling profiler: the stacks of the threads serving requests are sampled every interval of CPU time, and
+    # written as collapsed stacks per endpoint when a worker receives the dump signal. Gunicorn resets the handlers of
+    # the signals it uses (HUP, USR1, USR2, WINCH...) in each worker, so a real time signal is used
+    PROFILER_ENABLED = False
+    PROFILER_INTERVAL = 0.01
+    PROFILER_OUTPUT_DIR = os.path.join(basedir, 'data', 'profiles')
+    PROFILER_DUMP_SIGNAL = 'SIGRTMIN+1'
 
 
 class DevelopmentConfig(Config):
@@ -23,6 +121,7 @@ class TestingConfig(Config):
 
 
 class ProductionConfig(Config):
+    DB_POOL_WARMUP = True
     DB_USER = 'bc0e0e4f733dda'
     DB_PASSWORD = '00f61efe'
     DB_NAME = 'heroku_8149febc614deb5'
@@ -0,0 +1,12 @@
+# Gunicorn settings of the web workers, read with `gunicorn --config gunicorn.conf.py run:application`
+
+
+def post_worker_init(worker):
+    """Warms up the database connection pool of each worker once it has loaded the application, before it accepts
+    requests. Connections are opened by each worker, so they are not shared even if the application is preloaded
+
+    :param worker: The gunicorn worker
+    """
+    from app.pool import database_pool
+
+    database_pool.warm_up()
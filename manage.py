@@ -0,0 +1,83 @@
+import os
+import click
+from app import create_app, lead_matrix_index
+from app.builder import SimilarityBuilder
+from app.lead_matrix import LeadMatrixIndex, lead_matrix_lock
+from app.models import CategoryRepository, UserRecommendationRepository
+from app.recommender import Recommender
+
+environment = os.environ.get('FLASK_ENV', 'development')
+
+application = create_app('config.{}Config'.format(environment.capitalize()))
+
+
+@click.group()
+def cli():
+    """Maintenance commands of the courses recommender"""
+    pass
+
+
+@cli.command('build-recommendations')
+@click.option('--max-recommendations', default=10, help='Maximum number of recommendations per user')
+@click.option('--batch-size', default=500, help='Number of users whose recommendations are computed at once')
+def build_recommendations(max_recommendations: int, batch_size: int):
+    """Computes and stores the recommendations of every user in the lead matrix. The recommendations of each batch of
+    users are computed with a single similarity product and written with a single insert"""
+    with application.app_context():
+        user_recommendation_repository = UserRecommendationRepository()
+        user_recommendation_repository.create_table()
+
+        lead_matrix = lead_matrix_index.get()
+        recommender = Recommender(lead_matrix)
+        user_ids = lead_matrix.users().tolist()
+
+        with click.progressbar(length=len(user_ids), label='Building recommendations') as progress:
+            for start in range(0, len(user_ids), batch_size):
+                batch = user_ids[start:start + batch_size]
+                recommendations = recommender.make_recommendations_for_users(batch, max_recommendations)
+                user_recommendation_repository.save_many({user_id: list(courses.keys())
+                                                          for (user_id, courses) in recommendations.items()})
+                progress.update(len(batch))
+
+
+@cli.command('build-similarities')
+@click.option('--top-k', default=10, help='Number of similar courses kept for each course')
+@click.option('--chunk-size', default=10000, help='Number of rows read from database at once')
+def build_similarities(top_k: int, chunk_size: int):
+    """Rebuilds the course similarity tables and the lead matrix file from the courses and the leads"""
+    with application.app_context():
+        builder = SimilarityBuilder(top_k=top_k, chunk_size=chunk_size,
+                                    item_neighbours=application.config['ITEM_NEIGHBOURS'])
+        builder.build(application.config['LEAD_MATRIX_FILE'])
+
+
+@cli.command('convert-lead-matrix')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.argument('destination', required=False)
+def convert_lead_matrix(source: str, destination: str):
+    """Converts a pickled lead matrix to the memory mapped format. The destination defaults to the configured lead
+    matrix file"""
+    destination = destination or application.config['LEAD_MATRIX_FILE']
+    lead_matrix = LeadMatrixIndex.load(source)
+
+    with lead_matrix_lock(destination):
+        lead_matrix.save(destination)
+
+    click.echo('{} users written to {}'.format(lead_matrix.number_of_users, destination))
+
+
+@cli.command('rebuild-category-stats')
+@click.option('--reset-live-leads', is_flag=True, default=False,
+              help='Discard the leads saved since the last rebuild, once the courses count them')
+def rebuild_category_stats(reset_live_leads: bool):
+    """Recomputes the aggregates of every category in the category_stats table"""
+    with application.app_context():
+        category_repository = CategoryRepository()
+        category_repository.create_stats_table()
+        category_repository.rebuild_stats(reset_live_leads)
+
+    click.echo('Category stats rebuilt')
+
+
+if __name__ == '__main__':
+    cli()
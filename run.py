@@ -1,9 +1,11 @@
 import os
 from app import create_app
+from app.pool import database_pool
 
 environment = os.environ.get('FLASK_ENV', 'development')
 
 application = create_app('config.{}Config'.format(environment.capitalize()))
 
 if __name__ == '__main__':
+    database_pool.warm_up()
     application.run()
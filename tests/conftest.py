@@ -0,0 +1,48 @@
+import pytest
+from config import Config
+from benchmarks.dataset import SyntheticDataset
+from app import create_app
+
+
+@pytest.fixture(scope='session')
+def dataset(tmp_path_factory):
+    """Small synthetic catalog with its leads, generated once per test session"""
+    dataset = SyntheticDataset(str(tmp_path_factory.mktemp('dataset')), courses=200, categories=5, users=2000,
+                               leads_per_user=4)
+    dataset.generate()
+
+    return dataset
+
+
+@pytest.fixture
+def make_app(dataset, tmp_path):
+    """Returns a function that creates an application over the synthetic dataset, with some configuration values
+        replaced"""
+    def make_app(**overrides):
+        settings = {'TESTING': True,
+                    'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(dataset.database_file),
+                    'LEAD_MATRIX_FILE': dataset.lead_matrix_file,
+                    'LEAD_WRITER_SPOOL_DIR': str(tmp_path / 'spool'),
+                    'QUERY_CACHE_PATH': str(tmp_path / 'query-cache.sqlite'),
+                    'PAGE_CACHE_PATH': str(tmp_path / 'page-cache.sqlite'),
+                    'PROFILER_OUTPUT_DIR': str(tmp_path / 'profiles')}
+        settings.update(overrides)
+
+        return create_app(type('TestConfig', (Config,), settings))
+
+    return make_app
+
+
+@pytest.fixture
+def app(make_app):
+    """Application with the default configuration"""
+    app = make_app()
+
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    """Test client of the application"""
+    return app.test_client()
@@ -0,0 +1,58 @@
+import json
+import sqlite3
+from click.testing import CliRunner
+from benchmarks import compare
+from benchmarks.dataset import SyntheticDataset
+from benchmarks.run import measure, parse_overrides, run_scale
+
+
+def report(median_ms: float):
+    return {'results': [{'scale': 'small', 'cases': {'find_similar_users': {'median_ms': median_ms},
+                                                     'retrieve_course_data': {'median_ms': 2.0}}}]}
+
+
+def test_generated_dataset_is_reused_only_with_the_same_parameters(dataset):
+    parameters = dataset.describe()
+
+    assert SyntheticDataset(dataset.directory, **parameters).exists()
+    assert not SyntheticDataset(dataset.directory, **dict(parameters, users=10)).exists()
+
+    with sqlite3.connect(dataset.database_file) as connection:
+        assert connection.execute('SELECT COUNT(*) FROM courses').fetchone() == (200,)
+        assert connection.execute('SELECT COUNT(*) FROM categories').fetchone() == (5,)
+
+
+def test_calls_cycle_through_the_arguments():
+    arguments = []
+    statistics = measure(arguments.append, ['a', 'b', 'c'], repeat=4, warmup=1)
+
+    assert arguments == ['a', 'b', 'c', 'a', 'b']
+    assert statistics['calls'] == 4
+    assert 0 <= statistics['min_ms'] <= statistics['median_ms'] <= statistics['p95_ms'] <= statistics['max_ms']
+
+
+def test_overrides_are_read_as_json_or_strings():
+    assert parse_overrides(['NEIGHBOUR_SEARCH=lsh', 'LSH_BANDS=8', 'QUERY_CACHE_BACKEND=null']) == \
+        {'NEIGHBOUR_SEARCH': 'lsh', 'LSH_BANDS': 8, 'QUERY_CACHE_BACKEND': None}
+
+
+def test_scale_run_times_every_case_over_an_existing_dataset(dataset):
+    result = run_scale('test', dataset.describe(), dataset.directory, repeat=2, warmup=1, overrides={})
+
+    assert result['generation_s'] is None
+    assert set(result['cases']) == {'find_similar_users', 'make_recommendations_for_user',
+                                    'retrieve_course_catalog', 'retrieve_course_data'}
+    assert all(statistics['calls'] == 2 for statistics in result['cases'].values())
+
+
+def test_slower_cases_fail_the_comparison(tmp_path):
+    before, after = str(tmp_path / 'before.json'), str(tmp_path / 'after.json')
+    with open(before, 'w') as before_file, open(after, 'w') as after_file:
+        json.dump(report(10.0), before_file)
+        json.dump(report(12.0), after_file)
+
+    passed = CliRunner().invoke(compare.main, [before, after, '--fail-above', '1.25'])
+    failed = CliRunner().invoke(compare.main, [before, after, '--fail-above', '1.10'])
+
+    assert passed.exit_code == 0 and '1.20' in passed.output
+    assert failed.exit_code == 1
@@ -0,0 +1,50 @@
+import shutil
+import pytest
+from sqlalchemy import inspect
+from app import db
+from app.builder import SimilarityBuilder
+from app.lead_matrix import LeadMatrix
+
+
+@pytest.fixture
+def builder_app(make_app, dataset, tmp_path):
+    """Application over a copy of the dataset database, since the similarity tables are replaced"""
+    path = str(tmp_path / 'builder.sqlite')
+    shutil.copy(dataset.database_file, path)
+
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(path))
+
+    with app.app_context():
+        yield app
+
+
+def indexes(table: str):
+    """Name and columns of the indexes of a table"""
+    return sorted((index['name'], tuple(index['column_names'])) for index in inspect(db.engine).get_indexes(table))
+
+
+def test_rebuilt_tables_keep_their_indexes(builder_app, tmp_path):
+    before = {table: indexes(table) for table in ('courses_similarities', 'recommended_courses_by_leads')}
+    path = str(tmp_path / 'rebuilt.leads')
+
+    SimilarityBuilder(top_k=5, chunk_size=500, insert_size=100).build(path)
+
+    assert before['courses_similarities'] == [('courses_similarities_a_course_id', ('a_course_id',))]
+    assert {table: indexes(table) for table in before} == before
+    assert db.engine.execute('SELECT COUNT(*) FROM courses_similarities').scalar() == 200 * 5
+    assert LeadMatrix.open(path).number_of_users > 0
+
+
+def test_replaced_table_keeps_its_primary_key(builder_app):
+    db.engine.execute('''CREATE TABLE course_pairs (course TEXT NOT NULL, other TEXT NOT NULL, score REAL,
+                         PRIMARY KEY (course, other))''')
+    db.engine.execute('CREATE INDEX course_pairs_other ON course_pairs (other)')
+
+    SimilarityBuilder(insert_size=2).load_table('course_pairs', ('course', 'other', 'score'),
+                                                [('1', '2', 0.5), ('1', '3', 0.25), ('2', '3', 0.75)])
+
+    assert inspect(db.engine).get_pk_constraint('course_pairs')['constrained_columns'] == ['course', 'other']
+    assert indexes('course_pairs') == [('course_pairs_other', ('other',))]
+    assert db.engine.execute('SELECT COUNT(*) FROM course_pairs').scalar() == 3
+    assert db.engine.execute("SELECT name FROM sqlite_master WHERE name LIKE 'course_pairs_%'").fetchall() == \
+        [('course_pairs_other',)]
@@ -0,0 +1,74 @@
+import json
+import pytest
+from app import lead_matrix_index
+
+TOKEN = 'bulk-token'
+
+
+@pytest.fixture
+def client(make_app):
+    app = make_app(BULK_RECOMMENDATIONS_TOKEN=TOKEN, BULK_RECOMMENDATIONS_MAX_IDS=5, BULK_RECOMMENDATIONS_BATCH_SIZE=2)
+
+    with app.app_context():
+        yield app.test_client()
+
+
+def post(client, body, token: str = TOKEN):
+    headers = {'Authorization': 'Bearer {}'.format(token)} if token else {}
+
+    return client.post('/api/recommendations', json=body, headers=headers)
+
+
+def test_user_recommendations_are_streamed_in_order(client):
+    user_ids = lead_matrix_index.get().users([0, 1, 2]).tolist()
+    response = post(client, {'user_ids': user_ids + ['unknown-user'], 'max_recommendations': 3})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+
+    assert [line['user_id'] for line in lines] == user_ids + ['unknown-user']
+    assert all(len(line['recommendations']) <= 3 for line in lines)
+    assert lines[-1]['recommendations'] == []
+
+
+def test_course_identifiers_may_be_integers(client):
+    response = post(client, {'course_ids': [1, '2']})
+
+    assert response.status_code == 200
+    assert [json.loads(line)['course_id'] for line in response.data.decode().splitlines()] == ['1', '2']
+
+
+@pytest.mark.parametrize('body', [{'user_ids': []},
+                                  {'course_ids': []},
+                                  {},
+                                  {'user_ids': ['a'], 'course_ids': ['1']},
+                                  {'user_ids': ['a', None]},
+                                  {'user_ids': ['a', ['b']]},
+                                  {'course_ids': [1, {'id': 2}]},
+                                  {'course_ids': [True]},
+                                  {'user_ids': 'a'},
+                                  {'user_ids': ['a'], 'max_recommendations': 0},
+                                  {'user_ids': ['a'], 'max_recommendations': '10'},
+                                  ['a']])
+def test_invalid_bodies_are_rejected(client, body):
+    assert post(client, body).status_code == 400
+
+
+def test_oversized_bodies_are_rejected(client):
+    assert post(client, {'user_ids': [str(user) for user in range(6)]}).status_code == 413
+    assert post(client, {'course_ids': list(range(6))}).status_code == 413
+    assert post(client, {'course_ids': list(range(1, 6))}).status_code == 200
+
+
+def test_requests_without_a_valid_token_are_rejected(client):
+    assert post(client, {'course_ids': ['1']}, token=None).status_code == 401
+    assert post(client, {'course_ids': ['1']}, token='wrong').status_code == 401
+
+
+def test_api_is_disabled_without_a_token(make_app):
+    app = make_app(BULK_RECOMMENDATIONS_TOKEN=None)
+
+    with app.app_context():
+        assert post(app.test_client(), {'course_ids': ['1']}).status_code == 403
@@ -0,0 +1,58 @@
+import os
+import stat
+import pytest
+from app.cache import SharedCacheBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SharedCacheBackend(str(tmp_path / 'cache' / 'query-cache.sqlite'), max_entries=3)
+
+
+def accessed_on(backend, key: str) -> float:
+    return backend.connection().execute('SELECT accessed_on FROM cache WHERE key = ?', (key,)).fetchone()[0]
+
+
+def test_cache_file_is_only_accessible_by_its_user(backend):
+    assert stat.S_IMODE(os.stat(backend.path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(os.path.dirname(backend.path)).st_mode) == 0o700
+
+
+@pytest.mark.skipif(os.getuid() != 0, reason='Only root can give a file to another user')
+def test_cache_file_of_another_user_is_not_read(tmp_path):
+    path = str(tmp_path / 'query-cache.sqlite')
+    open(path, 'w').close()
+    os.chown(path, os.getuid() + 1, -1)
+
+    with pytest.raises(ValueError):
+        SharedCacheBackend(path)
+
+
+def test_hits_update_the_access_time_once_per_resolution(backend, monkeypatch):
+    backend.set('key', {'value': 1}, ttl=60)
+    first_access = accessed_on(backend, 'key')
+
+    assert backend.get('key') == {'value': 1}
+    assert accessed_on(backend, 'key') == first_access
+
+    monkeypatch.setattr('time.time', lambda: first_access + SharedCacheBackend.ACCESS_RESOLUTION + 1)
+
+    assert backend.get('key') == {'value': 1}
+    assert accessed_on(backend, 'key') == first_access + SharedCacheBackend.ACCESS_RESOLUTION + 1
+
+
+def test_least_recently_used_entries_are_evicted(backend, monkeypatch):
+    now = 1000000.0
+    monkeypatch.setattr('time.time', lambda: now)
+
+    for key in ('a', 'b', 'c'):
+        backend.set(key, key, ttl=3600)
+        now += 1
+
+    now += SharedCacheBackend.ACCESS_RESOLUTION + 1
+    assert backend.get('a') == 'a'
+
+    backend.set('d', 'd', ttl=3600)
+
+    assert backend.get('b') is None
+    assert [backend.get(key) for key in ('a', 'c', 'd')] == ['a', 'c', 'd']
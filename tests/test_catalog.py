@@ -0,0 +1,54 @@
+import pytest
+from app.catalog import CatalogIndex, CatalogSnapshot, SnapshotCourseRepository
+from app.models import Category, Course, CourseRepository, Paginator
+
+COURSES_PER_PAGE = 20
+
+
+def walk_pages(make_repository, sort_by: str, category: int = None, keyset: bool = False):
+    """Walks every page of a ranked list, skipping rows with an offset or seeking past the last course of the
+        previous page"""
+    pages = []
+    page = 1
+
+    while True:
+        paginator = Paginator(page, items_per_page=COURSES_PER_PAGE)
+        after = pages[-1][-1] if keyset and pages else None
+        courses = getattr(make_repository(paginator), 'find_sorted_by_' + sort_by)(category, after=after)
+        pages.append(list(courses.keys()))
+
+        if page >= paginator.page_count or len(courses) == 0:
+            return pages
+
+        page += 1
+
+
+@pytest.mark.parametrize('sort_by', ['leads', 'rating'])
+@pytest.mark.parametrize('category', [None, 2])
+def test_snapshot_pages_match_database_pages(app, sort_by, category):
+    snapshot = CatalogIndex.load()
+
+    def snapshot_repository(paginator):
+        return SnapshotCourseRepository(snapshot, paginator)
+
+    database = walk_pages(CourseRepository, sort_by, category)
+
+    assert len(database) > 1
+    assert walk_pages(snapshot_repository, sort_by, category) == database
+    assert walk_pages(snapshot_repository, sort_by, category, keyset=True) == database
+
+
+def test_numeric_ids_are_ranked_as_numbers():
+    courses = {}
+    for course_id in (9, 10, 11, 100):
+        course = Course(course_id, 'Course {}'.format(course_id), Category(1, 'Languages'), 'Center')
+        course.set_number_of_leads(3)
+        course.set_number_of_reviews(1)
+        course.set_weighted_rating(4.5)
+        courses[course_id] = course
+
+    snapshot = CatalogSnapshot(courses)
+
+    assert list(snapshot.find_sorted('leads')) == [100, 11, 10, 9]
+    assert list(snapshot.find_sorted('rating', after='11')) == [10, 9]
+    assert list(snapshot.find_sorted('leads', max_rows=2, exclude='100')) == [11, 10]
@@ -0,0 +1,64 @@
+import shutil
+import pytest
+from app import db
+from app.models import CategoryRepository, CourseRepository, Lead, LeadRepository
+
+
+@pytest.fixture
+def stats_app(make_app, dataset, tmp_path):
+    """Application reading the category stats, over a copy of the dataset database since leads are inserted"""
+    path = str(tmp_path / 'stats.sqlite')
+    shutil.copy(dataset.database_file, path)
+
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(path), CATEGORY_STATS_ENABLED=True)
+
+    with app.app_context():
+        CategoryRepository().create_stats_table()
+        CategoryRepository().rebuild_stats()
+        yield app
+
+
+def aggregates(app, stats_enabled: bool):
+    """Number of leads and weighted rating of the popular categories, from the stats or from the courses"""
+    app.config['CATEGORY_STATS_ENABLED'] = stats_enabled
+    try:
+        return {category.id: (category.number_of_leads, pytest.approx(category.weighted_rating))
+                for category in CategoryRepository().find_popular(min_weighted_rating=0).values()}
+    finally:
+        app.config['CATEGORY_STATS_ENABLED'] = True
+
+
+def course_leads(course_id: str) -> int:
+    return db.engine.execute("SELECT number_of_leads FROM courses WHERE id = :id", id=course_id).scalar()
+
+
+def test_saved_leads_survive_a_rebuild_until_they_are_reset(stats_app):
+    course = CourseRepository().find('5')
+    before = CategoryRepository().find(course.category_id).number_of_leads
+    assert aggregates(stats_app, True) == aggregates(stats_app, False)
+
+    LeadRepository().save(Lead('stats-user', course))
+    LeadRepository().save_many([Lead('stats-user-{}'.format(index), course).to_record() for index in range(2)])
+
+    assert CategoryRepository().find(course.category_id).number_of_leads == before + 3
+
+    CategoryRepository().rebuild_stats()
+
+    assert CategoryRepository().find(course.category_id).number_of_leads == before + 3
+    assert course_leads('5') == course.number_of_leads
+
+    CategoryRepository().rebuild_stats(reset_live_leads=True)
+
+    assert CategoryRepository().find(course.category_id).number_of_leads == before
+    assert aggregates(stats_app, True) == aggregates(stats_app, False)
+
+
+def test_saved_leads_leave_the_courses_unchanged_without_stats(stats_app):
+    stats_app.config['CATEGORY_STATS_ENABLED'] = False
+    course = CourseRepository().find('5')
+
+    LeadRepository().save(Lead('no-stats-user', course))
+
+    assert course_leads('5') == course.number_of_leads
+    assert db.engine.execute("SELECT COUNT(*) FROM leads WHERE user_id = 'no-stats-user'").scalar() == 1
+    assert db.engine.execute('SELECT SUM(live_leads) FROM category_stats').scalar() == 0
@@ -0,0 +1,56 @@
+import time
+import pytest
+from app.recommender import Recommender, StrategyDispatcher
+
+STRATEGIES = [('make_recommendations_by_leads', {'course_id': '3'}),
+              ('make_recommendations_by_content', {'course_id': '3'}),
+              ('make_rating_recommendations', {'category_id': 2, 'exclude_course_id': '3'}),
+              ('make_number_of_leads_recommendations', {'category_id': 2, 'exclude_course_id': '3'})]
+
+
+@pytest.fixture
+def dispatcher(app):
+    dispatcher = StrategyDispatcher(app)
+    dispatcher.concurrent = True
+    dispatcher.timeout = 0.5
+    yield dispatcher
+
+    dispatcher.executor.shutdown(wait=True)
+
+
+def sections(recommender: Recommender):
+    return {section: list(getattr(recommender, section)) for section in StrategyDispatcher.SECTIONS}
+
+
+def test_concurrent_strategies_fill_the_same_sections(dispatcher):
+    sequential = Recommender()
+    for method, params in STRATEGIES:
+        getattr(sequential, method)(**params)
+
+    concurrent = Recommender()
+    dispatcher.run(concurrent, STRATEGIES)
+
+    assert sections(concurrent) == sections(sequential)
+    assert all(len(sections(concurrent)[section]) > 0 for section in ('by_rating', 'by_number_of_leads'))
+
+
+def test_failed_and_slow_strategies_leave_their_sections_empty(dispatcher, monkeypatch):
+    make_rating_recommendations = Recommender.make_rating_recommendations
+
+    def failing_strategy(recommender, course_id):
+        raise RuntimeError('The similarities table is being rebuilt')
+
+    def slow_strategy(recommender, **params):
+        time.sleep(dispatcher.timeout * 3)
+        return make_rating_recommendations(recommender, **params)
+
+    monkeypatch.setattr(Recommender, 'make_recommendations_by_content', failing_strategy)
+    monkeypatch.setattr(Recommender, 'make_rating_recommendations', slow_strategy)
+
+    recommender = Recommender()
+    started_on = time.monotonic()
+    dispatcher.run(recommender, STRATEGIES)
+
+    assert time.monotonic() - started_on < dispatcher.timeout * 2
+    assert recommender.by_content == {} and recommender.by_rating == {}
+    assert len(recommender.by_leads) > 0 and len(recommender.by_number_of_leads) > 0
@@ -0,0 +1,80 @@
+import re
+import pytest
+from flask import current_app
+from app.instrumentation import RequestTimings
+
+# Metric of a Server-Timing header: an HTTP token followed by its parameters, and the separator of the next one
+SERVER_TIMING_METRIC = re.compile(r'''([!#$%&'*+\-.^_`|~0-9A-Za-z]+)(?:;dur=[0-9.]+)?(?:;desc="[^"]*")?(?:, |$)''')
+
+
+@pytest.fixture
+def client(make_app):
+    app = make_app(INSTRUMENTATION_ENABLED=True)
+
+    with app.app_context():
+        yield app.test_client()
+
+
+def server_timing_metrics(header: str):
+    """Names of the metrics of a Server-Timing header, checking that the whole header is well formed"""
+    names = []
+    position = 0
+
+    while position < len(header):
+        metric = SERVER_TIMING_METRIC.match(header, position)
+        assert metric is not None, header[position:]
+
+        names.append(metric.group(1))
+        position = metric.end()
+
+    return names
+
+
+def test_pages_have_a_server_timing_header(client):
+    response = client.get('/catalog')
+    names = server_timing_metrics(response.headers['Server-Timing'])
+
+    assert response.status_code == 200
+    assert names[0] == 'db' and names[-1] == 'total'
+    assert 'RetrieveCourseCatalog.execute' in names
+    assert 'template.course-catalog' in names
+
+
+def test_included_and_extended_templates_are_timed(client):
+    names = server_timing_metrics(client.get('/catalog').headers['Server-Timing'])
+    metrics = client.get('/metrics').data.decode()
+
+    for section in ('template.course-catalog', 'template.base', 'template.navbar', 'template.main.course-meta'):
+        assert section in names
+        assert 'recommendations_section_duration_seconds_count{{section="{}"}}'.format(section) in metrics
+
+
+def test_section_names_are_http_tokens():
+    timings = RequestTimings('main.catalog')
+    timings.add('template.main/course-list.html', 0.002)
+    timings.add('template.main/course-list.html', 0.001)
+    timings.add('outer.<locals>.inner', 0.001)
+
+    assert server_timing_metrics(timings.server_timing()) == ['db', 'template.main.course-list.html',
+                                                               'outer..locals..inner', 'total']
+
+
+def test_templates_in_folders_are_timed_as_dotted_sections(client):
+    template = current_app.jinja_env.get_template('main/course-list.html')
+
+    assert template.section == 'template.main.course-list'
+
+
+def test_metrics_are_exposed_in_the_prometheus_format(client):
+    client.get('/catalog')
+    client.get('/catalog')
+    response = client.get('/metrics')
+    body = response.data.decode()
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE recommendations_request_duration_seconds histogram' in body
+    assert 'recommendations_request_duration_seconds_count{endpoint="main.catalog"} 2' in body
+    assert 'recommendations_request_duration_seconds_bucket{endpoint="main.catalog",le="+Inf"} 2' in body
+    assert 'recommendations_section_duration_seconds_count{section="template.course-catalog"} 2' in body
+    assert re.search(r'^recommendations_hydrated_rows_total [1-9]', body, re.MULTILINE)
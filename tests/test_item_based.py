@@ -0,0 +1,58 @@
+import numpy as np
+from app import lead_matrix_index
+from app.models import CourseRepository
+from app.recommender import Recommender, find_similar_courses
+
+
+def cosine_similarities(lead_matrix):
+    """Dense cosine similarities between the columns of the lead matrix, without the similarity of each course with
+        itself"""
+    courses = lead_matrix.matrix.T.toarray().astype(np.float64)
+    norms = np.linalg.norm(courses, axis=1)
+    norms[norms == 0] = 1
+    similarities = courses.dot(courses.T) / np.outer(norms, norms)
+    np.fill_diagonal(similarities, 0)
+
+    return similarities
+
+
+def test_course_neighbours_are_the_most_similar_courses(app):
+    lead_matrix = lead_matrix_index.get()
+    similarities = cosine_similarities(lead_matrix)
+    neighbours = lead_matrix.item_neighbours(k=5)
+
+    for column in range(0, len(lead_matrix.course_ids), 20):
+        row = neighbours[column]
+        expected = np.sort(similarities[column])[::-1][:5]
+
+        assert row.nnz <= 5
+        np.testing.assert_allclose(np.sort(row.data)[::-1], expected[expected > 0], rtol=1e-5)
+        np.testing.assert_allclose(row.data, similarities[column, row.indices], rtol=1e-5)
+
+
+def test_similar_courses_add_up_the_neighbours_of_the_set(app):
+    lead_matrix = lead_matrix_index.get()
+    course_ids = list(lead_matrix.course_ids[[3, 40, 41]])
+    columns = lead_matrix.columns_of(course_ids)
+    scores = cosine_similarities(lead_matrix)[columns].sum(axis=0)
+    scores[columns] = 0
+    ranked = [column for column in np.lexsort((np.arange(len(scores)), -scores)) if scores[column] > 0]
+
+    found = find_similar_courses(course_ids, max_courses=10, k=len(lead_matrix.course_ids))
+
+    assert found.tolist() == lead_matrix.course_ids[ranked[:10]].tolist()
+    assert not set(course_ids) & set(found)
+
+
+def test_item_based_recommendations_skip_the_courses_of_the_user(make_app):
+    app = make_app(COLLABORATIVE_FILTERING='item', ITEM_NEIGHBOURS=10)
+
+    with app.app_context():
+        user_id = lead_matrix_index.get().users([11])[0]
+        user_course_ids = list(CourseRepository().find_requested_by_user(user_id))
+
+        recommender = Recommender().make_recommendations_for_user(user_id, max_recommendations=8)
+
+        assert list(recommender.by_user) == find_similar_courses(user_course_ids, max_courses=8, k=10).tolist()
+        assert len(recommender.by_user) == 8
+        assert not set(user_course_ids) & set(recommender.by_user)
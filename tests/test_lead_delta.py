@@ -0,0 +1,163 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+import pytest
+from app import lead_matrix_index
+from app.lead_delta import LeadOverlay, lead_delta
+from app.lead_matrix import LeadMatrix, lead_matrix_lock
+from app.recommender import find_similar_users
+
+
+@pytest.fixture
+def delta_app(make_app, dataset, tmp_path):
+    path = str(tmp_path / 'delta.leads')
+    shutil.copy(dataset.lead_matrix_file, path)
+
+    app = make_app(LEAD_MATRIX_FILE=path, LEAD_DELTA_ENABLED=True, LEAD_DELTA_COMPACT_INTERVAL=3600,
+                   LEAD_DELTA_COMPACT_SIZE=10 ** 6)
+
+    with app.app_context():
+        yield app
+
+    if lead_delta._file is not None:
+        os.close(lead_delta._file)
+
+    lead_delta._file = None
+    lead_delta._pairs = []
+    lead_delta._compacted = []
+    lead_delta._courses = {}
+
+
+@pytest.fixture
+def pairs(dataset):
+    """New leads of existing users, some of them already in the matrix, and of new users"""
+    lead_matrix = LeadMatrix.open(dataset.lead_matrix_file)
+    random = np.random.RandomState(1)
+    user_ids = lead_matrix.users(random.randint(0, lead_matrix.number_of_users, size=40)).tolist()
+    user_ids += ['new-user-{}'.format(index % 5) for index in range(15)]
+    course_ids = lead_matrix.course_ids[random.randint(0, len(lead_matrix.course_ids), size=len(user_ids))]
+
+    return list(zip(user_ids, course_ids.tolist()))
+
+
+def test_overlay_matches_rebuilt_matrix(dataset, pairs):
+    base = LeadMatrix.open(dataset.lead_matrix_file)
+    overlay = LeadOverlay(base, pairs)
+    user_ids, course_ids = zip(*pairs)
+    rebuilt = base.with_leads(list(user_ids), list(course_ids))
+
+    assert overlay.number_of_users == rebuilt.number_of_users
+
+    for user_id in set(user_ids):
+        overlay_vector = overlay.vector(overlay.row_of(user_id))
+        rebuilt_vector = rebuilt.vector(rebuilt.row_of(user_id))
+        assert sorted(overlay_vector.indices) == sorted(rebuilt_vector.indices)
+
+        overlay_similarities = overlay.similarities(overlay_vector, np.arange(overlay.number_of_users))
+        rebuilt_similarities = rebuilt.similarities(rebuilt_vector, np.arange(rebuilt.number_of_users))
+        assert sorted(zip(overlay.users(), overlay_similarities)) == sorted(zip(rebuilt.users(), rebuilt_similarities))
+
+
+def test_similar_users_are_the_same_before_and_after_the_compaction(delta_app, pairs):
+    lead_delta.add(pairs)
+    user_ids = sorted(set(user_id for (user_id, _) in pairs))
+    before = {user_id: find_similar_users(user_id).tolist() for user_id in user_ids}
+
+    lead_delta.compact()
+
+    assert os.path.getsize(lead_delta.path) == 0
+    assert lead_matrix_index.get().row_of('new-user-0') is not None
+
+    after = {user_id: find_similar_users(user_id).tolist() for user_id in user_ids}
+
+    assert lead_delta._pairs == lead_delta._compacted == []
+
+    # Rows are sorted by user identifier, so users with the same similarity may be listed in another order
+    for user_id in user_ids:
+        assert len(after[user_id]) == len(before[user_id]) > 0
+        assert set(after[user_id]) == set(before[user_id])
+
+
+def test_compaction_waits_for_the_lead_matrix_lock(delta_app, pairs):
+    path = delta_app.config['LEAD_MATRIX_FILE']
+    lead_delta.add(pairs)
+
+    with lead_matrix_lock(path):
+        compaction = threading.Thread(target=lead_delta.compact)
+        compaction.start()
+        compaction.join(0.5)
+
+        assert compaction.is_alive()
+
+        # A file written by another process while the compaction waits is the one the leads are merged into
+        rebuilt = LeadMatrix.open(path).with_leads(['locked-user'], [pairs[0][1]])
+        rebuilt.save(path)
+
+    compaction.join()
+    compacted = LeadMatrix.open(path)
+
+    assert compacted.row_of('locked-user') is not None
+    assert all(compacted.row_of(user_id) is not None for (user_id, _) in pairs)
+
+
+def test_leads_saved_by_another_worker_are_laid_over_the_matrix(delta_app, pairs):
+    with open(lead_delta.path, 'a') as delta_file:
+        delta_file.write(''.join(json.dumps(pair) + '\n' for pair in pairs))
+        # A lead still being written is not read
+        delta_file.write('["new-user-9", ')
+
+    assert lead_delta.courses_of('new-user-0') == [course_id for (user_id, course_id) in pairs
+                                                   if user_id == 'new-user-0']
+    assert lead_delta.courses_of('new-user-9') == []
+    assert len(find_similar_users('new-user-0')) > 0
+
+
+def test_delta_file_is_kept_when_the_lead_matrix_cannot_be_saved(delta_app, pairs, monkeypatch):
+    lead_delta.add(pairs)
+    size = os.path.getsize(lead_delta.path)
+
+    def fail(*args):
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(LeadMatrix, 'save', fail)
+
+    with pytest.raises(OSError):
+        lead_delta.compact()
+
+    assert os.path.getsize(lead_delta.path) == size
+    assert len(lead_delta.courses_of('new-user-0')) > 0
+
+
+def test_leads_saved_during_the_compaction_are_kept(delta_app, pairs, monkeypatch):
+    lead_delta.add(pairs)
+    save = LeadMatrix.save
+
+    def save_while_a_lead_is_saved(lead_matrix, path):
+        lead_delta.add([('late-user', pairs[0][1])])
+        save(lead_matrix, path)
+
+    monkeypatch.setattr(LeadMatrix, 'save', save_while_a_lead_is_saved)
+    lead_delta.compact()
+
+    with open(lead_delta.path) as delta_file:
+        assert [json.loads(line) for line in delta_file] == [['late-user', pairs[0][1]]]
+
+    assert lead_matrix_index.get().row_of('late-user') is None
+    assert lead_delta.courses_of('late-user') == [pairs[0][1]]
+
+
+def test_compacted_leads_are_kept_until_the_new_matrix_is_used(delta_app, pairs):
+    lead_matrix = lead_matrix_index.get()
+    lead_delta.add(pairs)
+    lead_delta.compact()
+
+    assert lead_delta.overlay(lead_matrix).row_of('new-user-0') is not None
+    assert len(lead_delta.courses_of('new-user-0')) > 0
+
+    compacted = lead_matrix_index.get()
+
+    assert compacted is not lead_matrix
+    assert lead_delta.overlay(compacted) is compacted
+    assert lead_delta.courses_of('new-user-0') == []
@@ -0,0 +1,80 @@
+import os
+import pickle
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from app.lead_matrix import LeadMatrix, LeadMatrixIndex
+
+
+@pytest.fixture
+def lead_matrix(dataset):
+    return LeadMatrix.open(dataset.lead_matrix_file)
+
+
+@pytest.fixture
+def legacy_file(lead_matrix, tmp_path):
+    """Pickled dictionary of sparse rows, as written by previous versions"""
+    path = str(tmp_path / 'user_requested_courses_map.pickle')
+    user_map = {user_id: lead_matrix.matrix[row] for (row, user_id) in enumerate(lead_matrix.users())}
+
+    with open(path, 'wb') as legacy:
+        pickle.dump(user_map, legacy)
+
+    return path
+
+
+def test_legacy_file_is_read_until_the_lead_matrix_file_is_written(lead_matrix, legacy_file, tmp_path):
+    path = str(tmp_path / 'user_requested_courses.leads')
+    index = LeadMatrixIndex(path=path, legacy_path=legacy_file)
+
+    legacy = index.get()
+
+    assert index.source()[0] == legacy_file
+    assert legacy.number_of_users == lead_matrix.number_of_users
+    assert (legacy.matrix != lead_matrix.matrix).nnz == 0
+    assert len(legacy.course_ids) == 0
+
+    lead_matrix.save(path)
+    converted = index.get()
+
+    assert converted is not legacy
+    assert index.source()[0] == path
+    assert list(converted.course_ids) == list(lead_matrix.course_ids)
+
+
+def test_missing_lead_matrix_file_without_legacy_file_fails(tmp_path):
+    index = LeadMatrixIndex(path=str(tmp_path / 'missing.leads'))
+
+    with pytest.raises(FileNotFoundError):
+        index.get()
+
+
+def test_lead_matrix_is_loaded_once_per_process(dataset, monkeypatch):
+    loaded = []
+    load = LeadMatrixIndex.load
+
+    def counted_load(path):
+        loaded.append(path)
+        return load(path)
+
+    monkeypatch.setattr(LeadMatrixIndex, 'load', staticmethod(counted_load))
+    index = LeadMatrixIndex(path=dataset.lead_matrix_file)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        matrices = list(executor.map(lambda _: index.get(), range(32)))
+
+    assert loaded == [dataset.lead_matrix_file]
+    assert all(matrix is matrices[0] for matrix in matrices)
+
+
+def test_rewritten_lead_matrix_file_is_reloaded(lead_matrix, tmp_path):
+    path = str(tmp_path / 'user_requested_courses.leads')
+    lead_matrix.save(path)
+    index = LeadMatrixIndex(path=path)
+
+    first = index.get()
+    lead_matrix.save(path)
+    modified_on = os.path.getmtime(path) + 10
+    os.utime(path, (modified_on, modified_on))
+
+    assert index.get() is not first
+    assert index.get() is index.get()
@@ -0,0 +1,214 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import subprocess
+import threading
+import pytest
+from app import db
+from app.lead_writer import lead_writer
+from app.models import CourseRepository, Lead
+
+CRASHING_WORKER = '''
+import os
+from config import Config
+from app import create_app
+from app.lead_writer import lead_writer
+from app.models import CourseRepository, Lead
+
+settings = {{'SQLALCHEMY_DATABASE_URI': 'sqlite:///{database}', 'LEAD_MATRIX_FILE': '{lead_matrix}',
+             'LEAD_WRITER_ENABLED': True, 'LEAD_WRITER_BATCH_SIZE': 1000, 'LEAD_WRITER_FLUSH_INTERVAL': 3600,
+             'LEAD_WRITER_SPOOL_DIR': '{spool_dir}'}}
+app = create_app(type('CrashConfig', (Config,), settings))
+
+with app.app_context():
+    course = CourseRepository().find('3')
+    for index in range(5):
+        lead_writer.write(Lead('crashed-user-{{}}'.format(index), course))
+
+os._exit(1)
+'''
+
+
+@pytest.fixture
+def database(dataset, tmp_path):
+    """Copy of the dataset database, since leads are inserted"""
+    path = str(tmp_path / 'leads.sqlite')
+    shutil.copy(dataset.database_file, path)
+
+    return path
+
+
+@pytest.fixture
+def writer_app(make_app, database, tmp_path):
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(database), LEAD_WRITER_ENABLED=True,
+                   LEAD_WRITER_BATCH_SIZE=3, LEAD_WRITER_FLUSH_INTERVAL=3600,
+                   LEAD_WRITER_SPOOL_DIR=str(tmp_path / 'spool'))
+
+    with app.app_context():
+        yield app
+
+    lead_writer._pid = None
+    lead_writer._buffer = []
+    lead_writer._pending = []
+    lead_writer._spool = None
+
+
+def saved_users(prefix: str):
+    return sorted(row[0] for row in db.engine.execute("SELECT user_id FROM leads WHERE user_id LIKE '{}%'"
+                                                      .format(prefix)))
+
+
+def spool_files(app):
+    return glob.glob(os.path.join(app.config['LEAD_WRITER_SPOOL_DIR'], 'leads-*.spool'))
+
+
+def test_spools_of_crashed_workers_are_recovered(writer_app, dataset, database):
+    script = CRASHING_WORKER.format(database=database, lead_matrix=dataset.lead_matrix_file,
+                                    spool_dir=writer_app.config['LEAD_WRITER_SPOOL_DIR'])
+    worker = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.dirname(__file__)))
+
+    assert worker.returncode == 1
+    assert len(spool_files(writer_app)) == 1
+    assert saved_users('crashed-user') == []
+
+    lead_writer.flush()
+
+    assert saved_users('crashed-user') == ['crashed-user-{}'.format(index) for index in range(5)]
+    assert spool_files(writer_app) == []
+
+
+def test_spool_with_the_pid_of_a_running_process_is_recovered(writer_app):
+    course = CourseRepository().find('3')
+    path = os.path.join(writer_app.config['LEAD_WRITER_SPOOL_DIR'], 'leads-{}.spool'.format(os.getpid()))
+
+    with open(path, 'w') as spool:
+        spool.write(json.dumps(Lead('reused-pid-user', course).to_record()) + '\n')
+        # Last line of a worker stopped while writing
+        spool.write('{"user_id": "reused-pid')
+
+    lead_writer.write(Lead('current-user', course))
+    lead_writer.flush()
+
+    assert saved_users('reused-pid') == ['reused-pid-user']
+    assert saved_users('current-user') == ['current-user']
+    assert spool_files(writer_app) == [lead_writer.spool_file]
+
+
+def test_failed_flushes_do_not_fail_writes_and_are_retried(writer_app, monkeypatch):
+    course = CourseRepository().find('3')
+    save_many = lead_writer.lead_repository.save_many
+
+    def failing_save_many(records):
+        raise RuntimeError('The database is not available')
+
+    monkeypatch.setattr(lead_writer.lead_repository, 'save_many', failing_save_many)
+
+    for index in range(4):
+        lead_writer.write(Lead('retried-user-{}'.format(index), course))
+
+    assert saved_users('retried-user') == []
+
+    with pytest.raises(RuntimeError):
+        lead_writer.flush()
+
+    # Every lead is still spooled, in the spool of the failed batch or in the current one
+    spooled = [record['user_id'] for path in spool_files(writer_app) for record in lead_writer.read_spool(path)]
+    assert sorted(spooled) == ['retried-user-{}'.format(index) for index in range(4)]
+
+    monkeypatch.setattr(lead_writer.lead_repository, 'save_many', save_many)
+    lead_writer.flush()
+
+    assert saved_users('retried-user') == ['retried-user-{}'.format(index) for index in range(4)]
+    assert spool_files(writer_app) == [lead_writer.spool_file]
+    assert lead_writer.read_spool(lead_writer.spool_file) == []
+
+
+def test_full_buffers_are_inserted_by_the_flusher_thread(writer_app, monkeypatch):
+    course = CourseRepository().find('3')
+    save_many = lead_writer.lead_repository.save_many
+    inserted = threading.Event()
+    threads = []
+
+    def recorded_save_many(records):
+        threads.append(threading.current_thread().name)
+        save_many(records)
+        inserted.set()
+
+    monkeypatch.setattr(lead_writer.lead_repository, 'save_many', recorded_save_many)
+
+    for index in range(3):
+        lead_writer.write(Lead('woken-user-{}'.format(index), course))
+
+    assert inserted.wait(5)
+    assert threads == ['lead-writer']
+    assert saved_users('woken-user') == ['woken-user-{}'.format(index) for index in range(3)]
+
+
+def test_batches_that_keep_failing_are_quarantined(writer_app, monkeypatch):
+    course = CourseRepository().find('3')
+    save_many = lead_writer.lead_repository.save_many
+
+    def save_many_without_poisoned_leads(records):
+        if any(record['user_id'].startswith('poisoned') for record in records):
+            raise ValueError('Invalid lead')
+        save_many(records)
+
+    monkeypatch.setattr(lead_writer.lead_repository, 'save_many', save_many_without_poisoned_leads)
+    monkeypatch.setattr(lead_writer, 'batch_size', 100)
+    monkeypatch.setattr(lead_writer, 'max_attempts', 2)
+
+    lead_writer.write(Lead('poisoned-user', course))
+    with pytest.raises(ValueError):
+        lead_writer.flush()
+
+    lead_writer.write(Lead('later-user', course))
+    lead_writer.flush()
+
+    quarantined = glob.glob(os.path.join(writer_app.config['LEAD_WRITER_SPOOL_DIR'], 'leads-*.failed'))
+    assert saved_users('later-user') == ['later-user']
+    assert saved_users('poisoned') == []
+    assert [record['user_id'] for record in lead_writer.read_spool(quarantined[0])] == ['poisoned-user']
+    assert spool_files(writer_app) == [lead_writer.spool_file]
+
+
+def test_leads_are_synced_without_holding_the_lock(writer_app, monkeypatch):
+    course = CourseRepository().find('3')
+    fsync = os.fsync
+    syncing = threading.Event()
+    synced = threading.Event()
+
+    def slow_fsync(descriptor):
+        if threading.current_thread().name == 'slow-disk':
+            syncing.set()
+            synced.wait()
+
+        fsync(descriptor)
+
+    monkeypatch.setattr('app.lead_writer.os.fsync', slow_fsync)
+    slow_write = threading.Thread(target=lead_writer.write, args=(Lead('synced-user-0', course),), name='slow-disk',
+                                  daemon=True)
+    slow_write.start()
+    syncing.wait()
+
+    # Other requests are not blocked by the slow write
+    fast_write = threading.Thread(target=lead_writer.write, args=(Lead('synced-user-1', course),), daemon=True)
+    fast_write.start()
+    fast_write.join(5)
+
+    assert not fast_write.is_alive()
+
+    # The spool file of the batch is not persisted until the slow write is synced
+    flush = threading.Thread(target=lead_writer.flush)
+    flush.start()
+    flush.join(0.5)
+
+    assert flush.is_alive()
+
+    synced.set()
+    slow_write.join()
+    flush.join()
+
+    assert saved_users('synced-user') == ['synced-user-0', 'synced-user-1']
+    assert spool_files(writer_app) == [lead_writer.spool_file]
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from app import lead_matrix_index
+from app.lsh import MinHashLSHIndex
+from app.recommender import find_similar_users
+
+
+def leads_of(*users):
+    """Lead matrix of a few users over twenty courses, from the columns of the courses of each user"""
+    rows = [row for (row, courses) in enumerate(users) for _ in courses]
+    columns = [column for courses in users for column in courses]
+
+    return sparse.csr_matrix((np.ones(len(columns)), (rows, columns)), shape=(len(users), 20))
+
+
+def test_users_with_overlapping_courses_are_candidates():
+    index = MinHashLSHIndex(leads_of([1, 2, 3], [1, 2, 3], [1, 2, 3, 4], [10, 11, 12], []))
+
+    assert index.candidates(0).tolist() == [0, 1, 2]
+    assert index.candidates(3).tolist() == [3]
+    assert (index.signatures[4] == MinHashLSHIndex.PRIME).all()
+
+
+def test_hashes_are_split_in_whole_bands():
+    with pytest.raises(ValueError):
+        MinHashLSHIndex(leads_of([1, 2]), num_hashes=64, bands=10)
+
+
+def test_approximate_neighbours_are_exact_neighbours(make_app):
+    app = make_app(NEIGHBOUR_SEARCH='lsh', LSH_NUM_HASHES=32, LSH_BANDS=16, LSH_MIN_LEADS=3)
+
+    with app.app_context():
+        lead_matrix = lead_matrix_index.get()
+        found = 0
+
+        for user_id in lead_matrix.users(np.arange(0, lead_matrix.number_of_users, 100)):
+            exact = find_similar_users(user_id, min_similarity=2).tolist()
+            approximate = find_similar_users(user_id, min_similarity=2, approximate=True).tolist()
+
+            assert set(approximate) <= set(exact)
+            assert approximate == [user for user in exact if user in approximate]
+            found += len(approximate)
+
+        assert found > 0
@@ -0,0 +1,31 @@
+import pytest
+from app.models import Category, Course, CourseRepository, Lead
+
+
+@pytest.mark.parametrize('entity', [Category(1, 'Languages'),
+                                    Course('1', 'Spanish', Category(1, 'Languages'), 'Center'),
+                                    Lead('user', Course('1', 'Spanish', Category(1, 'Languages'), 'Center'))])
+def test_entities_have_no_attribute_dictionary(entity):
+    assert not hasattr(entity, '__dict__')
+
+    with pytest.raises(AttributeError):
+        entity.unknown_attribute = True
+
+
+def test_deferred_descriptions_are_read_once_on_access(app, monkeypatch):
+    described = CourseRepository().find_all()
+    deferred = CourseRepository().find_all(with_description=False)
+    lookups = []
+    find_description = CourseRepository.find_description
+
+    def counted_find_description(repository, course_id):
+        lookups.append(course_id)
+        return find_description(repository, course_id)
+
+    monkeypatch.setattr(CourseRepository, 'find_description', counted_find_description)
+    course = deferred['3']
+
+    assert course.description == described['3'].description is not None
+    assert course.description == described['3'].description
+    assert lookups == ['3']
+    assert described['4'].description is not None and lookups == ['3']
@@ -0,0 +1,112 @@
+import atexit
+import numpy as np
+import pytest
+from app import lead_matrix_index
+from app.lead_matrix import LeadMatrix
+from app.neighbour_search import score_shard, sharded_search
+from app.recommender import find_similar_users
+
+
+@pytest.fixture
+def sharded_app(make_app):
+    app = make_app(NEIGHBOUR_SEARCH_PROCESSES=2, NEIGHBOUR_SEARCH_MIN_USERS=0)
+
+    with app.app_context():
+        yield app
+
+    if sharded_search._executor is not None:
+        sharded_search._executor.shutdown()
+        sharded_search._executor = None
+
+
+def in_process_similar_users(user_id: str):
+    """Similar users found without the process pool"""
+    processes, sharded_search.processes = sharded_search.processes, 0
+    try:
+        return find_similar_users(user_id, max_neighbours=20).tolist()
+    finally:
+        sharded_search.processes = processes
+
+
+def test_sharded_search_matches_in_process_search(sharded_app):
+    lead_matrix = lead_matrix_index.get()
+
+    assert sharded_search.applies(lead_matrix)
+
+    for user_id in lead_matrix.users(np.arange(0, lead_matrix.number_of_users, 500)):
+        assert find_similar_users(user_id, max_neighbours=20).tolist() == in_process_similar_users(user_id)
+
+
+def test_broken_pool_is_replaced(sharded_app):
+    user_id = lead_matrix_index.get().users([7])[0]
+    expected = in_process_similar_users(user_id)
+
+    assert find_similar_users(user_id, max_neighbours=20).tolist() == expected
+
+    broken = sharded_search.executor
+    for process in list(broken._processes.values()):
+        process.kill()
+        process.join()
+
+    # The search falls back to the requesting process, and the next one uses a new pool
+    assert find_similar_users(user_id, max_neighbours=20).tolist() == expected
+    assert sharded_search.executor is not broken
+    assert find_similar_users(user_id, max_neighbours=20).tolist() == expected
+    assert sharded_search.executor is not broken
+
+
+def test_slow_pool_falls_back_to_the_requesting_process(sharded_app, monkeypatch):
+    user_id = lead_matrix_index.get().users([7])[0]
+    expected = in_process_similar_users(user_id)
+
+    assert find_similar_users(user_id, max_neighbours=20).tolist() == expected
+
+    stuck = sharded_search.executor
+    processes = list(stuck._processes.values())
+    monkeypatch.setattr(sharded_search, 'timeout', 0)
+
+    # The search does not wait for the pool, and its processes are terminated
+    assert len(processes) > 0
+    assert find_similar_users(user_id, max_neighbours=20).tolist() == expected
+    assert sharded_search.executor is not stuck
+
+    for process in processes:
+        process.join(5)
+        assert not process.is_alive()
+
+
+def test_replaced_pools_do_not_register_exit_handlers(sharded_app, monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, 'register', lambda *args, **kwargs: registered.append(args))
+
+    for _ in range(3):
+        sharded_search.reset(sharded_search.executor)
+
+    assert registered == []
+
+
+def test_shards_are_reloaded_when_the_file_changes(dataset, tmp_path):
+    path = str(tmp_path / 'shard.leads')
+    lead_matrix = LeadMatrix.open(dataset.lead_matrix_file)
+    lead_matrix.save(path)
+    before = LeadMatrix.open(path)
+
+    columns = np.array([0, 1, 2])
+    rows, _ = score_shard(path, before.mtime, before.matrix.shape, 0, before.number_of_users, columns, 3, None, -1)
+
+    # The same users, with a new lead of each of the courses, so the shape does not change
+    user_ids = lead_matrix.users([0, 0, 0]).tolist()
+    lead_matrix.with_leads(user_ids, lead_matrix.course_ids[columns].tolist()).save(path)
+    after = LeadMatrix.open(path)
+
+    assert after.matrix.shape == before.matrix.shape
+    assert after.mtime != before.mtime
+
+    changed_rows, _ = score_shard(path, after.mtime, after.matrix.shape, 0, after.number_of_users, columns, 3, None,
+                                  -1)
+
+    assert 0 not in rows
+    assert 0 in changed_rows
+
+    with pytest.raises(RuntimeError):
+        score_shard(path, before.mtime, before.matrix.shape, 0, before.number_of_users, columns, 3, None, -1)
@@ -0,0 +1,90 @@
+import shutil
+import pytest
+from sqlalchemy.sql import text
+from app import db
+from app.main.views import users, test_password
+from app.models import CourseRepository, Paginator
+from app.page_cache import PageCache, page_cache
+
+
+@pytest.fixture
+def client(make_app):
+    app = make_app(PAGE_CACHE_BACKEND='memory')
+
+    with app.app_context():
+        yield app.test_client()
+
+
+def login(client, user: str):
+    response = client.post('/login', data={'user': user, 'password': test_password})
+    assert response.status_code == 302
+
+
+def test_cached_page_is_revalidated_with_its_etag(client):
+    response = client.get('/catalog')
+
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    assert 'Cookie' in response.headers['Vary']
+    assert response.cache_control.public
+
+    revalidated = client.get('/catalog', headers={'If-None-Match': response.headers['ETag']})
+
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+
+    assert client.get('/catalog', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_user_pages_are_not_served_to_other_users(client, make_app):
+    anonymous = client.get('/')
+
+    login(client, users[0])
+    first_user = client.get('/')
+
+    assert first_user.status_code == 200
+    assert first_user.cache_control.private
+    assert 'Cookie' in first_user.headers['Vary']
+    assert first_user.headers['ETag'] != anonymous.headers['ETag']
+    assert 'User 1'.encode() in first_user.data
+
+    # The page of the anonymous user is not valid for the logged in user
+    assert client.get('/', headers={'If-None-Match': anonymous.headers['ETag']}).status_code == 200
+
+    client.get('/logout')
+    login(client, users[1])
+    second_user = client.get('/')
+
+    assert second_user.headers['ETag'] != first_user.headers['ETag']
+    assert 'User 1'.encode() not in second_user.data
+    assert 'User 2'.encode() in second_user.data
+
+    client.get('/logout')
+    anonymous_again = client.get('/')
+
+    assert anonymous_again.headers['ETag'] == anonymous.headers['ETag']
+    assert 'User'.encode() not in anonymous_again.data
+
+
+def test_fragments_are_rendered_again_when_another_worker_saves_a_lead(make_app, dataset, tmp_path):
+    path = str(tmp_path / 'fragments.sqlite')
+    shutil.copy(dataset.database_file, path)
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(path), PAGE_CACHE_BACKEND='memory')
+
+    with app.app_context():
+        client = app.test_client()
+        course_id = next(iter(CourseRepository(Paginator(1, 20)).find_sorted_by_leads()))
+        title = CourseRepository().find(course_id).title
+        assert title.encode() in client.get('/catalog').data
+
+        db.engine.execute(text('UPDATE courses SET title = :title WHERE id = :id'), title='Renamed course', id=course_id)
+
+        # Another page with the same courses reuses the cached fragment until another worker invalidates the caches
+        stale = client.get('/catalog?page=1').data
+        assert title.encode() in stale and b'Renamed course' not in stale
+
+        other_worker = PageCache()
+        other_worker.generation_path = page_cache.generation_path
+        other_worker.next_generation()
+
+        assert b'Renamed course' in client.get('/catalog?page=1').data
@@ -0,0 +1,94 @@
+import shutil
+import pytest
+from app import db
+from app.cache import query_cache
+from app.models import CourseRepository, Paginator
+
+COURSES_PER_PAGE = 20
+
+
+def offset_pages(make_repository, sort_by: str, category: int = None):
+    """Walks every page of a ranked list skipping rows with an offset"""
+    pages = []
+    page = 1
+
+    while True:
+        paginator = Paginator(page, items_per_page=COURSES_PER_PAGE)
+        courses = getattr(make_repository(paginator), 'find_sorted_by_' + sort_by)(category)
+        pages.append(list(courses.keys()))
+
+        if page >= paginator.page_count:
+            return pages, paginator.page_count
+
+        page += 1
+
+
+def keyset_pages(make_repository, sort_by: str, category: int = None):
+    """Walks every page of a ranked list seeking past the last course of the previous page"""
+    pages = []
+    page = 1
+    after = None
+
+    while True:
+        paginator = Paginator(page, items_per_page=COURSES_PER_PAGE)
+        courses = getattr(make_repository(paginator), 'find_sorted_by_' + sort_by)(category, after=after)
+        pages.append(list(courses.keys()))
+
+        if page >= paginator.page_count or len(courses) == 0:
+            return pages, paginator.page_count
+
+        after = pages[-1][-1]
+        page += 1
+
+
+@pytest.mark.parametrize('sort_by', ['leads', 'rating'])
+@pytest.mark.parametrize('category', [None, 2])
+def test_keyset_pages_match_offset_pages(app, sort_by, category):
+    offset, offset_page_count = offset_pages(CourseRepository, sort_by, category)
+    keyset, keyset_page_count = keyset_pages(CourseRepository, sort_by, category)
+
+    assert offset_page_count == keyset_page_count > 1
+    assert keyset == offset
+    assert all(len(page) == COURSES_PER_PAGE for page in offset[:-1])
+
+
+def test_unknown_keyset_course_returns_an_empty_page(app):
+    paginator = Paginator(2, items_per_page=COURSES_PER_PAGE)
+
+    assert CourseRepository(paginator).find_sorted_by_leads(after='unknown') == {}
+
+
+def test_row_counts_are_evicted_beyond_the_cache_size(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'QUERY_CACHE_MAX_ENTRIES', 2)
+    Paginator.count_cache().clear()
+
+    for category in (1, 2, 3):
+        CourseRepository(Paginator(1, items_per_page=COURSES_PER_PAGE)).find_sorted_by_leads(category)
+
+    keys = list(Paginator.count_cache()._entries)
+    assert len(keys) == 2
+    assert all("('category_id', 1)" not in key for key in keys)
+
+
+def test_row_counts_are_recounted_after_an_invalidation(make_app, dataset, tmp_path):
+    path = str(tmp_path / 'counts.sqlite')
+    shutil.copy(dataset.database_file, path)
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(path))
+
+    def row_count():
+        paginator = Paginator(1, items_per_page=COURSES_PER_PAGE)
+        CourseRepository(paginator).find_sorted_by_leads(2)
+        return paginator.row_count
+
+    with app.app_context():
+        before = row_count()
+        db.engine.execute('''INSERT INTO courses (id, title, description, category_id, center, number_of_leads,
+                             num_reviews, weighted_rating) SELECT 'new-course', title, description, category_id, center,
+                             number_of_leads, num_reviews, weighted_rating FROM courses
+                             WHERE category_id = 2 AND number_of_leads >= 1 AND weighted_rating >= 7 LIMIT 1''')
+
+        assert row_count() == before
+
+        query_cache.invalidate()
+
+        assert row_count() == before + 1
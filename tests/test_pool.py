@@ -0,0 +1,55 @@
+import atexit
+import runpy
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.cache import query_cache
+from app.instrumentation import instrumentation
+from app.pool import database_pool
+
+
+@pytest.fixture
+def statements():
+    """SQL statements run by every engine while the test runs"""
+    executed = []
+
+    def before_cursor_execute(connection, cursor, statement, *args):
+        executed.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    yield executed
+    event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_creating_the_application_does_not_warm_up_the_pool(make_app, statements):
+    make_app(DB_POOL_WARMUP=True)
+
+    assert statements == []
+
+
+def test_gunicorn_workers_warm_up_the_pool(make_app, statements):
+    make_app(DB_POOL_WARMUP=True)
+
+    runpy.run_path('gunicorn.conf.py')['post_worker_init'](None)
+
+    assert statements.count('SELECT 1') == 2
+    assert any('FROM courses' in statement for statement in statements)
+
+
+def test_extensions_are_registered_once(make_app, monkeypatch):
+    handlers = []
+    monkeypatch.setattr(atexit, 'register', handlers.append)
+
+    make_app(INSTRUMENTATION_ENABLED=True)
+    collectors = [type(collector) for collector in instrumentation.collectors]
+    hooks = list(query_cache._invalidation_hooks)
+
+    app = make_app(INSTRUMENTATION_ENABLED=True)
+    instrumentation.init_app(app)
+    database_pool.init_app(app)
+
+    assert [type(collector) for collector in instrumentation.collectors] == collectors
+    assert len(set(instrumentation.collectors)) == len(collectors)
+    assert query_cache._invalidation_hooks == hooks
+    assert handlers == []
+    assert len(app.before_request_funcs[None]) == len(set(app.before_request_funcs[None]))
@@ -0,0 +1,80 @@
+import os
+import atexit
+import signal
+import pytest
+from app.profiler import SamplingProfiler, sampling_profiler
+
+
+@pytest.fixture
+def profiled_app(make_app):
+    app = make_app(PROFILER_ENABLED=True, PROFILER_INTERVAL=0.001)
+
+    with app.app_context():
+        yield app
+
+    sampling_profiler.stop()
+    sampling_profiler.enabled = False
+    signal.signal(signal.SIGPROF, signal.SIG_IGN)
+    signal.signal(sampling_profiler.dump_signal, signal.SIG_DFL)
+
+
+def test_dump_signal_is_a_real_time_signal_by_default(profiled_app):
+    assert sampling_profiler.dump_signal == signal.SIGRTMIN + 1
+    assert SamplingProfiler.parse_signal('SIGUSR1') == signal.SIGUSR1
+
+
+def test_disabled_profiler_does_not_need_real_time_signals(make_app, monkeypatch):
+    monkeypatch.delattr(signal, 'SIGRTMIN')
+    monkeypatch.setattr(sampling_profiler, 'dump_signal', None)
+
+    app = make_app(PROFILER_ENABLED=False)
+
+    assert SamplingProfiler().dump_signal is None
+    assert sampling_profiler.dump_signal is None
+    assert app.test_client().get('/categories').status_code == 200
+
+
+def test_timer_is_stopped_at_exit_only_once_it_is_started(profiled_app, monkeypatch):
+    handlers = []
+    monkeypatch.setattr(atexit, 'register', handlers.append)
+    monkeypatch.setattr(sampling_profiler, '_stopped_at_exit', False)
+
+    SamplingProfiler()
+    assert handlers == []
+
+    client = profiled_app.test_client()
+    client.get('/categories')
+    sampling_profiler._pid = None
+    client.get('/categories')
+
+    assert handlers == [sampling_profiler.stop]
+
+
+def test_timer_starts_with_the_first_request(profiled_app):
+    assert sampling_profiler._pid is None
+    assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
+
+    assert profiled_app.test_client().get('/categories').status_code == 200
+
+    assert sampling_profiler._pid == os.getpid()
+    assert signal.getitimer(signal.ITIMER_PROF)[1] > 0
+
+
+def test_handlers_reset_by_the_server_are_installed_again(profiled_app, tmp_path):
+    # Forked workers of gunicorn reset the handlers of its signals
+    signal.signal(sampling_profiler.dump_signal, signal.SIG_DFL)
+    sampling_profiler._pid = None
+
+    client = profiled_app.test_client()
+    for _ in range(20):
+        client.get('/catalog')
+
+    assert signal.getsignal(sampling_profiler.dump_signal) == sampling_profiler.handle_dump
+
+    sampling_profiler._samples = {'catalog;render (app/main/views.py:1)': 3}
+    os.kill(os.getpid(), sampling_profiler.dump_signal)
+
+    dumps = os.listdir(profiled_app.config['PROFILER_OUTPUT_DIR'])
+    assert len(dumps) == 1
+    with open(os.path.join(profiled_app.config['PROFILER_OUTPUT_DIR'], dumps[0])) as dump:
+        assert dump.read() == 'catalog;render (app/main/views.py:1) 3\n'
@@ -0,0 +1,85 @@
+import numpy as np
+from app import lead_matrix_index
+from app.models import CourseRepository
+from app.recommender import Recommender, find_similar_users
+
+
+def brute_force_similar_users(lead_matrix, user_id: str, min_similarity: int = 1):
+    """Similar users computed one user at a time, sorted by descending similarity and matrix order"""
+    user_courses = set(lead_matrix.matrix[lead_matrix.row_of(user_id)].indices)
+    similar_users = []
+
+    for row, other_user_id in enumerate(lead_matrix.users()):
+        similarity = len(user_courses & set(lead_matrix.matrix[row].indices))
+        if other_user_id != user_id and similarity >= min_similarity:
+            similar_users.append((-similarity, row, other_user_id))
+
+    return [user for (_, _, user) in sorted(similar_users)]
+
+
+def test_similar_users_match_brute_force(app):
+    lead_matrix = lead_matrix_index.get()
+
+    for user_id in lead_matrix.users(np.arange(0, lead_matrix.number_of_users, 400)):
+        expected = brute_force_similar_users(lead_matrix, user_id)
+
+        assert find_similar_users(user_id).tolist() == expected
+        assert find_similar_users(user_id, max_neighbours=10).tolist() == expected[:10]
+        assert find_similar_users(user_id, min_similarity=2).tolist() == \
+            brute_force_similar_users(lead_matrix, user_id, min_similarity=2)
+
+
+def test_unknown_user_has_no_similar_users(app):
+    assert len(find_similar_users('unknown-user')) == 0
+    assert len(find_similar_users('unknown-user', max_neighbours=10)) == 0
+
+
+
+def test_unknown_user_has_no_recommendations(app):
+    recommender = Recommender()
+    recommender.make_recommendations_for_user('unknown-user')
+
+    assert recommender.by_user == {}
+
+
+def test_neighbour_courses_are_read_with_a_single_query(app, monkeypatch):
+    user_id = lead_matrix_index.get().users([7])[0]
+    course_repository = CourseRepository()
+    user_course_ids = set(course_repository.find_requested_by_user(user_id))
+    expected = {course_id for similar_user_id in find_similar_users(user_id, max_neighbours=50)
+                for course_id in course_repository.find_requested_by_user(similar_user_id)} - user_course_ids
+    lookups = []
+    find_requested_by_users = CourseRepository.find_requested_by_users
+
+    def counted_find_requested_by_users(repository, user_ids):
+        lookups.append(len(user_ids))
+        return find_requested_by_users(repository, user_ids)
+
+    monkeypatch.setattr(CourseRepository, 'find_requested_by_users', counted_find_requested_by_users)
+
+    everything = Recommender().make_recommendations_for_user(user_id, max_recommendations=len(expected) + 1).by_user
+    first = Recommender().make_recommendations_for_user(user_id, max_recommendations=5).by_user
+
+    assert len(lookups) == 2 and lookups[0] > 1
+    assert set(everything) == expected
+    assert len(first) == 5 and set(first) <= expected
+
+def test_course_page_ranks_match_the_listings(app):
+    course_repository = CourseRepository()
+
+    for category_id in [None, 2]:
+        recommendations = course_repository.find_course_recommendations('3', category_id)
+        by_rating = course_repository.find_sorted_by_rating(category=category_id, max_rows=10, exclude='3')
+        by_leads = course_repository.find_sorted_by_leads(category=category_id, max_rows=10, exclude='3')
+
+        assert list(recommendations['by_rating']) == list(by_rating)
+        assert list(recommendations['by_number_of_leads']) == list(by_leads)
+
+
+def test_course_page_ranks_use_the_thresholds(app):
+    recommendations = CourseRepository().find_course_recommendations('3', max_rows=200, min_number_of_leads=0,
+                                                                     min_weighted_rating=0)
+    listed = CourseRepository().find_all_by(min_number_of_leads=0, min_weighted_rating=0, exclude='3')
+
+    assert sorted(recommendations['by_rating']) == sorted(listed)
+    assert len(recommendations['by_rating']) > len(CourseRepository().find_all_by(exclude='3'))
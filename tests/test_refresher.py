@@ -0,0 +1,111 @@
+import time
+import shutil
+import threading
+import pytest
+from app import lead_matrix_index
+from app.lead_delta import lead_delta
+from app.main.use_cases import hash_user_email
+from app.models import CourseRepository, UserRecommendationRepository
+from app.recommender import Recommender
+from app.refresher import recommendation_refresher
+
+
+@pytest.fixture
+def store_app(make_app, dataset, tmp_path):
+    """Application serving stored recommendations, over a copy of the dataset database. New leads are laid over the
+        lead matrix, so new users have similar users"""
+    path = str(tmp_path / 'store.sqlite')
+    shutil.copy(dataset.database_file, path)
+
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(path), RECOMMENDATIONS_STORE_ENABLED=True,
+                   LEAD_DELTA_ENABLED=True, LEAD_DELTA_COMPACT_INTERVAL=3600, LEAD_DELTA_COMPACT_SIZE=10 ** 6)
+
+    with app.app_context():
+        UserRecommendationRepository().create_table()
+        yield app
+
+    lead_delta._pairs = []
+    lead_delta._courses = {}
+
+
+def wait_for_queue():
+    deadline = time.time() + 10
+    while recommendation_refresher.pending > 0 or recommendation_refresher._refresh_lock.locked():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_information_requests_do_not_wait_for_the_refresh(store_app, monkeypatch):
+    refresh = Recommender.refresh_recommendations_for_user
+    released = threading.Event()
+
+    def blocked_refresh(self, *args, **kwargs):
+        released.wait(10)
+        return refresh(self, *args, **kwargs)
+
+    monkeypatch.setattr(Recommender, 'refresh_recommendations_for_user', blocked_refresh)
+    user_id = hash_user_email('refreshed@example.com')
+
+    response = store_app.test_client().post('/request-information',
+                                            data={'email': 'refreshed@example.com', 'courseId': '3'})
+
+    assert response.status_code == 200
+    assert UserRecommendationRepository().find_by_user(user_id) == {}
+
+    released.set()
+    wait_for_queue()
+    stored = UserRecommendationRepository().find_by_user(user_id)
+
+    assert len(stored) > 0
+    assert '3' not in stored
+
+
+def test_queued_refreshes_of_a_user_are_merged(store_app):
+    user_id, other_user_id = lead_matrix_index.get().users([7, 8])
+
+    with recommendation_refresher._refresh_lock:
+        recommendation_refresher.enqueue(user_id, ['3'])
+        recommendation_refresher.enqueue(user_id, ['4'])
+        recommendation_refresher.enqueue(other_user_id, ['5'])
+
+        assert list(recommendation_refresher._queue.items()) == [(user_id, {'3', '4'}), (other_user_id, {'5'})]
+
+    wait_for_queue()
+    stored = UserRecommendationRepository().find_by_user(user_id)
+
+    assert len(stored) > 0
+    assert '3' not in stored and '4' not in stored
+    assert len(UserRecommendationRepository().find_by_user(other_user_id)) > 0
+
+
+def test_recommendations_of_several_users_are_stored_at_once(store_app):
+    user_ids = lead_matrix_index.get().users([7, 8, 9]).tolist()
+    repository = UserRecommendationRepository()
+    repository.save(user_ids[0], ['1', '2'])
+
+    recommendations = Recommender().make_recommendations_for_users(user_ids, max_recommendations=5)
+    repository.save_many({user_id: list(courses.keys()) for (user_id, courses) in recommendations.items()})
+
+    for user_id in user_ids:
+        assert len(recommendations[user_id]) > 0
+        assert list(repository.find_by_user(user_id).keys()) == list(recommendations[user_id].keys())
+
+
+def test_stored_recommendations_are_served_with_a_single_read(store_app, monkeypatch):
+    user_id = lead_matrix_index.get().users([7])[0]
+    UserRecommendationRepository().save(user_id, ['1', '2'])
+
+    def unexpected_read(self, user_id):
+        raise AssertionError('The courses of the user must not be read')
+
+    monkeypatch.setattr(CourseRepository, 'find_requested_by_user', unexpected_read)
+    recommender = Recommender().make_recommendations_for_user(user_id)
+
+    assert list(recommender.by_user.keys()) == ['1', '2']
+    assert recommender.user_courses == {}
+
+    monkeypatch.undo()
+    recommender = Recommender().make_recommendations_for_user(user_id, with_user_courses=True)
+
+    assert list(recommender.by_user.keys()) == ['1', '2']
+    assert len(recommender.user_courses) > 0
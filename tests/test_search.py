@@ -0,0 +1,44 @@
+from app import db
+from app.catalog import CatalogIndex
+from app.models import CourseRepository
+from app.main.use_cases import SearchCourses, SearchCoursesCommand
+
+
+def test_courses_that_are_not_listed_are_found(app):
+    listed = CourseRepository().find_all_by()
+    course_id, title = db.engine.execute('SELECT id, title FROM courses WHERE weighted_rating < 7.0 '
+                                         'ORDER BY id LIMIT 1').first()
+
+    assert course_id not in listed
+
+    # Titles start with the course number, which no other title or description contains
+    number = title.split()[1]
+    courses = SearchCourses.execute(SearchCoursesCommand('course {}'.format(number)))['courses']
+
+    assert list(courses)[0] == course_id
+
+
+def test_every_course_is_indexed(app):
+    number_of_courses = db.engine.execute('SELECT COUNT(*) FROM courses').scalar()
+
+    assert CatalogIndex.load_search().search_index.number_of_courses == number_of_courses
+
+
+def test_suggestions_match_prefixes(client):
+    course_id, title = db.engine.execute("SELECT id, title FROM courses WHERE id = '7'").first()
+    word = title.split()[2]
+
+    response = client.get('/search/suggest', query_string={'q': 'course 7 ' + word[:3]})
+
+    assert response.status_code == 200
+    assert response.get_json()[0]['id'] == course_id
+
+
+def test_search_page_lists_the_results(client):
+    course_id, title = db.engine.execute("SELECT id, title FROM courses WHERE id = '12'").first()
+
+    response = client.get('/search', query_string={'q': title})
+
+    assert response.status_code == 200
+    assert '/course/{}'.format(course_id).encode() in response.data
+    assert client.get('/search', query_string={'q': 'zzzzzz'}).status_code == 200